@@ -0,0 +1,70 @@
+"""
+list APIのJSON encodeを比較する（response_model検証 + jsonable_encoder と fast_response）
+
+    python -m commands.benchmark_json --rows 1000 --repeat 50
+"""
+import time
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from fastapi.responses import JSONResponse
+from fastapi_pagination import Page, Params
+from sqlalchemy.engine.result import result_tuple
+
+from routers.stock import schemas
+from routers.utils.fast_json import FastJSONResponse, project
+
+
+# stock_crud.get_stocksと同じcolumnのRow
+STOCKS_COLUMNS = ["id", "title", "views", "created_at", "writer", "like_cnt", "notice_comment_cnt"]
+
+
+def make_page(rows: int):
+    make_row = result_tuple(STOCKS_COLUMNS)
+    now = datetime.utcnow()
+    items = [make_row((i, f"title {i}", i * 3, now - timedelta(minutes=i), f"writer{i % 97}", i % 13, i % 7))
+            for i in range(rows, 0, -1)]
+    # Paramsのsizeは100までなので検証せずに作る
+    return Page.create(items=items, total=rows * 10, params=Params.construct(page=1, size=rows))
+
+
+async def pydantic_path(field, page):
+    content = await serialize_response(field=field, response_content=page, is_coroutine=True)
+    return JSONResponse(content=content).body
+
+
+def fast_path(page):
+    content = {**dict(page), "items": [project(schemas.Stocks, row) for row in page.items]}
+    return FastJSONResponse(content=content).body
+
+
+async def run(rows: int, repeat: int):
+    page = make_page(rows)
+    field = create_response_field(name="Response_get_stocks", type_=Page[schemas.Stocks])
+
+    results = {}
+    for name, encode in [("response_model", lambda: pydantic_path(field, page))
+                        , ("fast_response", lambda: asyncio.sleep(0, fast_path(page)))]:
+        body = await encode()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await encode()
+        seconds = (time.perf_counter() - started) / repeat
+        results[name] = seconds
+        print(f"{name:15s} {seconds * 1000:8.2f} ms/page  {len(body)} bytes")
+    print(f"speedup         {results['response_model'] / results['fast_response']:8.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON response encoding benchmark")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args(argv)
+    asyncio.run(run(rows=args.rows, repeat=args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+為替レートをCURRENCY_DATに一括登録する
+
+    python -m commands.ingest_rates rates.csv [rates2.csv ...] [--batch-size 5000]
+
+CSV header: currency_to,currency_from,price,inc_dec,inc_dec_per,created_at
+"""
+import argparse
+import logging
+
+from db.config import settings
+from db.session import SessionLocal
+from routers.utils.currency_ingest import CsvFileSource, CurrencyRateIngester
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CURRENCY_DAT bulk ingestion")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=settings.CURRENCY_INGEST_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    db = SessionLocal()
+    try:
+        ingester = CurrencyRateIngester(db=db, batch_size=args.batch_size)
+        for path in args.paths:
+            result = ingester.ingest(CsvFileSource(path))
+            print(f"{path}: {result['inserted']} rows inserted, {result['skipped']} skipped"
+                  f" in {result['seconds']}s ({result['rows_per_sec']} rows/sec)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+db/migrationsのSQLを順番に適用する（適用したversionはSCHEMA_MIGRATIONに記録する）
+workerの起動時にはschemaを変更しないので、deploy時にworkerを起動する前に実行する
+
+    python -m commands.migrate              # 未適用のmigrationを適用する
+    python -m commands.migrate --list       # 適用状況を表示する
+    python -m commands.migrate --fake       # 手動で適用済みのDBで、未適用のmigrationを適用済みとして記録する
+"""
+import os
+import argparse
+from datetime import datetime
+
+from sqlalchemy import text
+
+from db.session import engine
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db", "migrations")
+
+
+def get_migrations():
+    return sorted(name[:-len(".sql")] for name in os.listdir(MIGRATIONS_DIR) if name.endswith(".sql"))
+
+
+# コメント行を除いて、行末の;で文を分ける（triggerもBEGIN ... ENDなしの1文で書く）
+def read_statements(version: str):
+    with open(os.path.join(MIGRATIONS_DIR, version + ".sql"), encoding="utf-8") as f:
+        lines = [line for line in f.read().splitlines() if not line.strip().startswith("--")]
+    statements, current = [], []
+    for line in lines:
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statements.append("\n".join(current).strip().rstrip(";"))
+            current = []
+    if "\n".join(current).strip():
+        statements.append("\n".join(current).strip())
+    return statements
+
+
+def get_applied(conn):
+    conn.execute(text("CREATE TABLE IF NOT EXISTS SCHEMA_MIGRATION ("
+                    "version VARCHAR(255) NOT NULL PRIMARY KEY, "
+                    "applied_at TIMESTAMP NOT NULL)"))
+    return {row.version: row.applied_at for row in conn.execute(text("SELECT version, applied_at FROM SCHEMA_MIGRATION"))}
+
+
+def record(conn, version: str):
+    conn.execute(text("INSERT INTO SCHEMA_MIGRATION (version, applied_at) VALUES (:version, :applied_at)")
+                , {"version": version, "applied_at": datetime.utcnow()})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply db/migrations")
+    parser.add_argument("--list", action="store_true")
+    parser.add_argument("--fake", action="store_true")
+    args = parser.parse_args(argv)
+
+    with engine.begin() as conn:
+        applied = get_applied(conn)
+    pending = [version for version in get_migrations() if version not in applied]
+
+    if args.list:
+        for version in get_migrations():
+            print(f"{version}: {applied[version] if version in applied else 'pending'}")
+        return
+
+    for version in pending:
+        # MySQLのDDLは暗黙的にcommitされるので、失敗した場合は途中まで適用された状態になる
+        with engine.begin() as conn:
+            if not args.fake:
+                for statement in read_statements(version):
+                    conn.exec_driver_sql(statement)
+            record(conn, version)
+        print(f"{version}: {'faked' if args.fake else 'applied'}")
+
+    if not pending:
+        print("No pending migrations")
+
+
+if __name__ == "__main__":
+    main()
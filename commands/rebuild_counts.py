@@ -0,0 +1,21 @@
+"""
+投稿のLike, Hate, Comment Countを投票・コメントデータから再集計する
+
+    python -m commands.rebuild_counts
+"""
+from db.session import SessionLocal
+from routers.utils import notice_crud, stock_crud
+
+
+def main():
+    db = SessionLocal()
+    try:
+        notice_cnt = notice_crud.rebuild_notice_counts(db=db)
+        stock_cnt = stock_crud.rebuild_stock_counts(db=db)
+    finally:
+        db.close()
+    print(f"NOTICE_DETAIL_DAT: {notice_cnt} rows, STOCK_DETAIL_DAT: {stock_cnt} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+"""
+通貨ペアごとの最新レート(CURRENCY_LATEST_DAT)をCURRENCY_DATから再作成する
+
+    python -m commands.rebuild_latest_rates
+"""
+from db.session import SessionLocal
+from routers.utils import finance_crud
+
+
+def main():
+    db = SessionLocal()
+    try:
+        cnt = finance_crud.refresh_latest_rates(db=db)
+    finally:
+        db.close()
+    print(f"CURRENCY_LATEST_DAT: {cnt} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,8 +10,66 @@ class Settings:
     DB_HOST: str = os.getenv("DB_HOST", "localhost")
     DB_PORT: str = os.getenv("DB_PORT", 3306)
     DB_DATABASE: str = os.getenv("DB_DATABASE")
+    ASYNC_DB_DATABASE: str = os.getenv("ASYNC_DB_DATABASE", "mysql+aiomysql")
     DB_NAME: str = os.getenv("DB_NAME")
 
     DATABASE_URL = '{}://{}:{}@{}:{}/{}'.format(DB_DATABASE, DB_USERNAME, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME)
+    ASYNC_DATABASE_URL = '{}://{}:{}@{}:{}/{}'.format(ASYNC_DB_DATABASE, DB_USERNAME, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME)
+
+    # read replica（"host:port"をカンマ区切りで指定、未指定の場合はprimaryから読む）
+    DB_REPLICA_HOSTS: list = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+    # 書き込んだユーザーは、この秒数の間primaryから読む
+    DB_READ_YOUR_WRITES_SECONDS: float = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", 5))
+
+    # connection pool設定（workerごと）
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", 3600))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", 30))
+
+    VIEW_COUNT_FLUSH_INTERVAL: float = float(os.getenv("VIEW_COUNT_FLUSH_INTERVAL", 5))
+    VIEW_COUNT_FLUSH_SIZE: int = int(os.getenv("VIEW_COUNT_FLUSH_SIZE", 1000))
+
+    MENU_CACHE_TTL: float = float(os.getenv("MENU_CACHE_TTL", 30))
+
+    # 株掲示板のhot ranking（scoreの半減期, 掲示板ごとの件数, DBから作り直す間隔）
+    HOT_RANKING_HALF_LIFE_HOURS: float = float(os.getenv("HOT_RANKING_HALF_LIFE_HOURS", 6))
+    HOT_RANKING_TOP_N: int = int(os.getenv("HOT_RANKING_TOP_N", 500))
+    HOT_RANKING_REFRESH_INTERVAL: float = float(os.getenv("HOT_RANKING_REFRESH_INTERVAL", 60))
+
+    # 検証済みaccess tokenのcache（件数, 最大保持秒数）
+    TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+    TOKEN_CACHE_TTL: float = float(os.getenv("TOKEN_CACHE_TTL", 300))
+
+    # password hash（bcrypt cost, 専用thread数(0はCPU数), 空きを待つ最大秒数）
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", 12))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", 0))
+    PASSWORD_HASH_QUEUE_TIMEOUT: float = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", 5))
+
+    # username, email重複チェック用Bloom filter
+    USER_FILTER_CAPACITY: int = int(os.getenv("USER_FILTER_CAPACITY", 1000000))
+    USER_FILTER_ERROR_RATE: float = float(os.getenv("USER_FILTER_ERROR_RATE", 0.01))
+    USER_FILTER_SYNC_INTERVAL: float = float(os.getenv("USER_FILTER_SYNC_INTERVAL", 10))
+    # syncで読み直す秒数（commitの遅れ, worker間の時計のずれより長くする）
+    USER_FILTER_SYNC_OVERLAP: float = float(os.getenv("USER_FILTER_SYNC_OVERLAP", 300))
+    USER_FILTER_BUILD_BATCH_SIZE: int = int(os.getenv("USER_FILTER_BUILD_BATCH_SIZE", 10000))
+
+    # list, detail APIのレスポンスをresponse_modelの検証なしでorjsonでencodeする
+    FAST_JSON_RESPONSE: bool = os.getenv("FAST_JSON_RESPONSE", "false").lower() == "true"
+
+    # /metrics（route templateごとのlatency histogram, SQL件数）
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # gunicornの全workerを合計する場合の共有ディレクトリ（未指定の場合はworkerごとにpid labelを付ける）
+    METRICS_MULTIPROC_DIR: str = os.getenv("METRICS_MULTIPROC_DIR", "")
+    METRICS_FLUSH_INTERVAL: float = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+    OHLCV_CACHE_DIR: str = os.getenv("OHLCV_CACHE_DIR", ".cache/ohlcv")
+    # 当日分の株価をメモリに保持する秒数
+    OHLCV_TODAY_TTL: float = float(os.getenv("OHLCV_TODAY_TTL", 60))
+
+    CURRENCY_INGEST_BATCH_SIZE: int = int(os.getenv("CURRENCY_INGEST_BATCH_SIZE", 5000))
+    # 為替レート履歴APIのレスポンス最大点数（超える場合はLTTBで間引く）
+    CURRENCY_HISTORY_MAX_POINTS: int = int(os.getenv("CURRENCY_HISTORY_MAX_POINTS", 1000))
 
 settings = Settings()
@@ -1,4 +1,10 @@
-from db.session import SessionLocal
+import time
+
+from fastapi import Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.config import settings
+from db.session import SessionLocal, AsyncSessionLocal, get_replica_engine
 
 def get_db():
     try:
@@ -6,3 +12,82 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# 書き込み後にprimaryから読む期限（unix時刻）。cookieとresponse headerで返し、clientはどちらかで送り返す
+# workerやserverを跨いでも、tokenを更新しても同じclientはprimaryから読む
+READ_PRIMARY_COOKIE = "read_primary_until"
+READ_PRIMARY_HEADER = "X-Read-Primary-Until"
+
+
+def read_primary_until(request: Request):
+    value = request.cookies.get(READ_PRIMARY_COOKIE) or request.headers.get(READ_PRIMARY_HEADER)
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+# read-your-writesの期間中か（clientが送る値なので、windowより先の期限は無視する）
+def is_recent_writer(request: Request):
+    now = time.time()
+    return now < read_primary_until(request) <= now + settings.DB_READ_YOUR_WRITES_SECONDS
+
+
+# 書き込みを行うrouteのdependencies（閲覧数の加算や重複チェックなど、読み返さない処理には付けない）
+def mark_written(request: Request):
+    request.state.read_your_writes = True
+
+
+class ReadYourWritesMiddleware():
+    """
+    mark_writtenを付けたrouteが成功した場合、read-your-writesの期限をcookieとheaderで返す
+    （routeがResponseを直接返す場合もheaderを追加できるようにASGI middlewareにする）
+    """
+
+    def __init__(self, app, window: float):
+        self.app = app
+        self.window = window
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            # request.stateはscope["state"]に保持される
+            if message["type"] == "http.response.start" and message["status"] < 400 \
+                    and scope.get("state", {}).get("read_your_writes"):
+                until = f"{time.time() + self.window:.3f}"
+                cookie = f"{READ_PRIMARY_COOKIE}={until}; Max-Age={int(self.window) + 1}; Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = [*message.get("headers", [])
+                                    , (b"set-cookie", cookie.encode("latin-1"))
+                                    , (READ_PRIMARY_HEADER.lower().encode("latin-1"), until.encode("latin-1"))]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# read replicaから読む（直前に書き込んだclientはprimaryから読む）
+# 閲覧数の加算、重複チェックなどGET以外でも読み込みだけのrouteで使う
+async def get_replica_db(request: Request, db: AsyncSession = Depends(get_async_db)):
+    if is_recent_writer(request):
+        yield db
+        return
+    async with AsyncSessionLocal(bind=get_replica_engine()) as replica_db:
+        yield replica_db
+
+
+# 読み込み専用routeはread replicaから読む
+# （GET以外のrequestは書き込み前の確認に使うので、primaryから読む）
+async def get_read_db(request: Request, db: AsyncSession = Depends(get_async_db)):
+    if request.method != "GET" or is_recent_writer(request):
+        yield db
+        return
+    async with AsyncSessionLocal(bind=get_replica_engine()) as replica_db:
+        yield replica_db
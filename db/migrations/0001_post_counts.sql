@@ -0,0 +1,11 @@
+-- 投稿のLike, Hate, Comment Countカラム追加
+-- 追加後、python -m commands.rebuild_counts で既存データを再集計する
+ALTER TABLE NOTICE_DETAIL_DAT
+    ADD COLUMN like_cnt INT NOT NULL DEFAULT 0 AFTER views,
+    ADD COLUMN hate_cnt INT NOT NULL DEFAULT 0 AFTER like_cnt,
+    ADD COLUMN comment_cnt INT NOT NULL DEFAULT 0 AFTER hate_cnt;
+
+ALTER TABLE STOCK_DETAIL_DAT
+    ADD COLUMN like_cnt INT NOT NULL DEFAULT 0 AFTER views,
+    ADD COLUMN hate_cnt INT NOT NULL DEFAULT 0 AFTER like_cnt,
+    ADD COLUMN comment_cnt INT NOT NULL DEFAULT 0 AFTER hate_cnt;
@@ -0,0 +1,35 @@
+-- 通貨ペアごとの最新レートsnapshotテーブル追加
+-- /finance/main はCURRENCY_DATの全履歴ではなくこのテーブル（通貨ペア数分の行）を参照する
+ALTER TABLE CURRENCY_DAT
+    ADD INDEX ix_currency_dat_pair_id (currency_to, currency_from, id);
+
+CREATE TABLE CURRENCY_LATEST_DAT (
+    currency_to INT NOT NULL,
+    currency_from INT NOT NULL,
+    currency_dat_id INT NOT NULL,
+    inc_dec VARCHAR(255) NULL,
+    inc_dec_per VARCHAR(255) NULL,
+    price DECIMAL(20, 6) NULL,
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (currency_to, currency_from),
+    FOREIGN KEY (currency_to) REFERENCES CURRENCY_MST (id),
+    FOREIGN KEY (currency_from) REFERENCES CURRENCY_MST (id),
+    FOREIGN KEY (currency_dat_id) REFERENCES CURRENCY_DAT (id)
+);
+
+-- CURRENCY_DATにINSERTされたレートがより新しい場合のみsnapshotを更新する
+-- （ON DUPLICATE KEY UPDATEは左から順に評価されるため、currency_dat_idは最後に更新する）
+CREATE TRIGGER trg_currency_dat_latest AFTER INSERT ON CURRENCY_DAT
+FOR EACH ROW
+    INSERT INTO CURRENCY_LATEST_DAT
+        (currency_to, currency_from, currency_dat_id, inc_dec, inc_dec_per, price, created_at)
+    VALUES
+        (NEW.currency_to, NEW.currency_from, NEW.id, NEW.inc_dec, NEW.inc_dec_per, NEW.price, NEW.created_at)
+    ON DUPLICATE KEY UPDATE
+        inc_dec = IF(NEW.id > currency_dat_id, NEW.inc_dec, inc_dec),
+        inc_dec_per = IF(NEW.id > currency_dat_id, NEW.inc_dec_per, inc_dec_per),
+        price = IF(NEW.id > currency_dat_id, NEW.price, price),
+        created_at = IF(NEW.id > currency_dat_id, NEW.created_at, created_at),
+        currency_dat_id = GREATEST(NEW.id, currency_dat_id);
+
+-- 追加後、python -m commands.rebuild_latest_rates で既存データからsnapshotを作成する
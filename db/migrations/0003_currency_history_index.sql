@@ -0,0 +1,3 @@
+-- 為替レート履歴API（通貨ペア + created_atの期間検索）用index
+ALTER TABLE CURRENCY_DAT
+    ADD INDEX ix_currency_dat_pair_created_at (currency_to, currency_from, created_at);
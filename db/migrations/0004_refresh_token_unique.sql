@@ -0,0 +1,9 @@
+-- USER_REFRESH_TOKENをusernameごとに1行にする（loginは INSERT ... ON DUPLICATE KEY UPDATE の1回で保存する）
+-- 重複している場合は最新の行だけを残す
+DELETE t FROM USER_REFRESH_TOKEN t
+    JOIN USER_REFRESH_TOKEN newer
+        ON newer.username = t.username
+        AND newer.refresh_token_id > t.refresh_token_id;
+
+ALTER TABLE USER_REFRESH_TOKEN
+    ADD UNIQUE INDEX ux_user_refresh_token_username (username);
@@ -0,0 +1,6 @@
+-- 掲示板検索用FULLTEXT index（日本語・韓国語のためngram parser、token sizeはngram_token_size=2）
+ALTER TABLE NOTICE_DETAIL_DAT
+    ADD FULLTEXT INDEX ft_notice_detail_title_content (title, content) WITH PARSER ngram;
+
+ALTER TABLE STOCK_DETAIL_DAT
+    ADD FULLTEXT INDEX ft_stock_detail_title_content (title, content) WITH PARSER ngram;
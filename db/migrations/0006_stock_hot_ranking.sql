@@ -0,0 +1,6 @@
+-- 株掲示板hot ranking用index（直近のコメント・Likeを定期的に読み込む）
+ALTER TABLE STOCK_DETAIL_COMMENT_DAT
+    ADD INDEX ix_stock_detail_comment_created_at (created_at);
+
+ALTER TABLE STOCK_DETAIL_VOTE_DAT
+    ADD INDEX ix_stock_detail_vote_updated_at (updated_at);
@@ -0,0 +1,6 @@
+-- コメントリストのkeyset paging（post_id, id）用index
+ALTER TABLE NOTICE_DETAIL_COMMENT_DAT
+    ADD INDEX ix_notice_detail_comment_notice_id_id (notice_id, id);
+
+ALTER TABLE STOCK_DETAIL_COMMENT_DAT
+    ADD INDEX ix_stock_detail_comment_stock_id_id (stock_id, id);
@@ -0,0 +1,54 @@
+-- 投票を(投稿, ユーザー)ごとに1行にする（INSERT ... ON DUPLICATE KEY UPDATE の1回で保存する）
+-- 重複している場合は最新の行だけを残す
+DELETE v FROM NOTICE_DETAIL_VOTE_DAT v
+    JOIN NOTICE_DETAIL_VOTE_DAT newer
+        ON newer.notice_id = v.notice_id
+        AND newer.user_id = v.user_id
+        AND newer.id > v.id;
+
+DELETE v FROM STOCK_DETAIL_VOTE_DAT v
+    JOIN STOCK_DETAIL_VOTE_DAT newer
+        ON newer.stock_id = v.stock_id
+        AND newer.user_id = v.user_id
+        AND newer.id > v.id;
+
+ALTER TABLE NOTICE_DETAIL_VOTE_DAT
+    ADD UNIQUE INDEX ux_notice_detail_vote_notice_id_user_id (notice_id, user_id);
+
+ALTER TABLE STOCK_DETAIL_VOTE_DAT
+    ADD UNIQUE INDEX ux_stock_detail_vote_stock_id_user_id (stock_id, user_id);
+
+-- 投票のINSERT・UPDATE時に投稿のlike_cnt, hate_cntを更新する（updated_atは変えない）
+CREATE TRIGGER trg_notice_vote_insert AFTER INSERT ON NOTICE_DETAIL_VOTE_DAT
+FOR EACH ROW
+    UPDATE NOTICE_DETAIL_DAT
+        SET like_cnt = like_cnt + (NEW.`like` <> 0),
+            hate_cnt = hate_cnt + (NEW.hate <> 0),
+            updated_at = updated_at
+        WHERE id = NEW.notice_id;
+
+CREATE TRIGGER trg_notice_vote_update AFTER UPDATE ON NOTICE_DETAIL_VOTE_DAT
+FOR EACH ROW
+    UPDATE NOTICE_DETAIL_DAT
+        SET like_cnt = like_cnt + (NEW.`like` <> 0) - (OLD.`like` <> 0),
+            hate_cnt = hate_cnt + (NEW.hate <> 0) - (OLD.hate <> 0),
+            updated_at = updated_at
+        WHERE id = NEW.notice_id;
+
+CREATE TRIGGER trg_stock_vote_insert AFTER INSERT ON STOCK_DETAIL_VOTE_DAT
+FOR EACH ROW
+    UPDATE STOCK_DETAIL_DAT
+        SET like_cnt = like_cnt + (NEW.`like` <> 0),
+            hate_cnt = hate_cnt + (NEW.hate <> 0),
+            updated_at = updated_at
+        WHERE id = NEW.stock_id;
+
+CREATE TRIGGER trg_stock_vote_update AFTER UPDATE ON STOCK_DETAIL_VOTE_DAT
+FOR EACH ROW
+    UPDATE STOCK_DETAIL_DAT
+        SET like_cnt = like_cnt + (NEW.`like` <> 0) - (OLD.`like` <> 0),
+            hate_cnt = hate_cnt + (NEW.hate <> 0) - (OLD.hate <> 0),
+            updated_at = updated_at
+        WHERE id = NEW.stock_id;
+
+-- 追加後、python -m commands.rebuild_counts で重複を削除した投稿のcountを再集計する
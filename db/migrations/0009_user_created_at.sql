@@ -0,0 +1,3 @@
+-- username, email重複チェック用Bloom filterのsync（created_atの直近の範囲を読み直す）用
+ALTER TABLE USER
+    ADD INDEX ix_user_created_at (created_at);
@@ -0,0 +1,61 @@
+import time
+import threading
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+
+class PoolStatsMixin():
+    """
+    connection取得時の待ち時間を記録するQueuePool
+    """
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._stats_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeout_count = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self._stats_lock:
+                self.timeout_count += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            with self._stats_lock:
+                self.wait_count += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+    def stats(self):
+        with self._stats_lock:
+            wait_count = self.wait_count
+            wait_total = self.wait_total
+            wait_max = self.wait_max
+            timeout_count = self.timeout_count
+        return {
+            'pool_size': self.size(),
+            'checked_out': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'max_overflow': self._max_overflow,
+            'timeout': self.timeout(),
+            'wait_count': wait_count,
+            'wait_avg_ms': round(wait_total / wait_count * 1000, 3) if wait_count else 0.0,
+            'wait_max_ms': round(wait_max * 1000, 3),
+            'timeout_count': timeout_count,
+        }
+
+
+class StatsQueuePool(PoolStatsMixin, QueuePool):
+    pass
+
+
+class StatsAsyncAdaptedQueuePool(PoolStatsMixin, AsyncAdaptedQueuePool):
+    pass
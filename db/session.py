@@ -1,16 +1,50 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from .config import settings
+from .pool import StatsQueuePool, StatsAsyncAdaptedQueuePool
 import sqlalchemy
+import itertools
 
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
+SQLALCHEMY_ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL
+SQLALCHEMY_ASYNC_REPLICA_DATABASE_URLS = ['{}://{}:{}@{}/{}'.format(settings.ASYNC_DB_DATABASE, settings.DB_USERNAME, settings.DB_PASSWORD, host, settings.DB_NAME)
+                                        for host in settings.DB_REPLICA_HOSTS]
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+POOL_OPTIONS = {
+    'pool_size': settings.DB_POOL_SIZE,
+    'max_overflow': settings.DB_MAX_OVERFLOW,
+    'pool_recycle': settings.DB_POOL_RECYCLE,
+    'pool_pre_ping': settings.DB_POOL_PRE_PING,
+    'pool_timeout': settings.DB_POOL_TIMEOUT,
+}
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=StatsQueuePool, **POOL_OPTIONS)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async route handler用（event loopをblockしない）
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=StatsAsyncAdaptedQueuePool, **POOL_OPTIONS)
+
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession)
+
+# 読み込み専用route用のread replica
+replica_engines = [create_async_engine(url, poolclass=StatsAsyncAdaptedQueuePool, **POOL_OPTIONS)
+                    for url in SQLALCHEMY_ASYNC_REPLICA_DATABASE_URLS]
+replica_counter = itertools.count()
+
+
+# 使用中のconnectionが一番少ないreplicaを選ぶ（同じ場合はround robin）
+def get_replica_engine():
+    if not replica_engines:
+        return async_engine
+    start = next(replica_counter) % len(replica_engines)
+    candidates = replica_engines[start:] + replica_engines[:start]
+    return min(candidates, key=lambda replica: replica.sync_engine.pool.checkedout())
+
+
 Base = declarative_base()
 
 metadata = sqlalchemy.MetaData()
@@ -1,14 +1,35 @@
+import time
+import logging
+import importlib
 from fastapi import FastAPI
-from routers.menu import menu
-from routers.auth import auth
-from routers.notice import notice
-from routers.stock import stock
-from routers.faq import faq
-from routers.finance import finance
+from routers.utils.view_counter import view_counter
+from routers.utils.user_filter import user_filter
+from routers.utils.hot_ranking import hot_ranking
+from routers.utils.metrics import metrics, MetricsMiddleware, instrument_engine, CONTENT_TYPE
+from db.config import settings
+from db.session import engine, async_engine, replica_engines
+from db.connection import ReadYourWritesMiddleware, READ_PRIMARY_HEADER
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+# uvicorn, gunicornのworkerで出力されるloggerを使う
+logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI()
 
+
+# routerのimport時間（秒）。先にimportしたrouterの時間には共通moduleのimportも含まれる
+ROUTERS = ["menu", "auth", "notice", "stock", "faq", "finance", "internal"]
+router_import_times = {}
+
+def import_router(name: str):
+    started = time.perf_counter()
+    module = importlib.import_module(f"routers.{name}.{name}")
+    router_import_times[name] = time.perf_counter() - started
+    return module.router
+
+routers = {name: import_router(name) for name in ROUTERS}
+
 origins = [
     'http://localhost:3000',
     'localhost:3000'
@@ -19,12 +40,71 @@ app.add_middleware(
     allow_origins=['*'],
     allow_credentials=True,
     allow_methods=['*'],
-    allow_headers=['*']
+    allow_headers=['*'],
+    expose_headers=[READ_PRIMARY_HEADER]
 )
 
-app.include_router(menu.router, prefix="/app/v1")
-app.include_router(auth.router, prefix="/app/v1")
-app.include_router(notice.router, prefix="/app/v1")
-app.include_router(stock.router, prefix="/app/v1")
-app.include_router(faq.router, prefix="/app/v1")
-app.include_router(finance.router, prefix="/app/v1")
+# mark_writtenを付けたrouteで書き込んだclientはDB_READ_YOUR_WRITES_SECONDSの間primaryから読む（cookie / X-Read-Primary-Until）
+app.add_middleware(ReadYourWritesMiddleware, window=settings.DB_READ_YOUR_WRITES_SECONDS)
+
+# route templateごとのlatency, SQL件数などを集計する（/metrics）
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+    for db_engine in [engine, async_engine, *replica_engines]:
+        instrument_engine(db_engine)
+
+for router in routers.values():
+    app.include_router(router, prefix="/app/v1")
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
+@app.on_event("startup")
+def report_import_times():
+    logger.info("router import times: %s (total %.3fs)"
+                , ", ".join(f"{name}={seconds:.3f}s" for name, seconds in router_import_times.items())
+                , sum(router_import_times.values()))
+
+
+@app.on_event("startup")
+def start_view_counter():
+    view_counter.start()
+
+
+@app.on_event("startup")
+def start_metrics():
+    metrics.start()
+
+
+@app.on_event("startup")
+def start_hot_ranking():
+    hot_ranking.start()
+
+
+@app.on_event("startup")
+def start_user_filter():
+    # USERの全件読み込みを待たずにrequestを受け付ける
+    user_filter.start()
+
+
+@app.on_event("shutdown")
+async def stop_user_filter():
+    await user_filter.stop()
+
+
+@app.on_event("shutdown")
+def stop_metrics():
+    metrics.stop()
+
+
+@app.on_event("shutdown")
+def stop_view_counter():
+    view_counter.stop()
+
+
+@app.on_event("shutdown")
+def stop_hot_ranking():
+    hot_ranking.stop()
@@ -3,34 +3,41 @@ import jwt
 from dotenv import load_dotenv
 from typing import Optional
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 
-from sqlalchemy.orm import Session
-from db.connection import get_db
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.connection import get_async_db, get_replica_db
 
 from fastapi import APIRouter, Depends, Security, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from ..utils import auth_crud
+from ..utils.token_cache import token_cache
+from ..utils.password_hasher import password_hasher
+from ..utils.user_filter import user_filter
 from . import schemas
 
 
 load_dotenv()
 
 class Auth():
-    pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
+    pwd_context = password_hasher.context
     secret_key = os.getenv("SECRET_KEY")
     algorithm = os.getenv("ALGORITHM")
     access_token_expires_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
     refresh_token_expires_hours = int(os.getenv("REFRESH_TOKEN_EXPIRE_HOURS"))
 
     # Passwordをhashする
-    def get_password_hash(self, password: str):
-        return self.pwd_context.hash(password)
+    async def get_password_hash(self, password: str):
+        return await password_hasher.hash(password)
 
     # Passwordを確認する
-    def verify_password(self, plain_password: str, hashed_password: str):
-        return self.pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password: str, hashed_password: str):
+        return await password_hasher.verify(plain_password, hashed_password)
+
+    # Passwordを確認して、bcryptのcostが変わっている場合は新しいhashも返す
+    async def verify_and_update_password(self, plain_password: str, hashed_password: str):
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
 
     def encode_token(self, user: schemas.User):
         payload = {
@@ -48,7 +55,9 @@ class Auth():
         try:
             payload = jwt.decode(token, self.secret_key, self.algorithm)
             if (payload['scope'] == 'access_token'):
-                return {'username' : payload['sub'], 'user_id': payload['user_id']}
+                claims = {'username' : payload['sub'], 'user_id': payload['user_id']}
+                token_cache.set(token, claims, payload['exp'])
+                return claims
             raise HTTPException(status_code=401, detail='Scope for the token is invalid')
         except jwt.ExpiredSignatureError:
             #여기서 새토큰 생ㅅ어?
@@ -86,6 +95,7 @@ class Auth():
 
 auth_handler = Auth()
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 router = APIRouter(
     prefix="/auth",
@@ -93,83 +103,90 @@ router = APIRouter(
     responses={401:{"user": "Not authorized"}}
 )
 
-def get_user(db: Session, username: str):
-    user = auth_crud.get_user(db=db, username=username)
+async def get_user(db: AsyncSession, username: str):
+    user = await auth_crud.get_user(db=db, username=username)
     if user:
         return user
 
 
-def authenticate_user(db: Session, username: str, password: str, sns: Optional[str] = None):
-    user = get_user(db=db, username=username)
+async def authenticate_user(db: AsyncSession, username: str, password: str, sns: Optional[str] = None):
+    user = await get_user(db=db, username=username)
     # userが存在しない場合、Exceptionを発生する
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Incorrect username or password",
                             headers={"WWW-Authenticate": "Bearer"})
     # Passwordが一致しない場合、Exceptionを発生する
-    if not auth_handler.verify_password(plain_password=password, hashed_password=user.password):
+    verified, new_hash = await auth_handler.verify_and_update_password(plain_password=password, hashed_password=user.password)
+    if not verified:
         raise HTTPException(status_code=400, detail="The passwords do not match")
     # mail認証を行なっていない場合、Exceptionを発生する
     if not user.is_active:
         raise HTTPException(status_code=401, detail="Inactive user")
+    # costが変わったhashはlogin成功時に作り直す
+    if new_hash:
+        user = await auth_crud.update_password_hash(db=db, user=user, password=new_hash)
 
     return user
 
 
 @router.post("/signup/duplicate_id_check")
-async def duplicate_id_check(user: schemas.UserInfoCheck, db: Session = Depends(get_db)):
+async def duplicate_id_check(user: schemas.UserInfoCheck, db: AsyncSession = Depends(get_replica_db)):
     """
     <h2>会員登録</h2>
     会員登録する時、usernameを重複チェックする
     """
-    
-    _user = get_user(db=db, username=user.username)
-    if _user:
-        raise HTTPException(status_code=409, detail="username already exists")
+    # Bloom filterにない場合はDBに問い合わせない
+    if await user_filter.might_have_username(db=db, username=user.username):
+        _user = await get_user(db=db, username=user.username)
+        if _user:
+            raise HTTPException(status_code=409, detail="username already exists")
     return {"username": user.username, "result": True}
 
 
 @router.post("/signup/duplicate_email_check")
-async def duplicate_id_check(user: schemas.UserInfoCheck, db: Session = Depends(get_db)):
+async def duplicate_id_check(user: schemas.UserInfoCheck, db: AsyncSession = Depends(get_replica_db)):
     """
     <h2>会員登録</h2>
     会員登録する時、emailを重複チェックする
     """
-    
-    _user = auth_crud.get_user_for_email(db=db, email=user.email)
-    if _user:
-        raise HTTPException(status_code=409, detail="email already exists")
+    # Bloom filterにない場合はDBに問い合わせない
+    if await user_filter.might_have_email(db=db, email=user.email):
+        _user = await auth_crud.get_user_for_email(db=db, email=user.email)
+        if _user:
+            raise HTTPException(status_code=409, detail="email already exists")
     return {"email": user.email, "result": True}
 
 
 @router.post("/signup", response_model=schemas.User)
-async def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     <h2>SignUp</h2>
     会員登録を行う
     """
-    if auth_crud.get_user(db=db, username=user.username) != None:
+    if await auth_crud.get_user(db=db, username=user.username) != None:
         raise HTTPException(status_code=409, detail="username already exists")
 
+    # password暗号化して登録（hash待ちの503はそのまま返す）
+    user.password = await auth_handler.get_password_hash(user.password)
     try:
-        # password暗号化して登録
-        user.password = auth_handler.get_password_hash(user.password)
-        return auth_crud.create_user(db=db, user=user)
-    except:
+        return await auth_crud.create_user(db=db, user=user)
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(status_code=409, detail="username already exists")
 
 
 @router.post("/login", response_model=schemas.Token)
-async def login_for_access_token(login: schemas.Login, db: Session = Depends(get_db)):
+async def login_for_access_token(login: schemas.Login, db: AsyncSession = Depends(get_async_db)):
     """
     <h2>login</h2>
     ユーザーがログインに成功した場合、<b>access token, refresh token</b>を返します。
     """
-    user = authenticate_user(db=db, username=login.username, password=login.password)
+    user = await authenticate_user(db=db, username=login.username, password=login.password)
 
     access_token = auth_handler.encode_token(user=user)
     refresh_token = auth_handler.encode_refresh_token(user=user)
-    auth_crud.update_refresh_token(db=db, username=user.username, refresh_token=refresh_token)
+    await auth_crud.update_refresh_token(db=db, username=user.username, refresh_token=refresh_token)
 
     return {'access_token': access_token, 'refresh_token': refresh_token}
 
@@ -183,48 +200,67 @@ def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security)
 
 def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
     token = credentials.credentials
-    if(auth_handler.decode_token(token)):
-        return auth_handler.decode_token(token)
+    # 検証済みのtokenはcacheから返す
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = auth_handler.decode_token(token)
+    return claims
+
+
+# Loginしていない場合はNoneを返す
+def get_current_user_optional(credentials: Optional[HTTPAuthorizationCredentials] = Security(optional_security)):
+    if credentials is None:
+        return None
+    return get_current_user(credentials)
+
+
+# 管理者（is_staff）のみ
+async def get_current_staff(current_user: dict = Depends(get_current_user)
+                            , db: AsyncSession = Depends(get_async_db)):
+    user = await get_user(db=db, username=current_user['username'])
+    if user is None or not user.is_staff:
+        raise HTTPException(status_code=403, detail="Staff only")
+    return current_user
 
 
 @router.get('/{username}/MyInfo', response_model=schemas.User)
-def get_user_api(username: str
+async def get_user_api(username: str
             , current_user: str = Depends(get_current_user)
-            , db: Session = Depends(get_db)):
+            , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>loginしているユーザー情報</h2>
     """
-    return get_user(db=db, username=username)
+    return await get_user(db=db, username=username)
 
 
 @router.put('/{username}/MyInfo', response_model=schemas.User)
-def get_user_api(username: str
+async def get_user_api(username: str
             , user: schemas.UserUpdate
             , current_user: str = Depends(get_current_user)
-            , db: Session = Depends(get_db)):
+            , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>loginしているユーザー情報更新</h2>
     """
-    return auth_crud.update_user(db=db, username=username, user=user)
+    return await auth_crud.update_user(db=db, username=username, user=user)
 
 
 @router.put('/{username}/pw')
-def update_password_api(username: str
+async def update_password_api(username: str
             , password: schemas.UserPassword
             , current_user: str = Depends(get_current_user)
-            , db: Session = Depends(get_db)):
+            , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>loginしているユーザーPASSWORD変更</h2>
     """
-    user = authenticate_user(db=db, username=username, password=password.oldPassword)
-    user.password = auth_handler.get_password_hash(password.password)
-    return auth_crud.update_password(db=db, user=user)
+    user = await authenticate_user(db=db, username=username, password=password.oldPassword)
+    user.password = await auth_handler.get_password_hash(password.password)
+    return await auth_crud.update_password(db=db, user=user)
 
 
 @router.post("/forgot-password", response_model=schemas.User)
 async def forgot_password(user: schemas.PasswordFind
-                    , db: Session = Depends(get_db)):
-    _user = auth_crud.get_user_for_email(db=db, email=user.email)
+                    , db: AsyncSession = Depends(get_async_db)):
+    _user = await auth_crud.get_user_for_email(db=db, email=user.email)
     if not _user:
         raise HTTPException(status_code=401, detail="登録されているEmailが存在しません。")
     # 認証メール送信
@@ -234,24 +270,24 @@ async def forgot_password(user: schemas.PasswordFind
 
 @router.post("/forgot-password/auth-number", response_model=schemas.User)
 async def forgot_password_authnum(user: schemas.PasswordFind
-                    , db: Session = Depends(get_db)):
-    _user = auth_crud.auth_num_check(db=db, user=user)
+                    , db: AsyncSession = Depends(get_async_db)):
+    _user = await auth_crud.auth_num_check(db=db, user=user)
     if not _user:
         raise HTTPException(status_code=401, detail="認証番号が間違っています。")
     return _user
 
 
 @router.post("/google/callback")
-async def google_login(user: schemas.GoogleLogin, db: Session = Depends(get_db)):
-    _user = auth_crud.get_user_for_email(db=db, email=user.email, sns=user.sns)
+async def google_login(user: schemas.GoogleLogin, db: AsyncSession = Depends(get_async_db)):
+    _user = await auth_crud.get_user_for_email(db=db, email=user.email, sns=user.sns)
     if _user:
-        _user = auth_crud.get_user(db=db, username=_user.username)
         access_token = auth_handler.encode_token(user=_user)
         refresh_token = auth_handler.encode_refresh_token(user=_user)
-        auth_crud.update_refresh_token(db=db, username=_user.username, refresh_token=refresh_token)
+        await auth_crud.update_refresh_token(db=db, username=_user.username, refresh_token=refresh_token)
         return {'access_token': access_token, 'refresh_token': refresh_token}
 
     try:
-        return auth_crud.create_user(db=db, user=user)
-    except:
+        return await auth_crud.create_user(db=db, user=user)
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(status_code=409, detail="username already exists")
@@ -2,13 +2,14 @@ import os
 from typing import List
 from datetime import datetime
 
-from sqlalchemy.orm import Session
-from db.connection import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.connection import get_async_db, get_read_db, mark_written
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 
 from ..auth.auth import get_current_user
 from ..utils import faq_crud
+from ..utils.conditional import make_etag, cache_headers, is_not_modified, not_modified_response
 from . import schemas
 
 
@@ -20,29 +21,36 @@ router = APIRouter(
 
 
 @router.get("", response_model=List[schemas.Faq])
-async def get_faqs(db: Session = Depends(get_db)):
+async def get_faqs(request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
     """
     <h2>QnAを全て表示する</h2>
+    ETag, Last-Modifiedが一致する場合は304を返す
     """
-    return faq_crud.get_faqs(db=db)
+    last_modified, count = await faq_crud.get_faqs_version(db=db)
+    etag = make_etag('faq', last_modified, count)
+    if is_not_modified(request=request, etag=etag, last_modified=last_modified):
+        return not_modified_response(etag=etag, last_modified=last_modified)
 
-@router.post("", response_model=List[schemas.Faq])
-async def create_faq(faq: schemas.FaqBase, db: Session = Depends(get_db)):
+    response.headers.update(cache_headers(etag=etag, last_modified=last_modified))
+    return await faq_crud.get_faqs(db=db)
+
+@router.post("", response_model=List[schemas.Faq], dependencies=[Depends(mark_written)])
+async def create_faq(faq: schemas.FaqBase, db: AsyncSession = Depends(get_async_db)):
     """
     <h2>QnAを登録する</h2>
     """
-    return faq_crud.create_faq(db=db, faq=faq)
+    return await faq_crud.create_faq(db=db, faq=faq)
 
-@router.put("/{faq_id}", response_model=schemas.Faq)
-async def update_faq(faq_id: int, faq: schemas.Faq, db: Session = Depends(get_db)):
+@router.put("/{faq_id}", response_model=schemas.Faq, dependencies=[Depends(mark_written)])
+async def update_faq(faq_id: int, faq: schemas.Faq, db: AsyncSession = Depends(get_async_db)):
     """
     <h2>QnAを更新する</h2>
     """
-    return faq_crud.update_faq(db=db, faq=faq, faq_id=faq_id)
+    return await faq_crud.update_faq(db=db, faq=faq, faq_id=faq_id)
 
-@router.delete("/{faq_id}", response_model=List[schemas.Faq])
-async def delete_faq(faq_id: int, db: Session = Depends(get_db)):
+@router.delete("/{faq_id}", response_model=List[schemas.Faq], dependencies=[Depends(mark_written)])
+async def delete_faq(faq_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     <h2>QnAを削除する</h2>
     """
-    return faq_crud.delete_faq(db=db, faq_id=faq_id)
+    return await faq_crud.delete_faq(db=db, faq_id=faq_id)
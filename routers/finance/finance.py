@@ -1,14 +1,15 @@
 import os
-import FinanceDataReader as fdr
 
-from datetime import datetime
+from datetime import datetime, date, timedelta, timezone
 from typing import Optional, List
 
-from sqlalchemy.orm import Session
-from db.connection import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.config import settings
+from db.connection import get_read_db
 
-from fastapi import APIRouter, Depends, Security, HTTPException, status
+from fastapi import APIRouter, Depends, Security, HTTPException, status, Query
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 
 from ..auth.auth import get_current_user
 from ..utils import finance_crud
@@ -24,10 +25,109 @@ router = APIRouter(
 
 # 為替レートメインページDashBoard
 @router.get("/main", response_model=List[schemas.ExchangeRate_DAT])
-async def get_finance_dat(db: Session = Depends(get_db)):
-    return finance_crud.get_finance_dat(db=db)
+async def get_finance_dat(db: AsyncSession = Depends(get_read_db)):
+    return await finance_crud.get_finance_dat(db=db)
 
 
+# intervalごとのデフォルト期間と最大期間
+HISTORY_DEFAULT_RANGE = {
+    '1m': timedelta(days=1),
+    '1h': timedelta(days=30),
+    '1d': timedelta(days=365),
+}
+HISTORY_MAX_RANGE = {
+    '1m': timedelta(days=7),
+    '1h': timedelta(days=366),
+    '1d': timedelta(days=3660),
+}
+
+
+# numpy, FinanceDataReaderはworker起動時ではなく初めて使う時にimportする
+def build_currency_history(rows, interval: str):
+    import numpy as np
+    from ..utils import resample
+
+    if rows:
+        times, prices = zip(*rows)
+    else:
+        times, prices = (), ()
+    series = resample.resample_ohlc(np.array(times, dtype='datetime64[us]')
+                                    , np.array([np.nan if price is None else price for price in prices], dtype='float64')
+                                    , interval)
+    downsampled = resample.downsample(series, settings.CURRENCY_HISTORY_MAX_POINTS)
+    return downsampled, len(downsampled['time']) < len(series['time'])
+
+
+# DBで集計した日単位のOHLC
+def build_currency_history_daily(rows):
+    import numpy as np
+    from ..utils import resample
+
+    columns = list(zip(*rows)) if rows else [()] * 7
+    series = {'time': np.array([str(day) for day in columns[0]], dtype='datetime64[D]')}
+    for name, values in zip(('open', 'high', 'low', 'close', 'mean'), columns[1:6]):
+        series[name] = np.array([float(value) for value in values], dtype='float64')
+    series['count'] = np.array(columns[6], dtype='int64')
+    downsampled = resample.downsample(series, settings.CURRENCY_HISTORY_MAX_POINTS)
+    return downsampled, len(downsampled['time']) < len(series['time'])
+
+
+# DBの日時はUTC（naive）なので、offset付きの指定はUTCに変換する
+def to_naive_utc(value: Optional[datetime]):
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# 為替レート履歴（interval単位のOHLC）
+@router.get("/history/{currency_from}/{currency_to}", response_model=schemas.CurrencyHistory)
+async def get_currency_history(currency_from: str
+                            , currency_to: str
+                            , interval: str = Query('1h', regex='^(1m|1h|1d)$')
+                            , start: Optional[datetime] = None
+                            , end: Optional[datetime] = None
+                            , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>通貨ペアの為替レート履歴をinterval(1m, 1h, 1d)単位のOHLCで返す</h2>
+    start, end未指定の場合はintervalごとのデフォルト期間、点数が多い場合はLTTBで間引く
+    """
+    end = to_naive_utc(end) or datetime.utcnow()
+    start = to_naive_utc(start) or end - HISTORY_DEFAULT_RANGE[interval]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if end - start > HISTORY_MAX_RANGE[interval]:
+        raise HTTPException(status_code=400, detail=f"range too large for interval {interval} (max {HISTORY_MAX_RANGE[interval].days} days)")
+
+    currency_to_id = await finance_crud.get_currency_id(db=db, currency=currency_to)
+    currency_from_id = await finance_crud.get_currency_id(db=db, currency=currency_from)
+    if currency_to_id is None or currency_from_id is None:
+        raise HTTPException(status_code=404, detail="Currency not found")
+
+    if interval == '1d':
+        rows = await finance_crud.get_currency_history_daily(db=db, currency_to=currency_to_id, currency_from=currency_from_id, start=start, end=end)
+        series, downsampled = await run_in_threadpool(build_currency_history_daily, rows)
+    else:
+        rows = await finance_crud.get_currency_history(db=db, currency_to=currency_to_id, currency_from=currency_from_id, start=start, end=end)
+        series, downsampled = await run_in_threadpool(build_currency_history, rows, interval)
+
+    return {
+        "currency_to": currency_to.upper(),
+        "currency_from": currency_from.upper(),
+        "interval": interval,
+        "start": start,
+        "end": end,
+        "downsampled": downsampled,
+        **{name: values.tolist() for name, values in series.items()},
+        "time": series['time'].astype('datetime64[us]').tolist(),
+    }
+
+
+# 株価（ローカルのcacheにない期間のみFinanceDataReaderから取得する）
 @router.get("/stock")
-async def get_stock_info(db: Session = Depends(get_db)):
-    return fdr.DataReader('7203', '2020-01-01', exchange='TSE')
+async def get_stock_info(ticker: str = '7203'
+                        , exchange: str = 'TSE'
+                        , start: date = date(2020, 1, 1)
+                        , end: Optional[date] = None):
+    from ..utils.ohlcv_cache import ohlcv_cache
+    data = await run_in_threadpool(ohlcv_cache.get, ticker=ticker, exchange=exchange, start=start, end=end)
+    return ohlcv_cache.to_columns(data)
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+from typing import List
 
 
 class ExchangeRate_DAT(BaseModel):
@@ -13,3 +14,19 @@ class ExchangeRate_DAT(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class CurrencyHistory(BaseModel):
+    currency_to: str
+    currency_from: str
+    interval: str
+    start: datetime
+    end: datetime
+    downsampled: bool
+    time: List[datetime]
+    open: List[float]
+    high: List[float]
+    low: List[float]
+    close: List[float]
+    mean: List[float]
+    count: List[int]
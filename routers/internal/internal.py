@@ -0,0 +1,29 @@
+import os
+
+from fastapi import APIRouter, Depends
+
+from db.session import engine, async_engine, replica_engines
+from ..auth.auth import get_current_staff
+
+
+router = APIRouter(
+    prefix="/_internal",
+    tags=["内部"],
+    include_in_schema=False
+)
+
+
+@router.get("/pool")
+async def get_pool_stats(current_user: dict = Depends(get_current_staff)):
+    """
+    <h2>DB connection pool状況</h2>
+    このworkerのconnection poolの使用状況と待ち時間を取得する（管理者のみ）
+    """
+    return {
+        'pid': os.getpid(),
+        'pools': {
+            'sync': engine.pool.stats(),
+            'async': async_engine.sync_engine.pool.stats(),
+        },
+        'replicas': [replica.sync_engine.pool.stats() for replica in replica_engines]
+    }
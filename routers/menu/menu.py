@@ -1,12 +1,13 @@
 import os
 from typing import Optional, List
 
-from sqlalchemy.orm import Session
-from db.connection import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.connection import get_read_db
 
-from fastapi import APIRouter, Depends, Security, HTTPException, status, Body
+from fastapi import APIRouter, Depends, Security, HTTPException, status, Body, Request, Response
 
-from ..utils import menu_crud
+from ..utils.menu_cache import menu_cache
+from ..utils.conditional import make_etag, cache_headers, is_not_modified, not_modified_response
 from . import schemas
 
 
@@ -17,17 +18,17 @@ router = APIRouter(
 )
 
 @router.get("", response_model=List[schemas.MenuMST])
-async def get_menus(db: Session = Depends(get_db)):
-    menu_mst = list()
-    for v in menu_crud.get_menus(db=db):
-        menu_mst.append(
-            schemas.MenuMST(
-                name=v.name
-                , name_sub=v.name_sub
-                , path=v.path
-                , show_order=v.show_order
-                , sub=menu_crud.get_sub_menu(db=db, menu_id=v.id)
-            )
-        )
+async def get_menus(request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>メニューリスト</h2>
+    メニューとサブメニューを取得する（メモリにcacheしたデータを返す）<br/>
+    ETag, Last-Modifiedが一致する場合は304を返す
+    """
+    menus = await menu_cache.get(db=db)
+    last_modified = menu_cache.last_modified()
+    etag = make_etag('menu', *menu_cache.version)
+    if is_not_modified(request=request, etag=etag, last_modified=last_modified):
+        return not_modified_response(etag=etag, last_modified=last_modified)
 
-    return menu_mst
+    response.headers.update(cache_headers(etag=etag, last_modified=last_modified))
+    return menus
@@ -1,5 +1,5 @@
-from db.session import Base, metadata, engine
-from sqlalchemy import Column, ForeignKey, Boolean, Integer, String, DateTime, TIMESTAMP, Numeric
+from db.session import Base
+from sqlalchemy import Column, ForeignKey, Index, Boolean, Integer, String, DateTime, TIMESTAMP, Numeric
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -34,6 +34,11 @@ class USER(Base):
     STOCK_DETAIL_COMMENT_DAT = relationship("STOCK_DETAIL_COMMENT_DAT", back_populates="USER")
     STOCK_DETAIL_VOTE_DAT = relationship("STOCK_DETAIL_VOTE_DAT", back_populates="USER")
 
+    # 重複チェック用Bloom filterのsync用
+    __table_args__ = (
+        Index("ix_user_created_at", "created_at"),
+    )
+
 
 # USER REFRESH TOKEN INFO TABLE
 class USER_REFRESH_TOKEN(Base):
@@ -44,7 +49,7 @@ class USER_REFRESH_TOKEN(Base):
     created_at = Column(TIMESTAMP, default=datetime.utcnow, nullable=False)
     updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     deleted_at = Column(TIMESTAMP, nullable=True)
-    username = Column(Integer, ForeignKey("USER.username"))
+    username = Column(Integer, ForeignKey("USER.username"), unique=True)
 
     USER = relationship("USER", back_populates="USER_REFRESH_TOKEN")
 
@@ -56,6 +61,9 @@ class NOTICE_DETAIL_DAT(Base):
     title = Column(String, nullable=False)
     content = Column(String, nullable=False)
     views = Column(Integer, default=0, nullable=False)
+    like_cnt = Column(Integer, default=0, nullable=False)
+    hate_cnt = Column(Integer, default=0, nullable=False)
+    comment_cnt = Column(Integer, default=0, nullable=False)
     created_at = Column(TIMESTAMP, default=datetime.utcnow, nullable=False)
     updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     deleted_at = Column(TIMESTAMP, nullable=True)
@@ -65,6 +73,11 @@ class NOTICE_DETAIL_DAT(Base):
     NOTICE_DETAIL_COMMENT_DAT = relationship("NOTICE_DETAIL_COMMENT_DAT", back_populates="NOTICE_DETAIL_DAT")
     NOTICE_DETAIL_VOTE_DAT = relationship("NOTICE_DETAIL_VOTE_DAT", back_populates="NOTICE_DETAIL_DAT")
 
+    # 全文検索用（日本語・韓国語のためngram parser）
+    __table_args__ = (
+        Index("ft_notice_detail_title_content", "title", "content", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+    )
+
 # NOTICE COMMENT TABLE
 class NOTICE_DETAIL_COMMENT_DAT(Base):
     __tablename__ = "NOTICE_DETAIL_COMMENT_DAT"
@@ -80,6 +93,11 @@ class NOTICE_DETAIL_COMMENT_DAT(Base):
     USER = relationship("USER", back_populates="NOTICE_DETAIL_COMMENT_DAT")
     NOTICE_DETAIL_DAT = relationship("NOTICE_DETAIL_DAT", back_populates="NOTICE_DETAIL_COMMENT_DAT")
 
+    # コメントリストのkeyset paging用
+    __table_args__ = (
+        Index("ix_notice_detail_comment_notice_id_id", "notice_id", "id"),
+    )
+
 # NOTICE VOTE TABLE
 class NOTICE_DETAIL_VOTE_DAT(Base):
     __tablename__ = "NOTICE_DETAIL_VOTE_DAT"
@@ -95,6 +113,10 @@ class NOTICE_DETAIL_VOTE_DAT(Base):
     USER = relationship("USER", back_populates="NOTICE_DETAIL_VOTE_DAT")
     NOTICE_DETAIL_DAT = relationship("NOTICE_DETAIL_DAT", back_populates="NOTICE_DETAIL_VOTE_DAT")
 
+    __table_args__ = (
+        Index("ux_notice_detail_vote_notice_id_user_id", "notice_id", "user_id", unique=True),
+    )
+
 
 # FAQ TABLE
 class FAQ_MST(Base):
@@ -132,6 +154,9 @@ class STOCK_DETAIL_DAT(Base):
     title = Column(String, nullable=False)
     content = Column(String, nullable=False)
     views = Column(Integer, default=0, nullable=False)
+    like_cnt = Column(Integer, default=0, nullable=False)
+    hate_cnt = Column(Integer, default=0, nullable=False)
+    comment_cnt = Column(Integer, default=0, nullable=False)
     created_at = Column(TIMESTAMP, default=datetime.utcnow, nullable=False)
     updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     deleted_at = Column(TIMESTAMP, nullable=True)
@@ -143,6 +168,11 @@ class STOCK_DETAIL_DAT(Base):
     STOCK_DETAIL_COMMENT_DAT = relationship("STOCK_DETAIL_COMMENT_DAT", back_populates="STOCK_DETAIL_DAT")
     STOCK_DETAIL_VOTE_DAT = relationship("STOCK_DETAIL_VOTE_DAT", back_populates="STOCK_DETAIL_DAT")
 
+    # 全文検索用（日本語・韓国語のためngram parser）
+    __table_args__ = (
+        Index("ft_stock_detail_title_content", "title", "content", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+    )
+
 
 class STOCK_DETAIL_COMMENT_DAT(Base):
     __tablename__ = "STOCK_DETAIL_COMMENT_DAT"
@@ -158,6 +188,12 @@ class STOCK_DETAIL_COMMENT_DAT(Base):
     USER = relationship("USER", back_populates="STOCK_DETAIL_COMMENT_DAT")
     STOCK_DETAIL_DAT = relationship("STOCK_DETAIL_DAT", back_populates="STOCK_DETAIL_COMMENT_DAT")
 
+    # hot ranking（直近のイベント）用
+    __table_args__ = (
+        Index("ix_stock_detail_comment_stock_id_id", "stock_id", "id"),
+        Index("ix_stock_detail_comment_created_at", "created_at"),
+    )
+
 
 class STOCK_DETAIL_VOTE_DAT(Base):
     __tablename__ = "STOCK_DETAIL_VOTE_DAT"
@@ -173,6 +209,12 @@ class STOCK_DETAIL_VOTE_DAT(Base):
     USER = relationship("USER", back_populates="STOCK_DETAIL_VOTE_DAT")
     STOCK_DETAIL_DAT = relationship("STOCK_DETAIL_DAT", back_populates="STOCK_DETAIL_VOTE_DAT")
 
+    __table_args__ = (
+        Index("ux_stock_detail_vote_stock_id_user_id", "stock_id", "user_id", unique=True),
+        # hot ranking（直近のイベント）用
+        Index("ix_stock_detail_vote_updated_at", "updated_at"),
+    )
+
 
 class MENU_MST(Base):
     __tablename__ = "MENU_MST"
@@ -236,5 +278,21 @@ class CURRENCY_DAT(Base):
     _currency_to = relationship("CURRENCY_MST", foreign_keys=[currency_to])
     _currency_from = relationship("CURRENCY_MST", foreign_keys=[currency_from])
 
+    __table_args__ = (
+        Index("ix_currency_dat_pair_id", "currency_to", "currency_from", "id"),
+        Index("ix_currency_dat_pair_created_at", "currency_to", "currency_from", "created_at"),
+    )
+
+
+# 通貨ペアごとの最新レート（CURRENCY_DAT INSERT時にtriggerで更新）
+class CURRENCY_LATEST_DAT(Base):
+    __tablename__ = "CURRENCY_LATEST_DAT"
+
+    currency_to = Column(Integer, ForeignKey("CURRENCY_MST.id"), primary_key=True)
+    currency_from = Column(Integer, ForeignKey("CURRENCY_MST.id"), primary_key=True)
+    currency_dat_id = Column(Integer, ForeignKey("CURRENCY_DAT.id"), nullable=False)
+    inc_dec = Column(String, nullable=True)
+    inc_dec_per = Column(String, nullable=True)
+    price = Column(Numeric, nullable=True)
+    created_at = Column(TIMESTAMP, nullable=False)
 
-metadata.create_all(bind=engine)
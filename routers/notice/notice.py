@@ -1,17 +1,20 @@
 import os
 from datetime import datetime
 from dotenv import load_dotenv
-from typing import Optional, List
+from typing import Optional, List, Union
 
-from sqlalchemy.orm import Session
-from db.connection import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.connection import get_async_db, get_read_db, get_replica_db, mark_written
 
-from fastapi import APIRouter, Depends, Security, HTTPException, status, Body
-from fastapi_pagination import Page, paginate, add_pagination
+from fastapi import APIRouter, Depends, Security, HTTPException, status, Body, Request, Response, Query
+from fastapi_pagination import Page, Params, paginate, add_pagination
 from fastapi.responses import JSONResponse
 
-from ..auth.auth import get_current_user
+from ..auth.auth import get_current_user, get_current_user_optional, get_current_staff
 from ..utils import notice_crud
+from ..utils.prefer import prefer_minimal
+from ..utils.fast_json import fast_response
+from ..utils.conditional import make_etag, cache_headers, is_not_modified, not_modified_response
 from . import schemas
 
 
@@ -22,28 +25,42 @@ router = APIRouter(
 )
 
 
-@router.post("", response_model=schemas.Notice)
+@router.post("", response_model=schemas.Notice, dependencies=[Depends(mark_written)])
 async def create_notice(notice: schemas.NoticeBase
                         , current_user: str = Depends(get_current_user)
-                        , db: Session = Depends(get_db)):
+                        , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板投稿</h2>
     掲示板に投稿する（Loginしているユーザーのみ投稿可能）
     """
-    return notice_crud.create_notice(db=db, notice=notice, user_id=current_user['user_id'])
+    return await notice_crud.create_notice(db=db, notice=notice, user_id=current_user['user_id'])
 
 
 @router.get("", response_model=Page[schemas.Notices])
-async def get_notices(paginationPage: Optional[int] = 0, db: Session = Depends(get_db)):
+async def get_notices(paginationPage: Optional[int] = 0
+                        , last_id: Optional[int] = None
+                        , params: Params = Depends()
+                        , db: AsyncSession = Depends(get_read_db)):
     """
     <h2>掲示板リスト</h2>
-    掲示板のリストを取得する
+    掲示板のリストを取得する（DB側でページングする）<br/>
+    last_idを指定した場合、last_idより古い投稿をsize件取得する
     """
-    return paginate(notice_crud.get_notices(db=db))
+    return fast_response(schemas.Notices, await notice_crud.get_notices(db=db, params=params, last_id=last_id))
 
 
-@router.get("/{notice_id}", response_model=schemas.Notice)
-async def get_notice(notice_id: int, db: Session = Depends(get_db)):
+@router.get("/search", response_model=Page[schemas.Notices])
+async def search_notices(q: str = Query(..., min_length=1, max_length=100)
+                        , params: Params = Depends()
+                        , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>掲示板検索</h2>
+    title, contentを全文検索して、関連度の高い順に取得する（DB側でページングする）
+    """
+    return fast_response(schemas.Notices, await notice_crud.search_notices(db=db, q=q, params=params))
+
+
+async def get_notice(notice_id: int, db: AsyncSession = Depends(get_read_db)):
     """
     <h2>掲示板詳細</h2>
     掲示板番号の詳細データを取得する
@@ -52,31 +69,66 @@ async def get_notice(notice_id: int, db: Session = Depends(get_db)):
         HTTPException<br/>
         　　404: 掲示板番号が存在しない場合
     """
-    notice = notice_crud.get_notice(db=db, notice_id=notice_id)
+    notice = await notice_crud.get_notice(db=db, notice_id=notice_id)
     if notice is None:
         raise HTTPException(status_code=404, detail="Notice not found")
     return notice
 
 
+@router.get("/{notice_id}", response_model=schemas.Notice)
+async def get_notice_detail(notice_id: int
+                            , request: Request
+                            , response: Response
+                            , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>掲示板詳細</h2>
+    掲示板番号の詳細データを取得する<br/>
+    If-None-MatchのETagが一致する場合は、詳細データを取得せずに304を返す
+    
+    ※ Raises
+        HTTPException<br/>
+        　　404: 掲示板番号が存在しない場合
+    """
+    if request.headers.get('if-none-match') is not None:
+        version = await notice_crud.get_notice_version(db=db, notice_id=notice_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Notice not found")
+        etag = make_etag('notice', notice_id, *version)
+        if is_not_modified(request=request, etag=etag):
+            return not_modified_response(etag=etag)
+
+    notice = await get_notice(notice_id=notice_id, db=db)
+    etag = make_etag('notice', notice_id, notice.updated_at, notice.views, notice.like_cnt, notice.hate_cnt, notice.notice_comment_cnt)
+    headers = cache_headers(etag=etag)
+    response.headers.update(headers)
+    return fast_response(schemas.Notice, notice, headers=headers)
+
+
+# 閲覧数の加算はbufferに入れるだけなので、掲示板はread replicaから読む
+async def get_replica_notice(notice_id: int, db: AsyncSession = Depends(get_replica_db)):
+    return await get_notice(notice_id=notice_id, db=db)
+
+
 @router.put("/{notice_id}/view-count")
 def update_notice_view_count(notice_id: int
-                            , notice: schemas.Notice = Depends(get_notice)
-                            , db: Session = Depends(get_db)):
+                            , notice: schemas.Notice = Depends(get_replica_notice)):
     """
     <h2>掲示板Viewを増加する</h2>
-    掲示板にアクセスするとviewcountを１足す
+    掲示板にアクセスするとviewcountを１足す<br/>
+    DBへの反映はまとめて行うため、viewsは反映予定の件数を含めた値を返す
     
     ※ Raises
         HTTPException<br/>
         　　404: 掲示板番号が存在しない場合
     """
-    return notice_crud.update_notice_view_count(db=db, notice_id=notice_id)
+    views = notice_crud.update_notice_view_count(notice_id=notice_id, views=notice.views)
+    return {**notice._asdict(), "views": views}
 
 
 def get_notice_me(notice_id: int
                 , notice: schemas.Notice = Depends(get_notice)
                 , current_user: str = Depends(get_current_user)
-                , db: Session = Depends(get_db)):
+                , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板詳細</h2>
     Loginしたユーザーと掲示板投稿したユーザーと一致するか確認
@@ -92,12 +144,12 @@ def get_notice_me(notice_id: int
     return notice
 
 
-@router.put("/{notice_id}", response_model=schemas.Notice)
+@router.put("/{notice_id}", response_model=schemas.Notice, dependencies=[Depends(mark_written)])
 async def update_notice(notice_id: int
                         , notice: schemas.NoticeBase
                         , current_user: str = Depends(get_current_user)
                         , get_notice: schemas.Notice = Depends(get_notice_me)
-                        , db: Session = Depends(get_db)):
+                        , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板更新</h2>
     掲示板番号の投稿内容を更新する
@@ -108,14 +160,14 @@ async def update_notice(notice_id: int
         　　401: Loginしていない場合<br/>
         　　401: Loginしているユーザーと掲示板投稿者と異なっている場合<br/>
     """
-    return notice_crud.update_notice(db=db, notice_id=notice_id, notice=notice)
+    return await notice_crud.update_notice(db=db, notice_id=notice_id, notice=notice)
 
 
-@router.delete("/{notice_id}")
+@router.delete("/{notice_id}", dependencies=[Depends(mark_written)])
 async def delete_notice(notice_id: int
                         , current_user: str = Depends(get_current_user)
                         , notice: schemas.Notice = Depends(get_notice_me)
-                        , db: Session = Depends(get_db)):
+                        , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板削除</h2>
     掲示板番号の投稿内容を削除する
@@ -126,15 +178,17 @@ async def delete_notice(notice_id: int
         　　401: Loginしていない場合<br/>
         　　401: Loginしているユーザーと掲示板投稿者と異なっている場合<br/>
     """
-    return notice_crud.delete_notice(db=db, notice_id=notice_id)
+    return await notice_crud.delete_notice(db=db, notice_id=notice_id)
 
 
-@router.post("/{notice_id}/comment", response_model=Page[schemas.Comment])
+@router.post("/{notice_id}/comment", response_model=Union[Page[schemas.Comment], schemas.CommentResult], dependencies=[Depends(mark_written)])
 async def create_notice_comment(notice_id: int
                                 , comment: schemas.CommentBase
                                 , notice: schemas.Notice = Depends(get_notice)
                                 , current_user: str = Depends(get_current_user)
-                                , db: Session = Depends(get_db)):
+                                , params: Params = Depends()
+                                , minimal: bool = Depends(prefer_minimal)
+                                , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板のコメント投稿</h2>
     掲示板の掲示板のコメントを投稿する
@@ -144,29 +198,34 @@ async def create_notice_comment(notice_id: int
         　　404: 掲示板番号番号が存在しない場合<br/>
         　　401: Loginしていない場合<br/>
     """
-    return paginate(notice_crud.create_notice_comment(db=db, comment=comment, notice_id=notice_id, user_id=current_user['user_id']))
+    return await notice_crud.create_notice_comment(db=db, comment=comment, notice_id=notice_id, user_id=current_user['user_id'], params=params, minimal=minimal)
 
 
 @router.get("/{notice_id}/comments", response_model=Page[schemas.Comment])
 async def get_notice_comments(notice_id: int
+                            , last_id: Optional[int] = None
+                            , after_id: Optional[int] = None
+                            , params: Params = Depends()
                             , notice: schemas.Notice = Depends(get_notice)
-                            , db: Session = Depends(get_db)):
+                            , db: AsyncSession = Depends(get_read_db)):
     """
     <h2>掲示板のコメントリスト</h2>
-    掲示板番号のコメントリストを取得する
+    掲示板番号のコメントリストを取得する（DB側でページングする）<br/>
+    last_idを指定した場合、last_idより古いコメントをsize件取得する<br/>
+    after_idを指定した場合、after_idより新しいコメントを古い順にsize件取得する（新着コメントの確認用）
     
     ※ Raises
         HTTPException<br/>
         　　404: 掲示板番号が存在しない場合<br/>
     """
-    return paginate(notice_crud.get_notice_comments(db=db, notice_id=notice_id))
+    return fast_response(schemas.Comment, await notice_crud.get_notice_comments(db=db, notice_id=notice_id, params=params, last_id=last_id, after_id=after_id))
 
 
 async def get_notice_comment_me(notice_id: int
                             , comment_id: int
                             , notice: schemas.Notice = Depends(get_notice)
                             , current_user: str = Depends(get_current_user)
-                            , db: Session = Depends(get_db)):
+                            , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板のコメント詳細</h2>
     掲示板番号のコメント詳細情報を取得する
@@ -175,7 +234,7 @@ async def get_notice_comment_me(notice_id: int
         HTTPException<br/>
         　　404: 掲示板番号、コメント番号が存在しない場合<br/>
     """
-    comment = notice_crud.get_notice_comment(db=db, comment_id=comment_id)
+    comment = await notice_crud.get_notice_comment(db=db, comment_id=comment_id)
     if not comment:
         raise HTTPException(status_code=404, detail="Notice comment not found")
     if comment.user_id != current_user['user_id']:
@@ -183,13 +242,15 @@ async def get_notice_comment_me(notice_id: int
     return comment
 
 
-@router.put("/{notice_id}/comment/{comment_id}", response_model=Page[schemas.Comment])
+@router.put("/{notice_id}/comment/{comment_id}", response_model=Union[Page[schemas.Comment], schemas.CommentResult], dependencies=[Depends(mark_written)])
 async def update_notice_comment(notice_id: int
                                 , comment_id: int
                                 , comment: schemas.CommentBase
                                 , notice_comment: schemas.Comment = Depends(get_notice_comment_me)
                                 , current_user: str = Depends(get_current_user)
-                                , db: Session = Depends(get_db)):
+                                , params: Params = Depends()
+                                , minimal: bool = Depends(prefer_minimal)
+                                , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板のコメント更新</h2>
     掲示板の掲示板のコメントを更新する
@@ -200,15 +261,17 @@ async def update_notice_comment(notice_id: int
         　　401: Loginしていない場合<br/>
         　　401: Loginしているユーザーとコメント投稿者と異なっている場合<br/>
     """
-    return paginate(notice_crud.update_notice_comment(db=db, comment_id=comment_id, comment=comment))
+    return await notice_crud.update_notice_comment(db=db, comment_id=comment_id, comment=comment, params=params, minimal=minimal)
 
 
-@router.delete("/{notice_id}/comment/{comment_id}", response_model=Page[schemas.Comment])
+@router.delete("/{notice_id}/comment/{comment_id}", response_model=Union[Page[schemas.Comment], schemas.CommentResult], dependencies=[Depends(mark_written)])
 async def delete_notice_comment(notice_id: int
                                 , comment_id: int
                                 , notice_comment: schemas.Comment = Depends(get_notice_comment_me)
                                 , current_user: str = Depends(get_current_user)
-                                , db: Session = Depends(get_db)):
+                                , params: Params = Depends()
+                                , minimal: bool = Depends(prefer_minimal)
+                                , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板のコメント削除</h2>
     掲示板の掲示板のコメントを削除する
@@ -219,30 +282,53 @@ async def delete_notice_comment(notice_id: int
         　　401: Loginしていない場合<br/>
         　　401: Loginしているユーザーとコメント投稿者と異なっている場合<br/>
     """
-    return paginate(notice_crud.delete_notice_comment(db=db, comment_id=comment_id))
+    return await notice_crud.delete_notice_comment(db=db, comment_id=comment_id, params=params, minimal=minimal)
 
 
-@router.get("/{notice_id}/vote", response_model=List[schemas.Vote])
+@router.get("/{notice_id}/vote", response_model=schemas.VoteSummary)
+async def get_vote_summary(notice_id: int
+                    , current_user: Optional[dict] = Depends(get_current_user_optional)
+                    , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>掲示板のLike, Hate count</h2>
+    掲示板の掲示板のいいね、悪いボタンのカウント<br/>
+    Loginしている場合は、自分の投票(my_vote)も返す
+    
+    ※ Raises
+        HTTPException<br/>
+        　　404: 掲示板番号が存在しない場合<br/>
+    """
+    summary = await notice_crud.get_vote_summary(db=db, notice_id=notice_id, user_id=current_user['user_id'] if current_user else None)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Notice not found")
+    return summary
+
+
+@router.get("/{notice_id}/votes", response_model=Page[schemas.Vote])
 async def get_votes(notice_id: int
+                    , params: Params = Depends()
                     , notice: schemas.Notice = Depends(get_notice)
-                    , db: Session = Depends(get_db)):
+                    , current_user: dict = Depends(get_current_staff)
+                    , db: AsyncSession = Depends(get_read_db)):
     """
-    <h2>掲示板のLike, Hate count</h2>
-    掲示板の掲示板のいいね、悪いボタンのカウント
+    <h2>掲示板のLike, Hateリスト（管理者用）</h2>
+    掲示板の投票データを取得する（DB側でページングする）
     
     ※ Raises
         HTTPException<br/>
         　　404: 掲示板番号が存在しない場合<br/>
+        　　403: 管理者ではない場合<br/>
     """
-    return notice_crud.get_votes(db=db, notice_id=notice_id)
+    return await notice_crud.get_votes_page(db=db, notice_id=notice_id, params=params)
 
 
-@router.post("/{notice_id}/vote", response_model=List[schemas.Vote])
+@router.post("/{notice_id}/vote", response_model=Union[schemas.VoteSummary, schemas.VoteResult], dependencies=[Depends(mark_written)])
 async def update_vote(notice_id: int
                         , vote: schemas.VoteUpdate
                         , notice: schemas.Notice = Depends(get_notice)
                         , current_user: str = Depends(get_current_user)
-                        , db: Session = Depends(get_db)):
+                        , minimal: bool = Depends(prefer_minimal)
+                        , db: AsyncSession = Depends(get_async_db)):
     """
     <h2>掲示板のLike, Hateボタンクリックイベント</h2>
     掲示板の掲示板のいいね、悪いボタンをクリックする
@@ -252,7 +338,7 @@ async def update_vote(notice_id: int
         　　404: 掲示板番号が存在しない場合<br/>
         　　401: Loginしていない場合<br/>
     """
-    return notice_crud.update_vote(db=db, vote=vote, notice_id=notice_id, user_id=current_user['user_id'])
+    return await notice_crud.update_vote(db=db, vote=vote, notice_id=notice_id, user_id=current_user['user_id'], minimal=minimal)
 
 
 add_pagination(router)
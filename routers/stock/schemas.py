@@ -1,6 +1,6 @@
 from typing import List, Optional
 from datetime import datetime
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, Extra, validator
 from fastapi import File, UploadFile, Form
 
 
@@ -26,6 +26,19 @@ class Vote(VoteBase):
 class VoteUpdate(VoteBase):
     pass
 
+class VoteResult(VoteBase):
+    like_cnt: int
+    hate_cnt: int
+
+class VoteSummary(BaseModel):
+    like_cnt: int
+    hate_cnt: int
+    my_vote: Optional[VoteBase] = None
+
+    # VoteResultと区別する（Union[VoteSummary, VoteResult]）
+    class Config:
+        extra = Extra.forbid
+
 
 class StockBase(BaseModel):
     title: str
@@ -67,3 +80,13 @@ class Comment(CommentBase):
 
     class Config:
         orm_mode = True
+
+
+class CommentResult(BaseModel):
+    id: int
+    stock_id: int
+    comment: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    deleted: bool
+    comment_cnt: int
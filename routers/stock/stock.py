@@ -2,17 +2,20 @@ import os
 from enum import Enum
 from datetime import datetime
 from dotenv import load_dotenv
-from typing import Optional, List
+from typing import Optional, List, Union
 
-from sqlalchemy.orm import Session
-from db.connection import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.connection import get_async_db, get_read_db, get_replica_db, mark_written
 
-from fastapi import APIRouter, Depends, Security, HTTPException, status, Body
-from fastapi_pagination import Page, paginate, add_pagination
+from fastapi import APIRouter, Depends, Security, HTTPException, status, Body, Request, Response, Query
+from fastapi_pagination import Page, Params, paginate, add_pagination
 from fastapi.responses import JSONResponse
 
-from ..auth.auth import get_current_user
+from ..auth.auth import get_current_user, get_current_user_optional, get_current_staff
 from ..utils import stock_crud
+from ..utils.prefer import prefer_minimal
+from ..utils.fast_json import fast_response
+from ..utils.conditional import make_etag, cache_headers, is_not_modified, not_modified_response
 from . import schemas
 
 
@@ -23,8 +26,8 @@ router = APIRouter(
 )
 
 
-def checked_category_mst(stock: str, db: Session = Depends(get_db)):
-    isStock = stock_crud.get_stock_mst(db=db, stock=stock)
+async def checked_category_mst(stock: str, db: AsyncSession = Depends(get_read_db)):
+    isStock = await stock_crud.get_stock_mst(db=db, stock=stock)
     if isStock is None:
         raise HTTPException(status_code=404, detail="stock not found")
     return isStock
@@ -32,90 +35,152 @@ def checked_category_mst(stock: str, db: Session = Depends(get_db)):
 
 
 @router.get("", response_model=List[schemas.STOCK_MST])
-async def get_stocks_mst(db: Session = Depends(get_db)):
-    return stock_crud.get_stocks_mst(db=db)
+async def get_stocks_mst(db: AsyncSession = Depends(get_read_db)):
+    return await stock_crud.get_stocks_mst(db=db)
 
 
-@router.post("/{stock}", response_model=schemas.Stock)
+@router.post("/{stock}", response_model=schemas.Stock, dependencies=[Depends(mark_written)])
 async def create_stock(stock_create: schemas.StockBase
                         , stock: schemas.STOCK_MST = Depends(checked_category_mst)
                         , current_user: str = Depends(get_current_user)
-                        , db: Session = Depends(get_db)):
-    return stock_crud.create_stock(db=db, stock=stock_create, user_id=current_user['user_id'], stock_mst_id=stock.id)
+                        , db: AsyncSession = Depends(get_async_db)):
+    return await stock_crud.create_stock(db=db, stock=stock_create, user_id=current_user['user_id'], stock_mst_id=stock.id)
 
 
 
 @router.get("/{stock}", response_model=Page[schemas.Stocks])
 async def get_stocks(stock: schemas.STOCK_MST = Depends(checked_category_mst)
                     , paginationPage: Optional[int] = 0
-                    , db: Session = Depends(get_db)):
-    return paginate(stock_crud.get_stocks(db=db, stock_id=stock.id))
+                    , last_id: Optional[int] = None
+                    , sort: Optional[str] = Query(None, regex='^(new|hot)$')
+                    , params: Params = Depends()
+                    , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>株掲示板リスト</h2>
+    sort=hotの場合、閲覧・コメント・Likeを時間で減衰させたscore順（直近に反応があった投稿のみ）
+    """
+    if sort == 'hot':
+        return fast_response(schemas.Stocks, await stock_crud.get_hot_stocks(db=db, stock_id=stock.id, params=params))
+    return fast_response(schemas.Stocks, await stock_crud.get_stocks(db=db, stock_id=stock.id, params=params, last_id=last_id))
+
+
+
+@router.get("/{stock}/search", response_model=Page[schemas.Stocks])
+async def search_stocks(q: str = Query(..., min_length=1, max_length=100)
+                        , stock: schemas.STOCK_MST = Depends(checked_category_mst)
+                        , params: Params = Depends()
+                        , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>株掲示板検索</h2>
+    title, contentを全文検索して、関連度の高い順に取得する（DB側でページングする）
+    """
+    return fast_response(schemas.Stocks, await stock_crud.search_stocks(db=db, stock_id=stock.id, q=q, params=params))
 
 
 
-@router.get("/{stock}/{stock_id}", response_model=schemas.Stock)
 async def get_stock(stock_id: int
                     , stock: schemas.STOCK_MST = Depends(checked_category_mst)
-                    , db: Session = Depends(get_db)):
-    stock = stock_crud.get_stock(db=db, stock_id=stock_id)
+                    , db: AsyncSession = Depends(get_read_db)):
+    stock = await stock_crud.get_stock(db=db, stock_id=stock_id)
     if stock is None:
         raise HTTPException(status_code=404, detail="Stock not found")
     return stock
 
 
 
+@router.get("/{stock}/{stock_id}", response_model=schemas.Stock)
+async def get_stock_detail(stock_id: int
+                            , request: Request
+                            , response: Response
+                            , stock: schemas.STOCK_MST = Depends(checked_category_mst)
+                            , db: AsyncSession = Depends(get_read_db)):
+    if request.headers.get('if-none-match') is not None:
+        version = await stock_crud.get_stock_version(db=db, stock_id=stock_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Stock not found")
+        etag = make_etag('stock', stock_id, *version)
+        if is_not_modified(request=request, etag=etag):
+            return not_modified_response(etag=etag)
+
+    stock = await get_stock(stock_id=stock_id, stock=stock, db=db)
+    etag = make_etag('stock', stock_id, stock.updated_at, stock.views, stock.like_cnt, stock.hate_cnt, stock.notice_comment_cnt)
+    headers = cache_headers(etag=etag)
+    response.headers.update(headers)
+    return fast_response(schemas.Stock, stock, headers=headers)
+
+
+
+# 閲覧数の加算はbufferに入れるだけなので、株掲示板はread replicaから読む
+async def get_replica_stock(stock_id: int
+                            , stock: str
+                            , db: AsyncSession = Depends(get_replica_db)):
+    return await get_stock(stock_id=stock_id, stock=await checked_category_mst(stock=stock, db=db), db=db)
+
+
+
 @router.put("/{stock}/{stock_id}/view-count")
 def update_stock_view_count(stock_id: int
-                            , stock: schemas.Stock = Depends(get_stock)
-                            , db: Session = Depends(get_db)):
-    return stock_crud.update_stock_view_count(db=db, stock_id=stock_id)
+                            , stock: schemas.Stock = Depends(get_replica_stock)):
+    views = stock_crud.update_stock_view_count(stock_id=stock_id, views=stock.views, stock_mst_id=stock.stock_mst_id)
+    return {**stock._asdict(), "views": views}
 
 
 
 def get_stock_me(stock_id: int
                 , stock: schemas.Stock = Depends(get_stock)
                 , current_user: str = Depends(get_current_user)
-                , db: Session = Depends(get_db)):
+                , db: AsyncSession = Depends(get_async_db)):
     if stock.writer_id != current_user['user_id']:
         raise HTTPException(status_code=401, detail="The writer and the login user are different")
     return stock
 
 
 
-@router.put("/{stock}/{stock_id}", response_model=schemas.Stock)
+@router.put("/{stock}/{stock_id}", response_model=schemas.Stock, dependencies=[Depends(mark_written)])
 async def update_stock(stock_id: int
                         , stock_update: schemas.StockBase
                         , current_user: str = Depends(get_current_user)
                         , stock: schemas.Stock = Depends(get_stock_me)
-                        , db: Session = Depends(get_db)):
-    return stock_crud.update_stock(db=db, stock_id=stock_id, stock=stock_update)
+                        , db: AsyncSession = Depends(get_async_db)):
+    return await stock_crud.update_stock(db=db, stock_id=stock_id, stock=stock_update)
 
 
 
-@router.delete("/{stock}/{stock_id}")
+@router.delete("/{stock}/{stock_id}", dependencies=[Depends(mark_written)])
 async def delete_stock(stock_id: int
                         , current_user: str = Depends(get_current_user)
                         , stock: schemas.Stock = Depends(get_stock_me)
-                        , db: Session = Depends(get_db)):
-    return stock_crud.delete_stock(db=db, stock_id=stock_id)
+                        , db: AsyncSession = Depends(get_async_db)):
+    return await stock_crud.delete_stock(db=db, stock_id=stock_id)
 
 
 
-@router.post("/{stock}/{stock_id}/comment", response_model=Page[schemas.Comment])
+@router.post("/{stock}/{stock_id}/comment", response_model=Union[Page[schemas.Comment], schemas.CommentResult], dependencies=[Depends(mark_written)])
 async def create_stock_comment(stock_id: int
                                 , comment: schemas.CommentBase
                                 , stock: schemas.Stock = Depends(get_stock)
                                 , current_user: str = Depends(get_current_user)
-                                , db: Session = Depends(get_db)):
-    return paginate(stock_crud.create_stock_comment(db=db, comment=comment, stock_id=stock_id, user_id=current_user['user_id']))
+                                , params: Params = Depends()
+                                , minimal: bool = Depends(prefer_minimal)
+                                , db: AsyncSession = Depends(get_async_db)):
+    return await stock_crud.create_stock_comment(db=db, comment=comment, stock_id=stock_id, user_id=current_user['user_id'], params=params, minimal=minimal, stock_mst_id=stock.stock_mst_id)
 
 
 
 @router.get("/{stock}/{stock_id}/comments", response_model=Page[schemas.Comment])
 async def get_stock_comments(stock_id: int
+                            , last_id: Optional[int] = None
+                            , after_id: Optional[int] = None
+                            , params: Params = Depends()
                             , stock: schemas.Stock = Depends(get_stock)
-                            , db: Session = Depends(get_db)):
-    return paginate(stock_crud.get_stock_comments(db=db, stock_id=stock_id))
+                            , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>株掲示板のコメントリスト</h2>
+    コメントリストを取得する（DB側でページングする）<br/>
+    last_idを指定した場合、last_idより古いコメントをsize件取得する<br/>
+    after_idを指定した場合、after_idより新しいコメントを古い順にsize件取得する（新着コメントの確認用）
+    """
+    return fast_response(schemas.Comment, await stock_crud.get_stock_comments(db=db, stock_id=stock_id, params=params, last_id=last_id, after_id=after_id))
 
 
 
@@ -123,8 +188,8 @@ async def get_stock_comment_me(stock_id: int
                             , comment_id: int
                             , stock: schemas.Stock = Depends(get_stock)
                             , current_user: str = Depends(get_current_user)
-                            , db: Session = Depends(get_db)):
-    comment = stock_crud.get_stock_comment(db=db, comment_id=comment_id)
+                            , db: AsyncSession = Depends(get_async_db)):
+    comment = await stock_crud.get_stock_comment(db=db, comment_id=comment_id)
     if not comment:
         raise HTTPException(status_code=404, detail="Stock comment not found")
     if comment.user_id != current_user['user_id']:
@@ -133,42 +198,69 @@ async def get_stock_comment_me(stock_id: int
 
 
 
-@router.put("/{stock}/{stock_id}/comment/{comment_id}", response_model=Page[schemas.Comment])
+@router.put("/{stock}/{stock_id}/comment/{comment_id}", response_model=Union[Page[schemas.Comment], schemas.CommentResult], dependencies=[Depends(mark_written)])
 async def update_stock_comment(stock_id: int
                                 , comment_id: int
                                 , comment: schemas.CommentBase
                                 , stock_comment: schemas.Comment = Depends(get_stock_comment_me)
                                 , current_user: str = Depends(get_current_user)
-                                , db: Session = Depends(get_db)):
-    return paginate(stock_crud.update_stock_comment(db=db, comment_id=comment_id, comment=comment))
+                                , params: Params = Depends()
+                                , minimal: bool = Depends(prefer_minimal)
+                                , db: AsyncSession = Depends(get_async_db)):
+    return await stock_crud.update_stock_comment(db=db, comment_id=comment_id, comment=comment, params=params, minimal=minimal)
 
 
 
-@router.delete("/{stock}/{stock_id}/comment/{comment_id}", response_model=Page[schemas.Comment])
+@router.delete("/{stock}/{stock_id}/comment/{comment_id}", response_model=Union[Page[schemas.Comment], schemas.CommentResult], dependencies=[Depends(mark_written)])
 async def delete_stock_comment(stock_id: int
                                 , comment_id: int
                                 , stock_comment: schemas.Comment = Depends(get_stock_comment_me)
                                 , current_user: str = Depends(get_current_user)
-                                , db: Session = Depends(get_db)):
-    return paginate(stock_crud.delete_stock_comment(db=db, comment_id=comment_id))
+                                , params: Params = Depends()
+                                , minimal: bool = Depends(prefer_minimal)
+                                , db: AsyncSession = Depends(get_async_db)):
+    return await stock_crud.delete_stock_comment(db=db, comment_id=comment_id, params=params, minimal=minimal)
+
+
+
+@router.get("/{stock}/{stock_id}/vote", response_model=schemas.VoteSummary)
+async def get_vote_summary(stock_id: int
+                    , stock: schemas.STOCK_MST = Depends(checked_category_mst)
+                    , current_user: Optional[dict] = Depends(get_current_user_optional)
+                    , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>株掲示板のLike, Hate count</h2>
+    Loginしている場合は、自分の投票(my_vote)も返す
+    """
+    summary = await stock_crud.get_vote_summary(db=db, stock_id=stock_id, user_id=current_user['user_id'] if current_user else None, stock_mst_id=stock.id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Stock not found")
+    return summary
 
 
 
-@router.get("/{stock}/{stock_id}/vote", response_model=List[schemas.Vote])
+@router.get("/{stock}/{stock_id}/votes", response_model=Page[schemas.Vote])
 async def get_votes(stock_id: int
+                    , params: Params = Depends()
                     , stock: schemas.Stock = Depends(get_stock)
-                    , db: Session = Depends(get_db)):
-    return stock_crud.get_votes(db=db, stock_id=stock_id)
+                    , current_user: dict = Depends(get_current_staff)
+                    , db: AsyncSession = Depends(get_read_db)):
+    """
+    <h2>株掲示板のLike, Hateリスト（管理者用）</h2>
+    投票データを取得する（DB側でページングする）
+    """
+    return await stock_crud.get_votes_page(db=db, stock_id=stock_id, params=params)
 
 
 
-@router.post("/{stock}/{stock_id}/vote", response_model=List[schemas.Vote])
+@router.post("/{stock}/{stock_id}/vote", response_model=Union[schemas.VoteSummary, schemas.VoteResult], dependencies=[Depends(mark_written)])
 async def update_vote(stock_id: int
                         , vote: schemas.VoteUpdate
                         , stock: schemas.Stock = Depends(get_stock)
                         , current_user: str = Depends(get_current_user)
-                        , db: Session = Depends(get_db)):
-    return stock_crud.update_vote(db=db, vote=vote, stock_id=stock_id, user_id=current_user['user_id'])
+                        , minimal: bool = Depends(prefer_minimal)
+                        , db: AsyncSession = Depends(get_async_db)):
+    return await stock_crud.update_vote(db=db, vote=vote, stock_id=stock_id, user_id=current_user['user_id'], minimal=minimal, stock_mst_id=stock.stock_mst_id)
 
 
 
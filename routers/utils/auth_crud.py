@@ -1,74 +1,88 @@
 from typing import Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from .. import models
 from ..auth import schemas
+from .user_filter import user_filter
 from datetime import datetime
 
 # User Info取得
-def get_user(db: Session, username: str):
-    return db.query(models.USER)\
-            .filter(models.USER.username == username)\
+async def get_user(db: AsyncSession, username: str):
+    return (await db.scalars(select(models.USER)\
+            .where(models.USER.username == username)))\
             .first()
 
-def get_user_for_email(db: Session, email: str, sns: Optional[str] = None):
-    return db.query(models.USER)\
-            .filter(models.USER.email == email)\
-            .filter(models.USER.sns == sns)\
+async def get_user_for_email(db: AsyncSession, email: str, sns: Optional[str] = None):
+    return (await db.scalars(select(models.USER)\
+            .where(models.USER.email == email)\
+            .where(models.USER.sns == sns)))\
             .first()
 
 # User Insert
-def create_user(db: Session, user: schemas.UserCreate):
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
     db_user = models.USER(**user.dict())
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return get_user(db=db, username=db_user.username)
+    await db.commit()
+    await db.refresh(db_user)
+    user_filter.add(username=db_user.username, email=db_user.email)
+    return await get_user(db=db, username=db_user.username)
 
 # User Update
-def update_user(db: Session, username: str, user: schemas.UserUpdate):
-    db_user = db.query(models.USER).filter(models.USER.username == username).first()
+async def update_user(db: AsyncSession, username: str, user: schemas.UserUpdate):
+    db_user = await get_user(db=db, username=username)
     db_user.first_name = user.first_name
     db_user.last_name = user.last_name
     db_user.zipcode = user.zipcode
     db_user.address1 = user.address1
     db_user.address2 = user.address2
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return get_user(db=db, username=db_user.username)
+    await db.commit()
+    await db.refresh(db_user)
+    return await get_user(db=db, username=db_user.username)
 
 # User password update
-def update_password(db: Session, user: models.USER):
+async def update_password(db: AsyncSession, user: models.USER):
     db.add(user)
-    db.commit()
-    db.refresh(user)
-    return get_user(db=db, username=user.username)
+    await db.commit()
+    await db.refresh(user)
+    return await get_user(db=db, username=user.username)
+
+# bcrypt cost変更によるpassword再hash（updated_atは変更しない）
+async def update_password_hash(db: AsyncSession, user: models.USER, password: str):
+    await db.execute(update(models.USER)\
+            .where(models.USER.id == user.id)\
+            .values({models.USER.password: password
+                    , models.USER.updated_at: models.USER.updated_at})\
+            .execution_options(synchronize_session=False))
+    await db.commit()
+    # 変更として扱うと次のcommitでUPDATE（updated_atも更新）されるので、DBの値として設定する
+    set_committed_value(user, 'password', password)
+    return user
 
 # RefreshToekn Info取得
-def get_refresh_token(db: Session, username: str):
-    return db.query(models.USER_REFRESH_TOKEN)\
-            .filter(models.USER_REFRESH_TOKEN.username == username)\
+async def get_refresh_token(db: AsyncSession, username: str):
+    return (await db.scalars(select(models.USER_REFRESH_TOKEN)\
+            .where(models.USER_REFRESH_TOKEN.username == username)))\
             .first()
 
-# RefreshToekn Update or Insert
-def update_refresh_token(db: Session, username: str, refresh_token: str):
-    if get_refresh_token(db=db, username=username):
-        db_user = db.query(models.USER_REFRESH_TOKEN).filter(models.USER_REFRESH_TOKEN.username == username).first()
-        db_user.refresh_token = refresh_token
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
-        return get_user(db=db, username=db_user.username)
-
-    db_user = models.USER_REFRESH_TOKEN(username=username, refresh_token=refresh_token)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return get_user(db=db, username=db_user.username)
+# RefreshToekn Update or Insert（usernameのunique keyで1回のupsert）
+async def update_refresh_token(db: AsyncSession, username: str, refresh_token: str):
+    now = datetime.utcnow()
+    query = mysql_insert(models.USER_REFRESH_TOKEN)\
+            .values(username=username
+                    , refresh_token=refresh_token
+                    , created_at=now
+                    , updated_at=now)
+    await db.execute(query.on_duplicate_key_update(refresh_token=query.inserted.refresh_token
+                                                , updated_at=query.inserted.updated_at
+                                                , deleted_at=None))
+    await db.commit()
 
 
-def auth_num_check(db: Session, user: schemas.PasswordFind):
-    return db.query(models.USER)\
-            .filter(models.USER.email == user.email)\
-            .filter(models.USER.auth_number == user.authNum)\
+async def auth_num_check(db: AsyncSession, user: schemas.PasswordFind):
+    return (await db.scalars(select(models.USER)\
+            .where(models.USER.email == user.email)\
+            .where(models.USER.auth_number == user.authNum)))\
             .first()
@@ -0,0 +1,52 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+
+# ETag作成（W/"sha1"）
+def make_etag(*parts):
+    return 'W/"{}"'.format(hashlib.sha1(repr(parts).encode()).hexdigest())
+
+
+def cache_headers(etag: str, last_modified: Optional[datetime] = None):
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = format_datetime(to_utc(last_modified), usegmt=True)
+    return headers
+
+
+# If-None-Match（ない場合はIf-Modified-Since）を確認して、変更がない場合はTrueを返す
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None):
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or strip_weak(etag) in [strip_weak(tag) for tag in tags]
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return to_utc(last_modified).replace(microsecond=0) <= since
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime] = None):
+    return Response(status_code=304, headers=cache_headers(etag=etag, last_modified=last_modified))
+
+
+def strip_weak(etag: str):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+# DBの日時はUTC（datetime.utcnow）で保存している
+def to_utc(value: datetime):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
@@ -0,0 +1,140 @@
+import csv
+import time
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+
+from db.config import settings
+from db.session import SessionLocal
+from .. import models
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rate(row: dict):
+    created_at = row.get('created_at')
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at) if created_at else None
+    price = row.get('price')
+    return {
+        'currency_to': row['currency_to'].strip().upper(),
+        'currency_from': row['currency_from'].strip().upper(),
+        'price': Decimal(str(price)) if price not in (None, '') else None,
+        'inc_dec': row.get('inc_dec') or None,
+        'inc_dec_per': row.get('inc_dec_per') or None,
+        'created_at': created_at or datetime.utcnow(),
+    }
+
+
+class CsvFileSource():
+    """
+    CSVファイルからレートを読む
+    header: currency_to,currency_from,price,inc_dec,inc_dec_per,created_at
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                yield parse_rate(row)
+
+
+class StubSource():
+    """
+    メモリ上のレート(dict)をそのまま返す（テスト・ローカル用）
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def __iter__(self):
+        for row in self.rows:
+            yield parse_rate(row)
+
+
+class CurrencyRateIngester():
+    """
+    sourceから読んだレートをbatch_size件ごとに
+    executemanyのmulti-row INSERTでCURRENCY_DATに書き込む
+    CURRENCY_LATEST_DATはCURRENCY_DATのtrigger（migration 0002）が行ごとに更新する
+    """
+
+    def __init__(self, db: Session, batch_size: int = settings.CURRENCY_INGEST_BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self.currency_ids = {}
+
+    # CURRENCY_MSTを一度だけ読んで、通貨コード -> idのmapを作る
+    def load_currency_ids(self):
+        self.currency_ids = {currency: currency_id for currency_id, currency in
+                            self.db.execute(select(models.CURRENCY_MST.id
+                                                , models.CURRENCY_MST.currency)\
+                                        .where(models.CURRENCY_MST.deleted_at == None)).all()}
+        return self.currency_ids
+
+    def write(self, batch: list):
+        self.db.execute(insert(models.CURRENCY_DAT), batch)
+        self.db.commit()
+
+    def ingest(self, source):
+        if not self.currency_ids:
+            self.load_currency_ids()
+
+        started = time.perf_counter()
+        inserted = 0
+        skipped = 0
+        unknown = set()
+        batch = []
+
+        for rate in source:
+            currency_to = self.currency_ids.get(rate['currency_to'])
+            currency_from = self.currency_ids.get(rate['currency_from'])
+            if currency_to is None or currency_from is None:
+                unknown.update(code for code, currency_id in ((rate['currency_to'], currency_to)
+                                                            , (rate['currency_from'], currency_from))
+                                if currency_id is None)
+                skipped += 1
+                continue
+
+            batch.append({**rate, 'currency_to': currency_to, 'currency_from': currency_from,
+                        'updated_at': rate['created_at']})
+
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                inserted += len(batch)
+                batch = []
+                logger.info("CURRENCY_DAT: %d rows (%.0f rows/sec)", inserted, inserted / (time.perf_counter() - started))
+
+        if batch:
+            self.write(batch)
+            inserted += len(batch)
+
+        if unknown:
+            logger.warning("CURRENCY_MSTにない通貨のためskip: %s", ", ".join(sorted(unknown)))
+
+        elapsed = time.perf_counter() - started
+        return {
+            'inserted': inserted,
+            'skipped': skipped,
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(inserted / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+def ingest_rates(source, batch_size: Optional[int] = None):
+    """
+    BackgroundTasksなどから呼ぶ場合のentry point（sessionはここで作って閉じる）
+    """
+    db = SessionLocal()
+    try:
+        return CurrencyRateIngester(db=db, batch_size=batch_size or settings.CURRENCY_INGEST_BATCH_SIZE)\
+                .ingest(source)
+    finally:
+        db.close()
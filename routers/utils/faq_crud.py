@@ -1,53 +1,60 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, case, distinct
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, distinct, select
 from .. import models
 from ..faq import schemas
 from datetime import datetime
 
 
 # Faq Create
-def create_faq(db: Session, faq: schemas.FaqBase):
+async def create_faq(db: AsyncSession, faq: schemas.FaqBase):
     db_faq = models.FAQ_MST(**faq.dict())
     db.add(db_faq)
-    db.commit()
-    db.refresh(db_faq)
-    return get_faqs(db=db)
+    await db.commit()
+    await db.refresh(db_faq)
+    return await get_faqs(db=db)
 
 
 # Faq List
-def get_faqs(db: Session):
-    return db.query(models.FAQ_MST)\
-                .filter(models.FAQ_MST.deleted_at == None)\
-                .order_by(models.FAQ_MST.id.desc())\
+async def get_faqs(db: AsyncSession):
+    return (await db.scalars(select(models.FAQ_MST)\
+                .where(models.FAQ_MST.deleted_at == None)\
+                .order_by(models.FAQ_MST.id.desc())))\
                 .all()
 
 
+# Faq List version（ETag, Last-Modified用）
+async def get_faqs_version(db: AsyncSession):
+    return tuple((await db.execute(select(func.max(models.FAQ_MST.updated_at), func.count(models.FAQ_MST.id))\
+                .where(models.FAQ_MST.deleted_at == None)))\
+                .first())
+
+
 # Faq Read
-def get_faq(db: Session, faq_id: int):
-    return db.query(models.FAQ_MST)\
-                .filter(models.FAQ_MST.id == faq_id)\
-                .filter(models.FAQ_MST.deleted_at == None)\
+async def get_faq(db: AsyncSession, faq_id: int):
+    return (await db.scalars(select(models.FAQ_MST)\
+                .where(models.FAQ_MST.id == faq_id)\
+                .where(models.FAQ_MST.deleted_at == None)))\
                 .first()
 
 
 # Faq Update
-def update_faq(db:Session, faq: schemas.FaqBase, faq_id: int):
-    db_faq = db.query(models.FAQ_MST).filter(models.FAQ_MST.id == faq_id).first()
+async def update_faq(db: AsyncSession, faq: schemas.FaqBase, faq_id: int):
+    db_faq = await db.get(models.FAQ_MST, faq_id)
     db_faq.title = faq.title
     db_faq.content = faq.content
     db_faq.flg = faq.flg
-    db.commit()
-    db.refresh(db_faq)
-    return get_faq(db=db, faq_id=faq_id)
+    await db.commit()
+    await db.refresh(db_faq)
+    return await get_faq(db=db, faq_id=faq_id)
 
 
 # Faq Delete
-def delete_faq(db: Session, faq_id: int):
-    db_faq = db.query(models.FAQ_MST).filter(models.FAQ_MST.id == faq_id).first()
+async def delete_faq(db: AsyncSession, faq_id: int):
+    db_faq = await db.get(models.FAQ_MST, faq_id)
     db_faq.deleted_at = get_datetime()
-    db.commit()
-    db.refresh(db_faq)
-    return get_faqs(db=db)
+    await db.commit()
+    await db.refresh(db_faq)
+    return await get_faqs(db=db)
 
 
 def get_datetime():
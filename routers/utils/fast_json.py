@@ -0,0 +1,68 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from functools import lru_cache
+from typing import Optional, Type
+
+from fastapi import Response
+from fastapi_pagination.bases import AbstractPage
+from pydantic import BaseModel
+
+from db.config import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return dict(value)
+    if hasattr(value, '_mapping'):
+        return dict(value._mapping)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# orjsonがない場合は標準のjsonで同じ形式にする
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content, default=encode_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=encode_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# schemaのfield名とdefault値（response_modelと同じfieldだけを出力する）
+@lru_cache(maxsize=None)
+def schema_fields(schema: Type[BaseModel]):
+    return tuple((name, field.default) for name, field in schema.__fields__.items())
+
+
+def project(schema: Type[BaseModel], row):
+    mapping = row._mapping if hasattr(row, '_mapping') else row
+    return {name: mapping.get(name, default) for name, default in schema_fields(schema)}
+
+
+def fast_response(schema: Type[BaseModel], content, headers: Optional[dict] = None):
+    """
+    CRUDで取得したRow（またはRowのPage）をresponse_modelの検証なしでJSONにする
+    DBから取得した値は型が合っているので、schemaのfieldだけを取り出してorjsonでencodeする
+    FAST_JSON_RESPONSEがfalseの場合はそのまま返す（response_modelで検証する）
+    """
+    if not settings.FAST_JSON_RESPONSE or isinstance(content, Response):
+        return content
+    if isinstance(content, AbstractPage):
+        content = {**dict(content), "items": [project(schema, row) for row in content.items]}
+    else:
+        content = project(schema, content)
+    return FastJSONResponse(content=content, headers=headers)
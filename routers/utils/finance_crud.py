@@ -1,31 +1,124 @@
-from sqlalchemy.orm import Session, aliased
-from sqlalchemy import func, case, distinct
+from datetime import datetime
+
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, distinct, select, delete, insert, tuple_
 from .. import models
 from ..stock import schemas
 
 from fastapi import status
 
 
-def get_finance_dat(db: Session):
+async def get_finance_dat(db: AsyncSession):
     currency_mst_a = aliased(models.CURRENCY_MST)
     currency_mst_b = aliased(models.CURRENCY_MST)
 
-    sub_query = db.query(models.CURRENCY_DAT.currency_to
+    return (await db.execute(select(models.CURRENCY_LATEST_DAT.currency_dat_id.label("id")
+                    , currency_mst_a.currency.label("currency_to")
+                    , currency_mst_b.currency.label("currency_from")
+                    , models.CURRENCY_LATEST_DAT.inc_dec
+                    , models.CURRENCY_LATEST_DAT.inc_dec_per
+                    , models.CURRENCY_LATEST_DAT.price
+                    , models.CURRENCY_LATEST_DAT.created_at)\
+                .join(currency_mst_a, models.CURRENCY_LATEST_DAT.currency_to == currency_mst_a.id)\
+                .join(currency_mst_b, models.CURRENCY_LATEST_DAT.currency_from == currency_mst_b.id)))\
+                .all()
+
+
+# 通貨ペアごとの最新レートをCURRENCY_DATから再作成する（pairs指定なしの場合は全ペア）
+def refresh_latest_rates(db: Session, pairs=None):
+    sub_query = select(models.CURRENCY_DAT.currency_to
                         , models.CURRENCY_DAT.currency_from
                         , func.max(models.CURRENCY_DAT.id).label("id"))\
                 .group_by(models.CURRENCY_DAT.currency_to
-                        , models.CURRENCY_DAT.currency_from)\
-                .subquery('sub_query')
+                        , models.CURRENCY_DAT.currency_from)
 
+    delete_query = delete(models.CURRENCY_LATEST_DAT)
 
-    return db.query(models.CURRENCY_DAT.id
-                    , currency_mst_a.currency.label("currency_to")
-                    , currency_mst_b.currency.label("currency_from")
-                    , models.CURRENCY_DAT.inc_dec
-                    , models.CURRENCY_DAT.inc_dec_per
-                    , models.CURRENCY_DAT.price
-                    , models.CURRENCY_DAT.created_at)\
-                .join(currency_mst_a, models.CURRENCY_DAT.currency_to == currency_mst_a.id)\
-                .join(currency_mst_b, models.CURRENCY_DAT.currency_from == currency_mst_b.id)\
-                .join(sub_query, models.CURRENCY_DAT.id == sub_query.c.id)\
+    if pairs is not None:
+        pairs = list(pairs)
+        if not pairs:
+            return 0
+        sub_query = sub_query.where(tuple_(models.CURRENCY_DAT.currency_to
+                                        , models.CURRENCY_DAT.currency_from).in_(pairs))
+        delete_query = delete_query.where(tuple_(models.CURRENCY_LATEST_DAT.currency_to
+                                        , models.CURRENCY_LATEST_DAT.currency_from).in_(pairs))
+
+    sub_query = sub_query.subquery('sub_query')
+
+    db.execute(delete_query)
+    result = db.execute(insert(models.CURRENCY_LATEST_DAT)\
+                .from_select(["currency_to", "currency_from", "currency_dat_id", "inc_dec", "inc_dec_per", "price", "created_at"]
+                        , select(models.CURRENCY_DAT.currency_to
+                            , models.CURRENCY_DAT.currency_from
+                            , models.CURRENCY_DAT.id
+                            , models.CURRENCY_DAT.inc_dec
+                            , models.CURRENCY_DAT.inc_dec_per
+                            , models.CURRENCY_DAT.price
+                            , models.CURRENCY_DAT.created_at)\
+                        .join(sub_query, models.CURRENCY_DAT.id == sub_query.c.id)))
+    db.commit()
+
+    return result.rowcount
+
+
+async def get_currency_id(db: AsyncSession, currency: str):
+    return await db.scalar(select(models.CURRENCY_MST.id)\
+                .where(models.CURRENCY_MST.currency == currency.upper()
+                    , models.CURRENCY_MST.deleted_at == None))
+
+
+# 通貨ペアの期間内のtick(created_at, price)を返す
+async def get_currency_history(db: AsyncSession, currency_to: int, currency_from: int, start: datetime, end: datetime):
+    return (await db.execute(select(models.CURRENCY_DAT.created_at
+                    , models.CURRENCY_DAT.price)\
+                .where(models.CURRENCY_DAT.currency_to == currency_to
+                    , models.CURRENCY_DAT.currency_from == currency_from
+                    , models.CURRENCY_DAT.created_at >= start
+                    , models.CURRENCY_DAT.created_at < end
+                    , models.CURRENCY_DAT.deleted_at == None)\
+                .order_by(models.CURRENCY_DAT.created_at)))\
+                .all()
+
+
+# 日単位のOHLCはDBで集計する（tickを全件読まない）
+# open, closeはその日の最初・最後のtickのprice（同じ時刻の場合はidの順）
+async def get_currency_history_daily(db: AsyncSession, currency_to: int, currency_from: int, start: datetime, end: datetime):
+    pair = (models.CURRENCY_DAT.currency_to == currency_to
+            , models.CURRENCY_DAT.currency_from == currency_from
+            , models.CURRENCY_DAT.price != None
+            , models.CURRENCY_DAT.deleted_at == None)
+    day = func.date(models.CURRENCY_DAT.created_at)
+    daily = select(day.label("day")
+                    , func.min(models.CURRENCY_DAT.created_at).label("first_at")
+                    , func.max(models.CURRENCY_DAT.created_at).label("last_at")
+                    , func.max(models.CURRENCY_DAT.price).label("high")
+                    , func.min(models.CURRENCY_DAT.price).label("low")
+                    , func.avg(models.CURRENCY_DAT.price).label("mean")
+                    , func.count(models.CURRENCY_DAT.price).label("count"))\
+                .where(*pair
+                    , models.CURRENCY_DAT.created_at >= start
+                    , models.CURRENCY_DAT.created_at < end)\
+                .group_by(day)\
+                .subquery()
+    open_price = select(models.CURRENCY_DAT.price)\
+                .where(*pair, models.CURRENCY_DAT.created_at == daily.c.first_at)\
+                .order_by(models.CURRENCY_DAT.id)\
+                .limit(1)\
+                .scalar_subquery()
+    close_price = select(models.CURRENCY_DAT.price)\
+                .where(*pair, models.CURRENCY_DAT.created_at == daily.c.last_at)\
+                .order_by(models.CURRENCY_DAT.id.desc())\
+                .limit(1)\
+                .scalar_subquery()
+
+    return (await db.execute(select(daily.c.day
+                    , open_price.label("open")
+                    , daily.c.high
+                    , daily.c.low
+                    , close_price.label("close")
+                    , daily.c.mean
+                    , daily.c["count"])\
+                .order_by(daily.c.day)))\
                 .all()
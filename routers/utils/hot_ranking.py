@@ -0,0 +1,192 @@
+import math
+import time
+import bisect
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from db.config import settings
+from db.session import SessionLocal
+from .. import models
+
+
+logger = logging.getLogger(__name__)
+
+
+# イベントごとの重み
+WEIGHTS = {
+    'view': 1.0,
+    'comment': 3.0,
+    'like': 4.0,
+}
+
+
+def to_timestamp(value: datetime):
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class BoardRanking():
+    """
+    掲示板ごとのscoreとscore上位top_n件のsorted list
+    keyは(-score, -post_id)で、同じscoreの場合は新しい投稿が上
+    """
+
+    def __init__(self, top_n: int):
+        self.top_n = top_n
+        self.scores = defaultdict(float)
+        self.top = []
+        self.members = set()
+
+    def add(self, post_id: int, score: float):
+        old = self.scores[post_id]
+        new = old + score
+        self.scores[post_id] = new
+
+        if post_id in self.members:
+            del self.top[bisect.bisect_left(self.top, (-old, -post_id))]
+        elif len(self.top) >= self.top_n and (-new, -post_id) >= self.top[-1]:
+            return
+        else:
+            self.members.add(post_id)
+
+        bisect.insort(self.top, (-new, -post_id))
+        if len(self.top) > self.top_n:
+            self.members.discard(-self.top.pop()[1])
+
+    def remove(self, post_id: int):
+        score = self.scores.pop(post_id, None)
+        if post_id in self.members:
+            del self.top[bisect.bisect_left(self.top, (-score, -post_id))]
+            self.members.discard(post_id)
+            self.rebuild_top()
+
+    def rebuild_top(self):
+        self.top = heapq.nsmallest(self.top_n, ((-score, -post_id) for post_id, score in self.scores.items()))
+        self.members = {-post_id for _, post_id in self.top}
+
+
+class HotRanking():
+    """
+    株掲示板のhot ranking（閲覧・コメント・Likeをhalf_life時間で減衰させたscore）
+
+    scoreは基準時刻t0からの経過時間で重みを大きくして記録する（w * exp(λ(t - t0))）
+    全投稿が同じ割合で減衰するので、順位はイベントが来た投稿の分だけ更新すればよい
+    refresh_interval秒ごとにDBの直近のコメント・Likeから作り直して（他のworkerのイベントも反映）、t0を現在時刻に移す
+    閲覧はDBに時刻がないため、workerごとに記録した分を加える
+    Likeは投票のupdated_atからrefreshでのみ反映する（同じ投票の繰り返しを重複して数えない、最大refresh_interval秒遅れる）
+    """
+
+    def __init__(self, half_life_hours: float, top_n: int, refresh_interval: float):
+        self.decay = math.log(2) / (half_life_hours * 3600)
+        self.window = timedelta(hours=half_life_hours * 4)
+        self.top_n = top_n
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.t0 = time.time()
+        self.boards = defaultdict(lambda: BoardRanking(self.top_n))
+        self.views = defaultdict(float)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def weight(self, kind: str, at: float = None):
+        return WEIGHTS[kind] * math.exp(self.decay * ((at or time.time()) - self.t0))
+
+    def record(self, board_id: int, post_id: int, kind: str, count: int = 1):
+        if board_id is None or count <= 0:
+            return
+        with self.lock:
+            score = self.weight(kind) * count
+            if kind == 'view':
+                self.views[(board_id, post_id)] += score
+            self.boards[board_id].add(post_id, score)
+
+    def remove(self, board_id: int, post_id: int):
+        with self.lock:
+            self.views.pop((board_id, post_id), None)
+            if board_id in self.boards:
+                self.boards[board_id].remove(post_id)
+
+    # score順のpost_idとrankingの件数
+    def page(self, board_id: int, offset: int, limit: int):
+        with self.lock:
+            board = self.boards.get(board_id)
+            if board is None:
+                return [], 0
+            return [-post_id for _, post_id in board.top[offset:offset + limit]], len(board.top)
+
+    def load_events(self, since: datetime):
+        db = SessionLocal()
+        try:
+            likes = db.execute(select(models.STOCK_DETAIL_DAT.stock_mst_id
+                        , models.STOCK_DETAIL_VOTE_DAT.stock_id
+                        , models.STOCK_DETAIL_VOTE_DAT.updated_at)\
+                    .join(models.STOCK_DETAIL_DAT, models.STOCK_DETAIL_VOTE_DAT.stock_id == models.STOCK_DETAIL_DAT.id)\
+                    .where(models.STOCK_DETAIL_VOTE_DAT.updated_at >= since)\
+                    .where(models.STOCK_DETAIL_VOTE_DAT.like == True)\
+                    .where(models.STOCK_DETAIL_DAT.deleted_at == None)).all()
+            comments = db.execute(select(models.STOCK_DETAIL_DAT.stock_mst_id
+                        , models.STOCK_DETAIL_COMMENT_DAT.stock_id
+                        , models.STOCK_DETAIL_COMMENT_DAT.created_at)\
+                    .join(models.STOCK_DETAIL_DAT, models.STOCK_DETAIL_COMMENT_DAT.stock_id == models.STOCK_DETAIL_DAT.id)\
+                    .where(models.STOCK_DETAIL_COMMENT_DAT.created_at >= since)\
+                    .where(models.STOCK_DETAIL_COMMENT_DAT.deleted_at == None)\
+                    .where(models.STOCK_DETAIL_DAT.deleted_at == None)).all()
+        finally:
+            db.close()
+        return [('like', row) for row in likes] + [('comment', row) for row in comments]
+
+    def refresh(self):
+        events = self.load_events(since=datetime.utcnow() - self.window)
+        t0 = time.time()
+
+        scores = defaultdict(float)
+        for kind, (board_id, post_id, at) in events:
+            scores[(board_id, post_id)] += WEIGHTS[kind] * math.exp(self.decay * (to_timestamp(at) - t0))
+
+        with self.lock:
+            # 閲覧分を新しいt0に合わせて減衰させ、小さくなったものは捨てる
+            rebase = math.exp(-self.decay * (t0 - self.t0))
+            self.views = defaultdict(float, {key: score * rebase for key, score in self.views.items()
+                                            if score * rebase >= WEIGHTS['view'] / 1000})
+            for key, score in self.views.items():
+                scores[key] += score
+
+            # DBを読んだ後に記録されたLike・コメントは次のrefreshで反映される
+            self.t0 = t0
+            boards = defaultdict(lambda: BoardRanking(self.top_n))
+            for (board_id, post_id), score in scores.items():
+                boards[board_id].scores[post_id] = score
+            for board in boards.values():
+                board.rebuild_top()
+            self.boards = boards
+        return len(scores)
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("hot ranking refresh failed")
+            self.stopped.wait(timeout=self.refresh_interval)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="hot-ranking-refresh", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+
+hot_ranking = HotRanking(half_life_hours=settings.HOT_RANKING_HALF_LIFE_HOURS
+                        , top_n=settings.HOT_RANKING_TOP_N
+                        , refresh_interval=settings.HOT_RANKING_REFRESH_INTERVAL)
@@ -0,0 +1,56 @@
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.config import settings
+from . import menu_crud
+from ..menu import schemas
+
+
+class MenuCache():
+    """
+    メニューをメモリに保持する
+    ttl秒ごとにversion（updated_atの最大値と件数）を確認して、変わった場合のみ作り直す
+    メニューはAPIから変更しない（DBを直接更新する）ので、変更の反映はworkerごとに最大ttl秒遅れる
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.menus = None
+        self.version = None
+        self.checked_at = 0.0
+
+    async def get(self, db: AsyncSession):
+        if self.menus is not None and time.monotonic() - self.checked_at < self.ttl:
+            return self.menus
+
+        version = await menu_crud.get_menu_version(db=db)
+        if self.menus is None or version != self.version:
+            self.menus = await self.build(db=db)
+            self.version = version
+        self.checked_at = time.monotonic()
+        return self.menus
+
+    async def build(self, db: AsyncSession):
+        menu_mst = list()
+        for v, sub in await menu_crud.get_menus(db=db):
+            menu_mst.append(
+                schemas.MenuMST(
+                    name=v.name
+                    , name_sub=v.name_sub
+                    , path=v.path
+                    , show_order=v.show_order
+                    , sub=sub
+                )
+            )
+        return menu_mst
+
+    # Menu, Sub Menuのupdated_atの最大値
+    def last_modified(self):
+        if self.version is None:
+            return None
+        updated_at = [v for v in (self.version[0], self.version[2]) if v is not None]
+        return max(updated_at) if updated_at else None
+
+
+menu_cache = MenuCache(ttl=settings.MENU_CACHE_TTL)
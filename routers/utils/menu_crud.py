@@ -1,5 +1,5 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, case, distinct
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, distinct, select
 from .. import models
 from ..stock import schemas
 from datetime import datetime
@@ -7,15 +7,27 @@ from fastapi import status
 from fastapi.responses import JSONResponse
 
 
-def get_menus(db: Session):
-    return db.query(models.MENU_MST)\
-            .order_by(models.MENU_MST.show_order)\
+# Menu, Sub Menuを１回のqueryで取得する
+async def get_menus(db: AsyncSession):
+    rows = (await db.execute(select(models.MENU_MST, models.MENU_SUB_MST)\
+            .join(models.MENU_SUB_MST, models.MENU_MST.id == models.MENU_SUB_MST.menu_id, isouter=True)\
+            .order_by(models.MENU_MST.show_order, models.MENU_MST.id, models.MENU_SUB_MST.show_order)))\
             .all()
 
+    menus = dict()
+    for menu, sub_menu in rows:
+        if menu.id not in menus:
+            menus[menu.id] = (menu, list())
+        if sub_menu is not None:
+            menus[menu.id][1].append(sub_menu)
+    return list(menus.values())
 
-def get_sub_menu(db: Session, menu_id: int):
-    return db.query(models.MENU_SUB_MST)\
-            .filter(models.MENU_SUB_MST.menu_id == menu_id)\
-            .order_by(models.MENU_SUB_MST.show_order)\
-            .all()
 
+# Menu, Sub Menuの変更確認用version（updated_atの最大値と件数）
+async def get_menu_version(db: AsyncSession):
+    return tuple((await db.execute(select(
+                select(func.max(models.MENU_MST.updated_at)).scalar_subquery()
+                , select(func.count(models.MENU_MST.id)).scalar_subquery()
+                , select(func.max(models.MENU_SUB_MST.updated_at)).scalar_subquery()
+                , select(func.count(models.MENU_SUB_MST.id)).scalar_subquery())))\
+            .first())
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+
+from sqlalchemy import event
+
+from db.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# request latencyのhistogram bucket（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# charsetはPlainTextResponseで追加される
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class RequestStats():
+    """
+    1 requestの間に実行したSQLの集計（middlewareでcontextvarに入れて、engineのeventで加算する）
+    """
+    __slots__ = ('statements', 'db_seconds', 'rows')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+
+current_request = contextvars.ContextVar("metrics_request", default=None)
+
+
+class RouteMetrics():
+    __slots__ = ('buckets', 'count', 'seconds', 'statuses', 'statements', 'db_seconds', 'rows', 'response_bytes')
+
+    def __init__(self, bucket_count: int):
+        self.buckets = [0] * (bucket_count + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.statuses = {}
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.response_bytes = 0
+
+
+def escape(value: str):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics():
+    """
+    route template（/app/v1/notices/{notice_id}など）ごとのlatency histogramとSQL件数・DB時間・行数・レスポンスbytes
+
+    multiproc_dirを指定した場合、各workerはflush_interval秒ごと（と/metricsの時）に集計を{pid}.jsonに書き出し、
+    /metricsは全workerのファイルを合計して返す（どのworkerにscrapeされても同じ系列になる）
+    停止したworkerのファイルも合計に含めるので、counterは減らない（deploy時にディレクトリを空にする）
+    指定しない場合はこのworkerの集計だけをpid labelを付けて返す（workerごとにscrapeする）
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, multiproc_dir: str = "", flush_interval: float = 5):
+        self.buckets = tuple(buckets)
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats, response_bytes: int):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            metrics = self.routes.get((method, route))
+            if metrics is None:
+                metrics = self.routes[(method, route)] = RouteMetrics(len(self.buckets))
+            metrics.buckets[index] += 1
+            metrics.count += 1
+            metrics.seconds += seconds
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.statements += stats.statements
+            metrics.db_seconds += stats.db_seconds
+            metrics.rows += stats.rows
+            metrics.response_bytes += response_bytes
+
+    # {"method route": {...}}（JSONで書き出せる形式）
+    def snapshot(self):
+        with self.lock:
+            return {f"{method} {route}": {"buckets": metrics.buckets[:]
+                                        , "count": metrics.count
+                                        , "seconds": metrics.seconds
+                                        , "statuses": {str(status): count for status, count in metrics.statuses.items()}
+                                        , "statements": metrics.statements
+                                        , "db_seconds": metrics.db_seconds
+                                        , "rows": metrics.rows
+                                        , "response_bytes": metrics.response_bytes}
+                    for (method, route), metrics in self.routes.items()}
+
+    def flush(self):
+        if not self.multiproc_dir:
+            return
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        path = os.path.join(self.multiproc_dir, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    # 全workerのファイルを合計する（このworkerも書き出したファイルから読むので、scrapeごとに値が戻らない）
+    def collect(self):
+        if not self.multiproc_dir:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for name in os.listdir(self.multiproc_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.multiproc_dir, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for key, values in snapshot.items():
+                total = merged.get(key)
+                if total is None:
+                    merged[key] = values
+                    continue
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], values["buckets"])]
+                for field in ("count", "seconds", "statements", "db_seconds", "rows", "response_bytes"):
+                    total[field] += values[field]
+                for status, count in values["statuses"].items():
+                    total["statuses"][status] = total["statuses"].get(status, 0) + count
+        return merged
+
+    def render(self):
+        routes = sorted(self.collect().items())
+        # multiproc_dirがない場合はworkerごとの系列にする
+        worker = "" if self.multiproc_dir else f',pid="{os.getpid()}"'
+
+        lines = ["# HELP http_request_duration_seconds Request latency by route template."
+                , "# TYPE http_request_duration_seconds histogram"]
+        for key, values in routes:
+            method, route = key.split(" ", 1)
+            labels = f'method="{method}",route="{escape(route)}"{worker}'
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, values["buckets"]):
+                cumulative += bucket
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {values["count"]}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {values["seconds"]}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {values["count"]}')
+
+        lines += ["# HELP http_requests_total Requests by route template and status."
+                , "# TYPE http_requests_total counter"]
+        for key, values in routes:
+            method, route = key.split(" ", 1)
+            for status, count in sorted(values["statuses"].items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{escape(route)}",status="{status}"{worker}}} {count}')
+
+        for field, name, help_text in [("statements", "db_statements_total", "SQL statements executed while handling requests.")
+                                    , ("db_seconds", "db_duration_seconds_total", "Time spent in SQL statements while handling requests.")
+                                    , ("rows", "db_rows_total", "Rows returned by SQL statements while handling requests.")
+                                    , ("response_bytes", "http_response_bytes_total", "Response body bytes.")]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for key, values in routes:
+                method, route = key.split(" ", 1)
+                lines.append(f'{name}{{method="{method}",route="{escape(route)}"{worker}}} {values[field]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+    def run(self):
+        while not self.stopped.wait(timeout=self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("metrics flush failed")
+
+    def start(self):
+        if self.thread is not None or not self.multiproc_dir:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="metrics-flush", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            self.flush()
+
+
+# 1つのconnectionで同時に実行するSQLは1つなので、開始時刻は1つだけ保持する
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request.get() is not None:
+        conn.info['metrics_started'] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_started', None)
+    stats = current_request.get()
+    if stats is None or started is None:
+        return
+    stats.statements += 1
+    stats.db_seconds += time.perf_counter() - started
+    # SELECTなど結果を返すSQLのみ行数を数える（UPDATEなどのrowcountは更新した行数）
+    # MySQLのbufferedなcursorのrowcountは取得した行数（streamのserver side cursorは数えない）
+    if cursor.description is not None and cursor.rowcount > 0 \
+            and not (context is not None and context.execution_options.get('stream_results')):
+        stats.rows += cursor.rowcount
+
+
+# SQLが失敗した場合はafter_cursor_executeが呼ばれないので、ここで開始時刻を消す（失敗したSQLも件数と時間に含める）
+def handle_error(exception_context):
+    conn = exception_context.connection
+    started = conn.info.pop('metrics_started', None) if conn is not None else None
+    stats = current_request.get()
+    if stats is None or started is None:
+        return
+    stats.statements += 1
+    stats.db_seconds += time.perf_counter() - started
+
+
+# Engine（AsyncEngineの場合はsync_engine）にSQL計測のeventを登録する
+def instrument_engine(engine):
+    engine = getattr(engine, 'sync_engine', engine)
+    if not event.contains(engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(engine, 'handle_error', handle_error)
+
+
+class MetricsMiddleware():
+    """
+    ASGI middleware（BaseHTTPMiddlewareを使わず、1 requestあたりの処理を少なくする）
+    route templateはroutingでscopeに入るendpointから求める（一致しない場合は<unmatched>）
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+        self.templates = None
+
+    def route_template(self, scope):
+        if self.templates is None:
+            self.templates = {}
+            for route in scope["app"].routes:
+                if hasattr(route, 'endpoint'):
+                    self.templates.setdefault(route.endpoint, route.path)
+        return self.templates.get(scope.get("endpoint"), "<unmatched>")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+        response_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            self.metrics.observe(method=scope["method"]
+                                , route=self.route_template(scope)
+                                , status=status
+                                , seconds=time.perf_counter() - started
+                                , stats=stats
+                                , response_bytes=response_bytes)
+
+
+metrics = Metrics(multiproc_dir=settings.METRICS_MULTIPROC_DIR, flush_interval=settings.METRICS_FLUSH_INTERVAL)
@@ -1,6 +1,11 @@
+from typing import Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case, distinct
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, distinct, select, update, false
+from sqlalchemy.dialects.mysql import match, insert as mysql_insert
+from fastapi_pagination import Page, Params
 from .. import models
+from .view_counter import view_counter
 from ..notice import schemas
 from datetime import datetime
 from fastapi import status
@@ -8,196 +13,322 @@ from fastapi.responses import JSONResponse
 
 
 # Notice Create
-def create_notice(db: Session, notice: schemas.NoticeBase, user_id: int):
+async def create_notice(db: AsyncSession, notice: schemas.NoticeBase, user_id: int):
     db_notice = models.NOTICE_DETAIL_DAT(**notice.dict(), user_id=user_id)
     db.add(db_notice)
-    db.commit()
-    db.refresh(db_notice)
-    return get_notice(db=db, notice_id=db_notice.id)
+    await db.commit()
+    await db.refresh(db_notice)
+    return await get_notice(db=db, notice_id=db_notice.id)
 
 
 # Notice List
-def get_notices(db: Session):
-    vote_sub_query = db.query(models.NOTICE_DETAIL_DAT.id
-                            , func.sum(case([(models.NOTICE_DETAIL_VOTE_DAT.like == True, 1)], else_=0)).label("like_cnt")
-                            , func.sum(case([(models.NOTICE_DETAIL_VOTE_DAT.hate == True, 1)], else_=0)).label("hate_cnt"))\
-            .join(models.NOTICE_DETAIL_VOTE_DAT, models.NOTICE_DETAIL_DAT.id == models.NOTICE_DETAIL_VOTE_DAT.notice_id, isouter=True)\
-            .group_by(models.NOTICE_DETAIL_DAT.id)\
-            .filter(models.NOTICE_DETAIL_DAT.deleted_at == None)\
-            .subquery('vote_sub_query')
-
-    comment_sub_query = db.query(models.NOTICE_DETAIL_DAT.id
-                                , func.count(models.NOTICE_DETAIL_COMMENT_DAT.id).label("notice_comment_cnt"))\
-            .join(models.NOTICE_DETAIL_COMMENT_DAT, models.NOTICE_DETAIL_DAT.id == models.NOTICE_DETAIL_COMMENT_DAT.notice_id, isouter=True)\
-            .group_by(models.NOTICE_DETAIL_DAT.id)\
-            .filter(models.NOTICE_DETAIL_DAT.deleted_at == None)\
-            .subquery('comment_sub_query')
-
-    return db.query(models.NOTICE_DETAIL_DAT.id
+async def get_notices(db: AsyncSession, params: Params, last_id: Optional[int] = None):
+    base_query = select(models.NOTICE_DETAIL_DAT.id)\
+            .where(models.NOTICE_DETAIL_DAT.deleted_at == None)
+    total = await db.scalar(select(func.count()).select_from(base_query.subquery()))
+
+    # last_idが指定された場合はkeyset(id < last_id)、それ以外はLIMIT/OFFSETでページのidのみ取得する
+    raw_params = params.to_raw_params()
+    page_query = base_query.order_by(models.NOTICE_DETAIL_DAT.id.desc())
+    if last_id is not None:
+        page_query = page_query.where(models.NOTICE_DETAIL_DAT.id < last_id)
+    else:
+        page_query = page_query.offset(raw_params.offset)
+    page_ids = (await db.scalars(page_query.limit(raw_params.limit))).all()
+
+    if not page_ids:
+        return Page.create(items=[], total=total, params=params)
+
+    items = (await db.execute(select(models.NOTICE_DETAIL_DAT.id
                     , models.NOTICE_DETAIL_DAT.title
                     , models.NOTICE_DETAIL_DAT.views
                     , models.NOTICE_DETAIL_DAT.created_at
                     , func.substring(models.USER.email, 1, func.instr(models.USER.email, '@') - 1).label("writer")
-                    , vote_sub_query.c.like_cnt
-                    , comment_sub_query.c.notice_comment_cnt)\
+                    , models.NOTICE_DETAIL_DAT.like_cnt
+                    , models.NOTICE_DETAIL_DAT.comment_cnt.label("notice_comment_cnt"))\
             .join(models.USER, models.NOTICE_DETAIL_DAT.user_id == models.USER.id)\
-            .join(vote_sub_query, models.NOTICE_DETAIL_DAT.id == vote_sub_query.c.id)\
-            .join(comment_sub_query, models.NOTICE_DETAIL_DAT.id == comment_sub_query.c.id)\
-            .filter(models.NOTICE_DETAIL_DAT.deleted_at == None)\
-            .order_by(models.NOTICE_DETAIL_DAT.id.desc())\
-            .group_by(models.NOTICE_DETAIL_DAT.id)\
+            .where(models.NOTICE_DETAIL_DAT.id.in_(page_ids))\
+            .order_by(models.NOTICE_DETAIL_DAT.id.desc())))\
             .all()
 
+    return Page.create(items=items, total=total, params=params)
 
-# Notice Detail
-def get_notice(db: Session, notice_id: int):
-    vote_sub_query = db.query(models.NOTICE_DETAIL_DAT.id
-                , func.sum(case([(models.NOTICE_DETAIL_VOTE_DAT.like == True, 1)], else_=0)).label("like_cnt")
-                , func.sum(case([(models.NOTICE_DETAIL_VOTE_DAT.hate == True, 1)], else_=0)).label("hate_cnt"))\
-            .join(models.NOTICE_DETAIL_VOTE_DAT, models.NOTICE_DETAIL_DAT.id == models.NOTICE_DETAIL_VOTE_DAT.notice_id, isouter=True)\
-            .group_by(models.NOTICE_DETAIL_DAT.id)\
-            .filter(models.NOTICE_DETAIL_DAT.id == notice_id)\
-            .filter(models.NOTICE_DETAIL_DAT.deleted_at == None)\
-            .subquery('vote_sub_query')
-
-    comment_sub_query = db.query(models.NOTICE_DETAIL_DAT.id
-                                , func.count(models.NOTICE_DETAIL_COMMENT_DAT.id).label("notice_comment_cnt"))\
-            .join(models.NOTICE_DETAIL_COMMENT_DAT, models.NOTICE_DETAIL_DAT.id == models.NOTICE_DETAIL_COMMENT_DAT.notice_id, isouter=True)\
-            .group_by(models.NOTICE_DETAIL_DAT.id)\
-            .filter(models.NOTICE_DETAIL_DAT.deleted_at == None)\
-            .filter(models.NOTICE_DETAIL_COMMENT_DAT.deleted_at == None)\
-            .subquery('comment_sub_query')
 
-    return db.query(models.NOTICE_DETAIL_DAT.id
+
+# 全文検索（title, contentのFULLTEXT ngram index、relevance順にDB側でページングする）
+async def search_notices(db: AsyncSession, q: str, params: Params):
+    relevance = match(models.NOTICE_DETAIL_DAT.title, models.NOTICE_DETAIL_DAT.content, against=q)
+    base_query = select(models.NOTICE_DETAIL_DAT.id)\
+            .where(relevance)\
+            .where(models.NOTICE_DETAIL_DAT.deleted_at == None)
+    total = await db.scalar(select(func.count()).select_from(base_query.subquery()))
+
+    raw_params = params.to_raw_params()
+    page_ids = (await db.scalars(base_query\
+            .order_by(relevance.desc(), models.NOTICE_DETAIL_DAT.id.desc())\
+            .offset(raw_params.offset)\
+            .limit(raw_params.limit))).all()
+
+    if not page_ids:
+        return Page.create(items=[], total=total, params=params)
+
+    rows = (await db.execute(select(models.NOTICE_DETAIL_DAT.id
+                    , models.NOTICE_DETAIL_DAT.title
+                    , models.NOTICE_DETAIL_DAT.views
+                    , models.NOTICE_DETAIL_DAT.created_at
+                    , func.substring(models.USER.email, 1, func.instr(models.USER.email, '@') - 1).label("writer")
+                    , models.NOTICE_DETAIL_DAT.like_cnt
+                    , models.NOTICE_DETAIL_DAT.comment_cnt.label("notice_comment_cnt"))\
+            .join(models.USER, models.NOTICE_DETAIL_DAT.user_id == models.USER.id)\
+            .where(models.NOTICE_DETAIL_DAT.id.in_(page_ids))))\
+            .all()
+
+    # relevance順（page_idsの順）に並べ直す
+    rows = {row.id: row for row in rows}
+    items = [rows[id] for id in page_ids if id in rows]
+
+    return Page.create(items=items, total=total, params=params)
+
+
+# Notice Detail
+async def get_notice(db: AsyncSession, notice_id: int):
+    return (await db.execute(select(models.NOTICE_DETAIL_DAT.id
                 , models.NOTICE_DETAIL_DAT.title
                 , models.NOTICE_DETAIL_DAT.content
                 , models.NOTICE_DETAIL_DAT.views
                 , models.NOTICE_DETAIL_DAT.created_at
                 , models.NOTICE_DETAIL_DAT.updated_at
-                , vote_sub_query.c.like_cnt
-                , vote_sub_query.c.hate_cnt
+                , models.NOTICE_DETAIL_DAT.like_cnt
+                , models.NOTICE_DETAIL_DAT.hate_cnt
                 , models.USER.id.label("writer_id")
-                , comment_sub_query.c.notice_comment_cnt
+                , models.NOTICE_DETAIL_DAT.comment_cnt.label("notice_comment_cnt")
                 , func.substring(models.USER.email, 1, func.instr(models.USER.email, '@') - 1).label("writer"))\
             .join(models.USER, models.NOTICE_DETAIL_DAT.user_id == models.USER.id)\
-            .join(comment_sub_query, models.NOTICE_DETAIL_DAT.id == comment_sub_query.c.id)\
-            .join(vote_sub_query, models.NOTICE_DETAIL_DAT.id == vote_sub_query.c.id)\
-            .filter(models.NOTICE_DETAIL_DAT.id == notice_id)\
+            .where(models.NOTICE_DETAIL_DAT.id == notice_id)\
+            .where(models.NOTICE_DETAIL_DAT.deleted_at == None)))\
             .first()
 
 
-# Notice View Count Update
-def update_notice_view_count(db: Session, notice_id: int):
-    db_notice = db.query(models.NOTICE_DETAIL_DAT).filter(models.NOTICE_DETAIL_DAT.id == notice_id).first()
-    db_notice.views = db_notice.views + 1
-    db.add(db_notice)
+# Notice Detail version（ETag用、USER joinなしのPK検索）
+async def get_notice_version(db: AsyncSession, notice_id: int):
+    return (await db.execute(select(models.NOTICE_DETAIL_DAT.updated_at
+                , models.NOTICE_DETAIL_DAT.views
+                , models.NOTICE_DETAIL_DAT.like_cnt
+                , models.NOTICE_DETAIL_DAT.hate_cnt
+                , models.NOTICE_DETAIL_DAT.comment_cnt)\
+            .where(models.NOTICE_DETAIL_DAT.id == notice_id)\
+            .where(models.NOTICE_DETAIL_DAT.deleted_at == None)))\
+            .first()
+
+
+# Notice Like, Hate, Comment Count Update（呼び出し側のtransactionでcommitする）
+async def update_notice_counts(db: AsyncSession, notice_id: int, like: int = 0, hate: int = 0, comment: int = 0):
+    await db.execute(update(models.NOTICE_DETAIL_DAT)\
+        .where(models.NOTICE_DETAIL_DAT.id == notice_id)\
+        .values({models.NOTICE_DETAIL_DAT.like_cnt: models.NOTICE_DETAIL_DAT.like_cnt + like
+                , models.NOTICE_DETAIL_DAT.hate_cnt: models.NOTICE_DETAIL_DAT.hate_cnt + hate
+                , models.NOTICE_DETAIL_DAT.comment_cnt: models.NOTICE_DETAIL_DAT.comment_cnt + comment
+                , models.NOTICE_DETAIL_DAT.updated_at: models.NOTICE_DETAIL_DAT.updated_at})\
+        .execution_options(synchronize_session=False))
+
+
+# Notice Like, Hate, Comment Count再集計（batch処理用）
+def rebuild_notice_counts(db: Session):
+    like_cnt = db.query(func.coalesce(func.sum(case([(models.NOTICE_DETAIL_VOTE_DAT.like == True, 1)], else_=0)), 0))\
+            .filter(models.NOTICE_DETAIL_VOTE_DAT.notice_id == models.NOTICE_DETAIL_DAT.id)\
+            .scalar_subquery()
+    hate_cnt = db.query(func.coalesce(func.sum(case([(models.NOTICE_DETAIL_VOTE_DAT.hate == True, 1)], else_=0)), 0))\
+            .filter(models.NOTICE_DETAIL_VOTE_DAT.notice_id == models.NOTICE_DETAIL_DAT.id)\
+            .scalar_subquery()
+    comment_cnt = db.query(func.count(models.NOTICE_DETAIL_COMMENT_DAT.id))\
+            .filter(models.NOTICE_DETAIL_COMMENT_DAT.notice_id == models.NOTICE_DETAIL_DAT.id)\
+            .filter(models.NOTICE_DETAIL_COMMENT_DAT.deleted_at == None)\
+            .scalar_subquery()
+
+    updated = db.query(models.NOTICE_DETAIL_DAT)\
+            .update({models.NOTICE_DETAIL_DAT.like_cnt: like_cnt
+                    , models.NOTICE_DETAIL_DAT.hate_cnt: hate_cnt
+                    , models.NOTICE_DETAIL_DAT.comment_cnt: comment_cnt
+                    , models.NOTICE_DETAIL_DAT.updated_at: models.NOTICE_DETAIL_DAT.updated_at}
+                    , synchronize_session=False)
     db.commit()
-    db.refresh(db_notice)
-    return get_notice(db=db, notice_id=db_notice.id)
+    return updated
+
+
+# Notice View Count Update（view_counterに溜めてまとめてDBに反映する）
+def update_notice_view_count(notice_id: int, views: int):
+    return views + view_counter.add(models.NOTICE_DETAIL_DAT, notice_id)
 
 
 # Notice Update
-def update_notice(db: Session, notice_id: int, notice: schemas.NoticeBase):
-    db_notice = db.query(models.NOTICE_DETAIL_DAT).filter(models.NOTICE_DETAIL_DAT.id == notice_id).first()
+async def update_notice(db: AsyncSession, notice_id: int, notice: schemas.NoticeBase):
+    db_notice = await db.get(models.NOTICE_DETAIL_DAT, notice_id)
     db_notice.title = notice.title
     db_notice.content = notice.content
     db.add(db_notice)
-    db.commit()
-    db.refresh(db_notice)
-    return get_notice(db=db, notice_id=db_notice.id)
+    await db.commit()
+    await db.refresh(db_notice)
+    return await get_notice(db=db, notice_id=db_notice.id)
 
 
 # Notice Delete
-def delete_notice(db: Session, notice_id: int):
-    db_notice = db.query(models.NOTICE_DETAIL_DAT).filter(models.NOTICE_DETAIL_DAT.id == notice_id).first()
+async def delete_notice(db: AsyncSession, notice_id: int):
+    db_notice = await db.get(models.NOTICE_DETAIL_DAT, notice_id)
     db_notice.deleted_at = get_datetime()
     db.add(db_notice)
-    db.commit()
-    db.refresh(db_notice)
+    await db.commit()
+    await db.refresh(db_notice)
     return JSONResponse(status_code=status.HTTP_200_OK, content={"detail": "Success"})
 
 
 # Notice Comment Create
-def create_notice_comment(db: Session, comment: schemas.CommentBase, notice_id: int, user_id: int):
+async def create_notice_comment(db: AsyncSession, comment: schemas.CommentBase, notice_id: int, user_id: int, params: Params, minimal: bool = False):
     db_comment = models.NOTICE_DETAIL_COMMENT_DAT(**comment.dict(), notice_id=notice_id, user_id=user_id)
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return get_notice_comments(db=db, notice_id=notice_id)
-
-
-# Notice Comment List
-def get_notice_comments(db: Session, notice_id: int):
-    return db.query(models.NOTICE_DETAIL_DAT.id
-                , models.NOTICE_DETAIL_COMMENT_DAT.id
+    await update_notice_counts(db=db, notice_id=notice_id, comment=1)
+    await db.commit()
+    if minimal:
+        return await get_notice_comment_result(db=db, db_comment=db_comment)
+    return await get_notice_comments(db=db, notice_id=notice_id, params=params)
+
+
+# Notice Comment List（(notice_id, id)のindexでkeyset paging）
+# last_id: last_idより古いコメントをsize件（新しい順）
+# after_id: after_idより新しいコメントをsize件（古い順、新着コメントのpolling用）
+async def get_notice_comments(db: AsyncSession, notice_id: int, params: Params, last_id: Optional[int] = None, after_id: Optional[int] = None):
+    total = await db.scalar(select(models.NOTICE_DETAIL_DAT.comment_cnt)\
+            .where(models.NOTICE_DETAIL_DAT.id == notice_id))
+
+    raw_params = params.to_raw_params()
+    query = select(models.NOTICE_DETAIL_COMMENT_DAT.id
                 , models.NOTICE_DETAIL_COMMENT_DAT.comment
                 , models.NOTICE_DETAIL_COMMENT_DAT.created_at
                 , models.NOTICE_DETAIL_COMMENT_DAT.updated_at
                 , models.USER.id.label("writer_id")
                 , func.substring(models.USER.email, 1, func.instr(models.USER.email, '@') - 1).label("writer"))\
-            .join(models.NOTICE_DETAIL_COMMENT_DAT, models.NOTICE_DETAIL_DAT.id == models.NOTICE_DETAIL_COMMENT_DAT.notice_id)\
             .join(models.USER, models.NOTICE_DETAIL_COMMENT_DAT.user_id == models.USER.id)\
-            .filter(models.NOTICE_DETAIL_DAT.id == notice_id)\
-            .filter(models.NOTICE_DETAIL_COMMENT_DAT.deleted_at == None)\
-            .order_by(models.NOTICE_DETAIL_COMMENT_DAT.id.desc())\
-            .all()
+            .where(models.NOTICE_DETAIL_COMMENT_DAT.notice_id == notice_id)\
+            .where(models.NOTICE_DETAIL_COMMENT_DAT.deleted_at == None)
+
+    if after_id is not None:
+        query = query.where(models.NOTICE_DETAIL_COMMENT_DAT.id > after_id)\
+            .order_by(models.NOTICE_DETAIL_COMMENT_DAT.id)
+    elif last_id is not None:
+        query = query.where(models.NOTICE_DETAIL_COMMENT_DAT.id < last_id)\
+            .order_by(models.NOTICE_DETAIL_COMMENT_DAT.id.desc())
+    else:
+        query = query.order_by(models.NOTICE_DETAIL_COMMENT_DAT.id.desc())\
+            .offset(raw_params.offset)
+
+    items = (await db.execute(query.limit(raw_params.limit))).all()
+
+    return Page.create(items=items, total=total or 0, params=params)
 
 
 # Notice Comment Detail
-def get_notice_comment(db: Session, comment_id: int):
-    return db.query(models.NOTICE_DETAIL_COMMENT_DAT)\
-            .filter(models.NOTICE_DETAIL_COMMENT_DAT.id == comment_id)\
-            .filter(models.NOTICE_DETAIL_COMMENT_DAT.deleted_at == None)\
+async def get_notice_comment(db: AsyncSession, comment_id: int):
+    return (await db.scalars(select(models.NOTICE_DETAIL_COMMENT_DAT)\
+            .where(models.NOTICE_DETAIL_COMMENT_DAT.id == comment_id)\
+            .where(models.NOTICE_DETAIL_COMMENT_DAT.deleted_at == None)))\
             .first()
 
 
+# Notice Comment更新結果（更新したコメントとcomment countのみ）
+async def get_notice_comment_result(db: AsyncSession, db_comment: models.NOTICE_DETAIL_COMMENT_DAT):
+    counts = await get_notice_version(db=db, notice_id=db_comment.notice_id)
+    return {"id": db_comment.id
+            , "notice_id": db_comment.notice_id
+            , "comment": db_comment.comment
+            , "created_at": db_comment.created_at
+            , "updated_at": db_comment.updated_at
+            , "deleted": db_comment.deleted_at is not None
+            , "comment_cnt": counts.comment_cnt if counts else 0}
+
+
 # Notice Comment Update
-def update_notice_comment(db: Session, comment_id: int, comment: schemas.CommentBase):
-    db_comment = db.query(models.NOTICE_DETAIL_COMMENT_DAT).filter(models.NOTICE_DETAIL_COMMENT_DAT.id == comment_id).first()
+async def update_notice_comment(db: AsyncSession, comment_id: int, comment: schemas.CommentBase, params: Params, minimal: bool = False):
+    db_comment = await db.get(models.NOTICE_DETAIL_COMMENT_DAT, comment_id)
     db_comment.comment = comment.comment
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return get_notice_comments(db=db, notice_id=db_comment.notice_id)
+    await db.commit()
+    if minimal:
+        return await get_notice_comment_result(db=db, db_comment=db_comment)
+    return await get_notice_comments(db=db, notice_id=db_comment.notice_id, params=params)
 
 
 # Notice Comment Delete
-def delete_notice_comment(db: Session, comment_id: int):
-    db_comment = db.query(models.NOTICE_DETAIL_COMMENT_DAT).filter(models.NOTICE_DETAIL_COMMENT_DAT.id == comment_id).first()
+async def delete_notice_comment(db: AsyncSession, comment_id: int, params: Params, minimal: bool = False):
+    db_comment = await db.get(models.NOTICE_DETAIL_COMMENT_DAT, comment_id)
     db_comment.deleted_at = get_datetime()
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return get_notice_comments(db=db, notice_id=db_comment.notice_id)
+    await update_notice_counts(db=db, notice_id=db_comment.notice_id, comment=-1)
+    await db.commit()
+    if minimal:
+        return await get_notice_comment_result(db=db, db_comment=db_comment)
+    return await get_notice_comments(db=db, notice_id=db_comment.notice_id, params=params)
+
+
+# Notice Like, Hate集計（投稿のcount + loginユーザーの投票を1回のqueryで取得する）
+async def get_vote_summary(db: AsyncSession, notice_id: int, user_id: Optional[int] = None):
+    # Loginしていない場合は投票をjoinしない
+    my_vote = ((models.NOTICE_DETAIL_VOTE_DAT.notice_id == models.NOTICE_DETAIL_DAT.id) & (models.NOTICE_DETAIL_VOTE_DAT.user_id == user_id)) if user_id is not None else false()
+    summary = (await db.execute(select(models.NOTICE_DETAIL_DAT.like_cnt
+                , models.NOTICE_DETAIL_DAT.hate_cnt
+                , models.NOTICE_DETAIL_VOTE_DAT.like
+                , models.NOTICE_DETAIL_VOTE_DAT.hate)\
+            .outerjoin(models.NOTICE_DETAIL_VOTE_DAT, my_vote)\
+            .where(models.NOTICE_DETAIL_DAT.id == notice_id)\
+            .where(models.NOTICE_DETAIL_DAT.deleted_at == None)))\
+            .first()
+
+    if summary is None:
+        return None
+    return {"like_cnt": summary.like_cnt
+            , "hate_cnt": summary.hate_cnt
+            , "my_vote": {"like": bool(summary.like), "hate": bool(summary.hate)} if summary.like is not None else None}
+
 
+# Notice Like, Hateリスト（管理者用、DB側でページングする）
+async def get_votes_page(db: AsyncSession, notice_id: int, params: Params):
+    total = await db.scalar(select(func.count(models.NOTICE_DETAIL_VOTE_DAT.id))\
+            .where(models.NOTICE_DETAIL_VOTE_DAT.notice_id == notice_id))
 
-# Notice Get Like, Hate
-def get_votes(db: Session, notice_id: int):
-    return db.query(models.NOTICE_DETAIL_VOTE_DAT)\
-            .filter(models.NOTICE_DETAIL_VOTE_DAT.notice_id == notice_id)\
+    raw_params = params.to_raw_params()
+    items = (await db.scalars(select(models.NOTICE_DETAIL_VOTE_DAT)\
+            .where(models.NOTICE_DETAIL_VOTE_DAT.notice_id == notice_id)\
+            .order_by(models.NOTICE_DETAIL_VOTE_DAT.id.desc())\
+            .offset(raw_params.offset)\
+            .limit(raw_params.limit)))\
             .all()
 
+    return Page.create(items=items, total=total, params=params)
+
 
 # Notice Set Like, Hate Update
-def update_vote(db: Session, vote: schemas.VoteUpdate, notice_id: int, user_id: int):
-    db_like = db.query(models.NOTICE_DETAIL_VOTE_DAT)\
-                .filter(models.NOTICE_DETAIL_VOTE_DAT.notice_id == notice_id)\
-                .filter(models.NOTICE_DETAIL_VOTE_DAT.user_id == user_id)\
-                .first()
-
-    if db_like:
-        db_like.like = vote.like
-        db_like.hate = vote.hate
-        db.add(db_like)
-        db.commit()
-        db.refresh(db_like)
-        return get_votes(db=db, notice_id=notice_id)
-
-    db_like = models.NOTICE_DETAIL_VOTE_DAT(**vote.dict(), notice_id=notice_id, user_id=user_id)
-    db.add(db_like)
-    db.commit()
-    db.refresh(db_like)
-    return get_votes(db=db, notice_id=notice_id)
+# (notice_id, user_id)のunique keyで1回のupsert（like_cnt, hate_cntはDBのtriggerで更新する）
+async def update_vote(db: AsyncSession, vote: schemas.VoteUpdate, notice_id: int, user_id: int, minimal: bool = False):
+    now = datetime.utcnow()
+    query = mysql_insert(models.NOTICE_DETAIL_VOTE_DAT)\
+            .values(notice_id=notice_id
+                    , user_id=user_id
+                    , like=int(bool(vote.like))
+                    , hate=int(bool(vote.hate))
+                    , created_at=now
+                    , updated_at=now)
+    await db.execute(query.on_duplicate_key_update(like=query.inserted.like
+                                                , hate=query.inserted.hate
+                                                , updated_at=query.inserted.updated_at))
+    await db.commit()
+    return await get_vote_result(db=db, vote=vote, notice_id=notice_id) if minimal else await get_vote_summary(db=db, notice_id=notice_id, user_id=user_id)
+
+
+# Like, Hate更新結果（自分の投票とlike, hate countのみ）
+async def get_vote_result(db: AsyncSession, vote: schemas.VoteUpdate, notice_id: int):
+    counts = await get_notice_version(db=db, notice_id=notice_id)
+    return {"like": bool(vote.like)
+            , "hate": bool(vote.hate)
+            , "like_cnt": counts.like_cnt if counts else 0
+            , "hate_cnt": counts.hate_cnt if counts else 0}
 
 
 def get_datetime():
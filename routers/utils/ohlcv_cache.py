@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Optional
+
+import numpy as np
+
+from db.config import settings
+
+
+COLUMNS = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+
+def empty_ohlcv():
+    data = {'Date': np.array([], dtype='datetime64[D]')}
+    for column in COLUMNS:
+        data[column] = np.array([], dtype='float64')
+    return data
+
+
+class FinanceDataReaderFetcher():
+    """
+    FinanceDataReaderから株価を取得する
+    """
+
+    def fetch(self, ticker: str, exchange: str, start: date, end: date):
+        import FinanceDataReader as fdr
+
+        df = fdr.DataReader(ticker, start.isoformat(), end.isoformat(), exchange=exchange)
+        data = {'Date': df.index.values.astype('datetime64[D]')}
+        for column in COLUMNS:
+            if column in df:
+                data[column] = df[column].to_numpy(dtype='float64')
+            else:
+                data[column] = np.full(len(df), np.nan)
+        return data
+
+
+class StubFetcher():
+    """
+    networkにアクセスしないfetcher（テスト・ローカル用）
+    data: {(ticker, exchange): {'Date': datetime64[D]の配列, 'Open': ..., ...}}
+    """
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.calls = list()
+
+    def fetch(self, ticker: str, exchange: str, start: date, end: date):
+        self.calls.append((ticker, exchange, start, end))
+        source = self.data.get((ticker, exchange))
+        if source is None:
+            return empty_ohlcv()
+        mask = (source['Date'] >= np.datetime64(start)) & (source['Date'] <= np.datetime64(end))
+        return {column: values[mask] for column, values in source.items()}
+
+
+class OhlcvCache():
+    """
+    ticker, exchangeごとに株価をcolumn単位の.npyファイルで保存する
+    保存済みの期間外のみfetcherから取得して、読み込みはmemory mapのsliceで返す
+    当日分はファイルに保存せず、today_ttl秒の間メモリのデータを返す
+    """
+
+    def __init__(self, root: str, fetcher, today_ttl: float):
+        self.root = root
+        self.fetcher = fetcher
+        self.today_ttl = today_ttl
+        self.today_entries = {}
+        self.lock = threading.Lock()
+        self.key_locks = defaultdict(threading.Lock)
+
+    def get(self, ticker: str, exchange: str, start: date, end: Optional[date] = None):
+        today = date.today()
+        end = min(end or today, today)
+        if start > end:
+            return empty_ohlcv()
+
+        # 当日分はまだ変わるため、ファイルには前日までを保存して、当日分はtoday_ttl秒メモリに保持する
+        history_end = min(end, today - timedelta(days=1))
+        path = self.path(ticker=ticker, exchange=exchange)
+        with self.key_lock(path):
+            meta = self.load_meta(path)
+            missing = self.missing_ranges(meta=meta, start=start, end=history_end) if start <= history_end else []
+            if missing:
+                data = self.load(path, meta, mmap_mode=None) if meta else empty_ohlcv()
+                for fetch_start, fetch_end in missing:
+                    data = self.merge(data, self.fetcher.fetch(ticker, exchange, fetch_start, fetch_end))
+                covered_start = min(start, date.fromisoformat(meta['start'])) if meta else start
+                covered_end = max(history_end, date.fromisoformat(meta['end'])) if meta else history_end
+                meta = self.save(path, self.slice(data, covered_start, covered_end), covered_start, covered_end, previous=meta)
+            current = self.get_today(ticker=ticker, exchange=exchange, path=path, today=today) if end == today else None
+
+        data = self.slice(self.load(path, meta), start, history_end) if meta and start <= history_end else empty_ohlcv()
+        if current is None or not len(current['Date']):
+            return data
+        return {column: np.concatenate([np.asarray(data[column]), current[column]]) for column in data}
+
+    # key lockを取った状態で呼ぶ
+    def get_today(self, ticker: str, exchange: str, path: str, today: date):
+        entry = self.today_entries.get(path)
+        if entry is None or entry[0] != today or time.monotonic() - entry[1] >= self.today_ttl:
+            entry = (today, time.monotonic(), self.fetcher.fetch(ticker, exchange, today, today))
+            self.today_entries[path] = entry
+        return entry[2]
+
+    def slice(self, data: dict, start: date, end: date):
+        dates = data['Date']
+        i = np.searchsorted(dates, np.datetime64(start), side='left')
+        j = np.searchsorted(dates, np.datetime64(end), side='right')
+        return {column: values[i:j] for column, values in data.items()}
+
+    def missing_ranges(self, meta: Optional[dict], start: date, end: date):
+        if not meta:
+            return [(start, end)]
+        covered_start = date.fromisoformat(meta['start'])
+        covered_end = date.fromisoformat(meta['end'])
+        missing = list()
+        if start < covered_start:
+            missing.append((start, covered_start - timedelta(days=1)))
+        if end > covered_end:
+            missing.append((covered_end + timedelta(days=1), end))
+        return missing
+
+    # 日付順に並べて、同じ日付は新しく取得したデータを優先する
+    def merge(self, data: dict, fetched: dict):
+        merged = {column: np.concatenate([np.asarray(data[column]), np.asarray(fetched[column])])
+                    for column in ('Date',) + COLUMNS}
+        reversed_dates = merged['Date'][::-1]
+        _, index = np.unique(reversed_dates, return_index=True)
+        index = len(reversed_dates) - 1 - index
+        return {column: values[index] for column, values in merged.items()}
+
+    def path(self, ticker: str, exchange: str):
+        safe = lambda value: "".join(c if c.isalnum() or c in "-_." else "_" for c in value)
+        return os.path.join(self.root, safe(exchange), safe(ticker))
+
+    def key_lock(self, path: str):
+        with self.lock:
+            return self.key_locks[path]
+
+    def load_meta(self, path: str):
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load(self, path: str, meta: dict, mmap_mode: Optional[str] = 'r'):
+        try:
+            return self.load_version(path, meta, mmap_mode)
+        except FileNotFoundError:
+            # 他のprocessが更新した場合はmetaを読み直す
+            return self.load_version(path, self.load_meta(path), mmap_mode)
+
+    def load_version(self, path: str, meta: dict, mmap_mode: Optional[str]):
+        version_path = os.path.join(path, meta['version'])
+        return {column: np.load(os.path.join(version_path, column + '.npy'), mmap_mode=mmap_mode)
+                for column in ('Date',) + COLUMNS}
+
+    # 新しいversionのディレクトリに保存してから、meta.jsonを置き換える
+    def save(self, path: str, data: dict, start: date, end: date, previous: Optional[dict] = None):
+        version = uuid.uuid4().hex
+        version_path = os.path.join(path, version)
+        os.makedirs(version_path)
+        for column in ('Date',) + COLUMNS:
+            np.save(os.path.join(version_path, column + '.npy'), np.ascontiguousarray(data[column]))
+
+        meta = {'version': version, 'start': start.isoformat(), 'end': end.isoformat()}
+        tmp_path = os.path.join(path, 'meta.json.' + version)
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+        if previous:
+            shutil.rmtree(os.path.join(path, previous['version']), ignore_errors=True)
+        return meta
+
+    # column → {日付: 値}の形式に変換する
+    def to_columns(self, data: dict):
+        dates = ['{}T00:00:00'.format(d) for d in data['Date'].astype(str)]
+        return {column: dict(zip(dates, [None if np.isnan(v) else v for v in data[column].tolist()]))
+                for column in COLUMNS}
+
+
+ohlcv_cache = OhlcvCache(root=settings.OHLCV_CACHE_DIR, fetcher=FinanceDataReaderFetcher(), today_ttl=settings.OHLCV_TODAY_TTL)
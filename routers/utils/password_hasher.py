@@ -0,0 +1,64 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from db.config import settings
+
+
+class PasswordHasher():
+    """
+    bcryptのhash, verifyを専用のthread poolで実行する（event loopを止めない）
+    bcryptは計算中GILを解放するので、workers数まで並列に計算できる
+    同時実行数を超えた分はqueue_timeout秒まで待ち、超えた場合は503を返す
+    """
+
+    def __init__(self, context: CryptContext, workers: int, queue_timeout: float):
+        self.context = context
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self.semaphore = None
+        self.loop = None
+
+    def get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self.semaphore is None or self.loop is not loop:
+            self.semaphore = asyncio.Semaphore(self.workers)
+            self.loop = loop
+        return self.semaphore
+
+    async def run(self, func, *args):
+        semaphore = self.get_semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Server is busy, please retry", headers={"Retry-After": "1"})
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            semaphore.release()
+
+    async def hash(self, password: str):
+        return await self.run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str):
+        return await self.run(self.context.verify, password, hashed_password)
+
+    # (一致するか, 新しいhash) を返す。bcryptのcostが設定と違う場合のみ新しいhashを返す
+    async def verify_and_update(self, password: str, hashed_password: str):
+        return await self.run(self.context.verify_and_update, password, hashed_password)
+
+
+# costが変わった場合、既存のhashはloginの時に作り直す（min, maxを同じcostにする）
+pwd_context = CryptContext(schemes=['bcrypt']
+                        , deprecated="auto"
+                        , bcrypt__default_rounds=settings.BCRYPT_ROUNDS
+                        , bcrypt__min_rounds=settings.BCRYPT_ROUNDS
+                        , bcrypt__max_rounds=settings.BCRYPT_ROUNDS)
+
+password_hasher = PasswordHasher(context=pwd_context
+                                , workers=settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+                                , queue_timeout=settings.PASSWORD_HASH_QUEUE_TIMEOUT)
@@ -0,0 +1,24 @@
+from typing import Optional
+
+from fastapi import Query, Request, Response
+
+
+def prefer_minimal(request: Request
+                    , response: Response
+                    , return_: Optional[str] = Query(None, alias="return", regex='^(minimal|representation)$')):
+    """
+    更新系APIのレスポンス形式（?return= または Prefer: return= ヘッダー）
+    minimal: 更新した行とcountのみ（デフォルト）
+    representation: 更新後の状態を再取得して返す（コメントはリスト、投票は集計）
+    """
+    preference = return_
+    if preference is None:
+        for value in request.headers.get('prefer', '').split(','):
+            name, _, token = value.strip().partition('=')
+            if name.strip().lower() == 'return' and token.strip().lower() in ('minimal', 'representation'):
+                preference = token.strip().lower()
+                break
+    preference = preference or 'minimal'
+
+    response.headers['Preference-Applied'] = f'return={preference}'
+    return preference == 'minimal'
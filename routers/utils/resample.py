@@ -0,0 +1,86 @@
+import numpy as np
+
+
+# interval -> numpy datetime64 unit
+INTERVAL_UNITS = {
+    '1m': 'm',
+    '1h': 'h',
+    '1d': 'D',
+}
+
+
+def resample_ohlc(times: np.ndarray, prices: np.ndarray, interval: str):
+    """
+    tickをinterval単位のbucketにまとめて、open/high/low/close/meanを返す
+    （bucketの境界はnp.uniqueで求め、集計はreduceatで行う）
+    """
+    unit = INTERVAL_UNITS[interval]
+
+    times = np.asarray(times, dtype='datetime64[us]')
+    prices = np.asarray(prices, dtype='float64')
+
+    valid = ~np.isnan(prices)
+    times, prices = times[valid], prices[valid]
+
+    order = np.argsort(times, kind='stable')
+    times, prices = times[order], prices[order]
+
+    buckets, starts, counts = np.unique(times.astype(f'datetime64[{unit}]'), return_index=True, return_counts=True)
+    if not len(buckets):
+        empty = np.array([], dtype='float64')
+        return {'time': buckets, 'open': empty, 'high': empty, 'low': empty, 'close': empty, 'mean': empty, 'count': counts}
+
+    return {
+        'time': buckets,
+        'open': prices[starts],
+        'high': np.maximum.reduceat(prices, starts),
+        'low': np.minimum.reduceat(prices, starts),
+        'close': prices[starts + counts - 1],
+        'mean': np.add.reduceat(prices, starts) / counts,
+        'count': counts,
+    }
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int):
+    """
+    Largest-Triangle-Three-Buckets で残す点のindexを返す
+    （最初と最後の点は必ず残す）
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+
+    # 最初と最後を除いた点をthreshold - 2個のbucketに分ける
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # 次のbucketの平均点（最後のbucketの次は最後の点）
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                       - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample(series: dict, max_points: int, key: str = 'close'):
+    """
+    bucket数がmax_pointsを超える場合、keyの系列でLTTBをかけて点を間引く
+    """
+    if len(series['time']) <= max_points:
+        return series
+
+    index = lttb(series['time'].astype('int64'), series[key], max_points)
+    return {name: values[index] for name, values in series.items()}
@@ -1,211 +1,365 @@
+from typing import Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case, distinct
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, distinct, select, update, false, true
+from sqlalchemy.dialects.mysql import match, insert as mysql_insert
+from fastapi_pagination import Page, Params
 from .. import models
+from .view_counter import view_counter
+from .hot_ranking import hot_ranking
 from ..stock import schemas
 from datetime import datetime
 from fastapi import status
 from fastapi.responses import JSONResponse
 
 
-def get_stocks_mst(db: Session):
-    return db.query(models.STOCK_MST).all()
+async def get_stocks_mst(db: AsyncSession):
+    return (await db.scalars(select(models.STOCK_MST))).all()
 
 
 # Category Check
-def get_stock_mst(db: Session, stock: str):
-    return db.query(models.STOCK_MST).filter(models.STOCK_MST.name == stock).first()
+async def get_stock_mst(db: AsyncSession, stock: str):
+    return (await db.scalars(select(models.STOCK_MST).where(models.STOCK_MST.name == stock))).first()
 
 
 # Stock List
-def get_stocks(db: Session, stock_id: int):
-    vote_sub_query = db.query(models.STOCK_DETAIL_DAT.id
-                            , func.sum(case([(models.STOCK_DETAIL_VOTE_DAT.like == True, 1)], else_=0)).label("like_cnt")
-                            , func.sum(case([(models.STOCK_DETAIL_VOTE_DAT.hate == True, 1)], else_=0)).label("hate_cnt"))\
-            .join(models.STOCK_DETAIL_VOTE_DAT, models.STOCK_DETAIL_DAT.id == models.STOCK_DETAIL_VOTE_DAT.stock_id, isouter=True)\
-            .group_by(models.STOCK_DETAIL_DAT.id)\
-            .filter(models.STOCK_DETAIL_DAT.deleted_at == None)\
-            .subquery('vote_sub_query')
-
-    comment_sub_query = db.query(models.STOCK_DETAIL_DAT.id
-                                , func.count(models.STOCK_DETAIL_COMMENT_DAT.id).label("notice_comment_cnt"))\
-            .join(models.STOCK_DETAIL_COMMENT_DAT, models.STOCK_DETAIL_DAT.id == models.STOCK_DETAIL_COMMENT_DAT.stock_id, isouter=True)\
-            .group_by(models.STOCK_DETAIL_DAT.id)\
-            .filter(models.STOCK_DETAIL_DAT.deleted_at == None)\
-            .subquery('comment_sub_query')
-
-    return db.query(models.STOCK_DETAIL_DAT.id
+async def get_stocks(db: AsyncSession, stock_id: int, params: Params, last_id: Optional[int] = None):
+    base_query = select(models.STOCK_DETAIL_DAT.id)\
+            .where(models.STOCK_DETAIL_DAT.stock_mst_id == stock_id)\
+            .where(models.STOCK_DETAIL_DAT.deleted_at == None)
+    total = await db.scalar(select(func.count()).select_from(base_query.subquery()))
+
+    # last_idが指定された場合はkeyset(id < last_id)、それ以外はLIMIT/OFFSETでページのidのみ取得する
+    raw_params = params.to_raw_params()
+    page_query = base_query.order_by(models.STOCK_DETAIL_DAT.id.desc())
+    if last_id is not None:
+        page_query = page_query.where(models.STOCK_DETAIL_DAT.id < last_id)
+    else:
+        page_query = page_query.offset(raw_params.offset)
+    page_ids = (await db.scalars(page_query.limit(raw_params.limit))).all()
+
+    if not page_ids:
+        return Page.create(items=[], total=total, params=params)
+
+    items = (await db.execute(select(models.STOCK_DETAIL_DAT.id
                     , models.STOCK_DETAIL_DAT.title
                     , models.STOCK_DETAIL_DAT.views
                     , models.STOCK_DETAIL_DAT.created_at
                     , func.substring(models.USER.email, 1, func.instr(models.USER.email, '@') - 1).label("writer")
-                    , vote_sub_query.c.like_cnt
-                    , comment_sub_query.c.notice_comment_cnt)\
+                    , models.STOCK_DETAIL_DAT.like_cnt
+                    , models.STOCK_DETAIL_DAT.comment_cnt.label("notice_comment_cnt"))\
             .join(models.USER, models.STOCK_DETAIL_DAT.user_id == models.USER.id)\
-            .join(vote_sub_query, models.STOCK_DETAIL_DAT.id == vote_sub_query.c.id)\
-            .join(comment_sub_query, models.STOCK_DETAIL_DAT.id == comment_sub_query.c.id)\
-            .join(models.STOCK_MST, models.STOCK_DETAIL_DAT.stock_mst_id == models.STOCK_MST.id)\
-            .filter(models.STOCK_MST.id == stock_id)\
-            .filter(models.STOCK_DETAIL_DAT.deleted_at == None)\
-            .order_by(models.STOCK_DETAIL_DAT.id.desc())\
-            .group_by(models.STOCK_DETAIL_DAT.id)\
+            .where(models.STOCK_DETAIL_DAT.id.in_(page_ids))\
+            .order_by(models.STOCK_DETAIL_DAT.id.desc())))\
             .all()
 
-# Stock Detail
-def get_stock(db: Session, stock_id: int):
-    vote_sub_query = db.query(models.STOCK_DETAIL_DAT.id
-                , func.sum(case([(models.STOCK_DETAIL_VOTE_DAT.like == True, 1)], else_=0)).label("like_cnt")
-                , func.sum(case([(models.STOCK_DETAIL_VOTE_DAT.hate == True, 1)], else_=0)).label("hate_cnt"))\
-            .join(models.STOCK_DETAIL_VOTE_DAT, models.STOCK_DETAIL_DAT.id == models.STOCK_DETAIL_VOTE_DAT.stock_id, isouter=True)\
-            .group_by(models.STOCK_DETAIL_DAT.id)\
-            .filter(models.STOCK_DETAIL_DAT.id == stock_id)\
-            .filter(models.STOCK_DETAIL_DAT.deleted_at == None)\
-            .subquery('vote_sub_query')
-
-    comment_sub_query = db.query(models.STOCK_DETAIL_DAT.id
-                                , func.count(models.STOCK_DETAIL_COMMENT_DAT.id).label("notice_comment_cnt"))\
-            .join(models.STOCK_DETAIL_COMMENT_DAT, models.STOCK_DETAIL_DAT.id == models.STOCK_DETAIL_COMMENT_DAT.stock_id, isouter=True)\
-            .group_by(models.STOCK_DETAIL_DAT.id)\
-            .filter(models.STOCK_DETAIL_DAT.deleted_at == None)\
-            .filter(models.STOCK_DETAIL_COMMENT_DAT.deleted_at == None)\
-            .subquery('comment_sub_query')
+    return Page.create(items=items, total=total, params=params)
+
+
+
+# 全文検索（title, contentのFULLTEXT ngram index、relevance順にDB側でページングする）
+async def search_stocks(db: AsyncSession, stock_id: int, q: str, params: Params):
+    relevance = match(models.STOCK_DETAIL_DAT.title, models.STOCK_DETAIL_DAT.content, against=q)
+    base_query = select(models.STOCK_DETAIL_DAT.id)\
+            .where(models.STOCK_DETAIL_DAT.stock_mst_id == stock_id)\
+            .where(relevance)\
+            .where(models.STOCK_DETAIL_DAT.deleted_at == None)
+    total = await db.scalar(select(func.count()).select_from(base_query.subquery()))
+
+    raw_params = params.to_raw_params()
+    page_ids = (await db.scalars(base_query\
+            .order_by(relevance.desc(), models.STOCK_DETAIL_DAT.id.desc())\
+            .offset(raw_params.offset)\
+            .limit(raw_params.limit))).all()
+
+    return Page.create(items=await get_stocks_by_ids(db=db, page_ids=page_ids), total=total, params=params)
 
-    return db.query(models.STOCK_DETAIL_DAT.id
+
+# hot ranking順のStock List（rankingからページのidを取得して、その分だけDBから読む）
+async def get_hot_stocks(db: AsyncSession, stock_id: int, params: Params):
+    raw_params = params.to_raw_params()
+    page_ids, total = hot_ranking.page(board_id=stock_id, offset=raw_params.offset, limit=raw_params.limit)
+    return Page.create(items=await get_stocks_by_ids(db=db, page_ids=page_ids), total=total, params=params)
+
+
+# page_idsの順で投稿リストを返す（削除された投稿は除く）
+async def get_stocks_by_ids(db: AsyncSession, page_ids: list):
+    if not page_ids:
+        return []
+
+    rows = (await db.execute(select(models.STOCK_DETAIL_DAT.id
+                    , models.STOCK_DETAIL_DAT.title
+                    , models.STOCK_DETAIL_DAT.views
+                    , models.STOCK_DETAIL_DAT.created_at
+                    , func.substring(models.USER.email, 1, func.instr(models.USER.email, '@') - 1).label("writer")
+                    , models.STOCK_DETAIL_DAT.like_cnt
+                    , models.STOCK_DETAIL_DAT.comment_cnt.label("notice_comment_cnt"))\
+            .join(models.USER, models.STOCK_DETAIL_DAT.user_id == models.USER.id)\
+            .where(models.STOCK_DETAIL_DAT.id.in_(page_ids))\
+            .where(models.STOCK_DETAIL_DAT.deleted_at == None)))\
+            .all()
+
+    rows = {row.id: row for row in rows}
+    return [rows[id] for id in page_ids if id in rows]
+
+
+# Stock Detail
+async def get_stock(db: AsyncSession, stock_id: int):
+    return (await db.execute(select(models.STOCK_DETAIL_DAT.id
                 , models.STOCK_DETAIL_DAT.title
                 , models.STOCK_DETAIL_DAT.content
                 , models.STOCK_DETAIL_DAT.views
                 , models.STOCK_DETAIL_DAT.created_at
                 , models.STOCK_DETAIL_DAT.updated_at
-                , vote_sub_query.c.like_cnt
-                , vote_sub_query.c.hate_cnt
+                , models.STOCK_DETAIL_DAT.like_cnt
+                , models.STOCK_DETAIL_DAT.hate_cnt
+                , models.STOCK_DETAIL_DAT.stock_mst_id
                 , models.USER.id.label("writer_id")
-                , comment_sub_query.c.notice_comment_cnt
+                , models.STOCK_DETAIL_DAT.comment_cnt.label("notice_comment_cnt")
                 , func.substring(models.USER.email, 1, func.instr(models.USER.email, '@') - 1).label("writer"))\
             .join(models.USER, models.STOCK_DETAIL_DAT.user_id == models.USER.id)\
-            .join(comment_sub_query, models.STOCK_DETAIL_DAT.id == comment_sub_query.c.id)\
-            .join(vote_sub_query, models.STOCK_DETAIL_DAT.id == vote_sub_query.c.id)\
-            .filter(models.STOCK_DETAIL_DAT.id == stock_id)\
+            .where(models.STOCK_DETAIL_DAT.id == stock_id)\
+            .where(models.STOCK_DETAIL_DAT.deleted_at == None)))\
             .first()
 
+
+# Stock Detail version（ETag用、USER joinなしのPK検索）
+async def get_stock_version(db: AsyncSession, stock_id: int):
+    return (await db.execute(select(models.STOCK_DETAIL_DAT.updated_at
+                , models.STOCK_DETAIL_DAT.views
+                , models.STOCK_DETAIL_DAT.like_cnt
+                , models.STOCK_DETAIL_DAT.hate_cnt
+                , models.STOCK_DETAIL_DAT.comment_cnt)\
+            .where(models.STOCK_DETAIL_DAT.id == stock_id)\
+            .where(models.STOCK_DETAIL_DAT.deleted_at == None)))\
+            .first()
+
+
+# Stock Like, Hate, Comment Count Update（呼び出し側のtransactionでcommitする）
+async def update_stock_counts(db: AsyncSession, stock_id: int, like: int = 0, hate: int = 0, comment: int = 0):
+    await db.execute(update(models.STOCK_DETAIL_DAT)\
+        .where(models.STOCK_DETAIL_DAT.id == stock_id)\
+        .values({models.STOCK_DETAIL_DAT.like_cnt: models.STOCK_DETAIL_DAT.like_cnt + like
+                , models.STOCK_DETAIL_DAT.hate_cnt: models.STOCK_DETAIL_DAT.hate_cnt + hate
+                , models.STOCK_DETAIL_DAT.comment_cnt: models.STOCK_DETAIL_DAT.comment_cnt + comment
+                , models.STOCK_DETAIL_DAT.updated_at: models.STOCK_DETAIL_DAT.updated_at})\
+        .execution_options(synchronize_session=False))
+
+
+# Stock Like, Hate, Comment Count再集計（batch処理用）
+def rebuild_stock_counts(db: Session):
+    like_cnt = db.query(func.coalesce(func.sum(case([(models.STOCK_DETAIL_VOTE_DAT.like == True, 1)], else_=0)), 0))\
+            .filter(models.STOCK_DETAIL_VOTE_DAT.stock_id == models.STOCK_DETAIL_DAT.id)\
+            .scalar_subquery()
+    hate_cnt = db.query(func.coalesce(func.sum(case([(models.STOCK_DETAIL_VOTE_DAT.hate == True, 1)], else_=0)), 0))\
+            .filter(models.STOCK_DETAIL_VOTE_DAT.stock_id == models.STOCK_DETAIL_DAT.id)\
+            .scalar_subquery()
+    comment_cnt = db.query(func.count(models.STOCK_DETAIL_COMMENT_DAT.id))\
+            .filter(models.STOCK_DETAIL_COMMENT_DAT.stock_id == models.STOCK_DETAIL_DAT.id)\
+            .filter(models.STOCK_DETAIL_COMMENT_DAT.deleted_at == None)\
+            .scalar_subquery()
+
+    updated = db.query(models.STOCK_DETAIL_DAT)\
+            .update({models.STOCK_DETAIL_DAT.like_cnt: like_cnt
+                    , models.STOCK_DETAIL_DAT.hate_cnt: hate_cnt
+                    , models.STOCK_DETAIL_DAT.comment_cnt: comment_cnt
+                    , models.STOCK_DETAIL_DAT.updated_at: models.STOCK_DETAIL_DAT.updated_at}
+                    , synchronize_session=False)
+    db.commit()
+    return updated
+
+
 # Stock Create
-def create_stock(db: Session, stock: schemas.StockBase, user_id: int, stock_mst_id: int):
+async def create_stock(db: AsyncSession, stock: schemas.StockBase, user_id: int, stock_mst_id: int):
     db_stock = models.STOCK_DETAIL_DAT(**stock.dict(), user_id=user_id, stock_mst_id=stock_mst_id)
     db.add(db_stock)
-    db.commit()
-    db.refresh(db_stock)
-    return get_stock(db=db, stock_id=db_stock.id)
+    await db.commit()
+    await db.refresh(db_stock)
+    return await get_stock(db=db, stock_id=db_stock.id)
 
 
-# Stock View Count Update
-def update_stock_view_count(db: Session, stock_id: int):
-    db_stock = db.query(models.STOCK_DETAIL_DAT).filter(models.STOCK_DETAIL_DAT.id == stock_id).first()
-    db_stock.views = db_stock.views + 1
-    db.add(db_stock)
-    db.commit()
-    db.refresh(db_stock)
-    return get_stock(db=db, stock_id=db_stock.id)
+# Stock View Count Update（view_counterに溜めてまとめてDBに反映する）
+def update_stock_view_count(stock_id: int, views: int, stock_mst_id: Optional[int] = None):
+    hot_ranking.record(board_id=stock_mst_id, post_id=stock_id, kind='view')
+    return views + view_counter.add(models.STOCK_DETAIL_DAT, stock_id)
+
 
 # Stock Update
-def update_stock(db: Session, stock_id: int, stock: schemas.StockBase):
-    db_stock = db.query(models.STOCK_DETAIL_DAT).filter(models.STOCK_DETAIL_DAT.id == stock_id).first()
+async def update_stock(db: AsyncSession, stock_id: int, stock: schemas.StockBase):
+    db_stock = await db.get(models.STOCK_DETAIL_DAT, stock_id)
     db_stock.title = stock.title
     db_stock.content = stock.content
     db.add(db_stock)
-    db.commit()
-    db.refresh(db_stock)
-    return get_stock(db=db, stock_id=db_stock.id)
+    await db.commit()
+    await db.refresh(db_stock)
+    return await get_stock(db=db, stock_id=db_stock.id)
 
 
 # Stock Delete
-def delete_stock(db: Session, stock_id: int):
-    db_stock = db.query(models.STOCK_DETAIL_DAT).filter(models.STOCK_DETAIL_DAT.id == stock_id).first()
+async def delete_stock(db: AsyncSession, stock_id: int):
+    db_stock = await db.get(models.STOCK_DETAIL_DAT, stock_id)
     db_stock.deleted_at = get_datetime()
     db.add(db_stock)
-    db.commit()
-    db.refresh(db_stock)
+    await db.commit()
+    await db.refresh(db_stock)
+    hot_ranking.remove(board_id=db_stock.stock_mst_id, post_id=stock_id)
     return JSONResponse(status_code=status.HTTP_200_OK, content={"detail": "Success"})
 
 
 # Stock Comment Create
-def create_stock_comment(db: Session, comment: schemas.CommentBase, stock_id: int, user_id: int):
+async def create_stock_comment(db: AsyncSession, comment: schemas.CommentBase, stock_id: int, user_id: int, params: Params, minimal: bool = False, stock_mst_id: Optional[int] = None):
     db_comment = models.STOCK_DETAIL_COMMENT_DAT(**comment.dict(), stock_id=stock_id, user_id=user_id)
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return get_stock_comments(db=db, stock_id=stock_id)
-
-
-# Stock Comment List
-def get_stock_comments(db: Session, stock_id: int):
-    return db.query(models.STOCK_DETAIL_DAT.id
-                , models.STOCK_DETAIL_COMMENT_DAT.id
+    await update_stock_counts(db=db, stock_id=stock_id, comment=1)
+    await db.commit()
+    hot_ranking.record(board_id=stock_mst_id, post_id=stock_id, kind='comment')
+    if minimal:
+        return await get_stock_comment_result(db=db, db_comment=db_comment)
+    return await get_stock_comments(db=db, stock_id=stock_id, params=params)
+
+
+# Stock Comment List（(stock_id, id)のindexでkeyset paging）
+# last_id: last_idより古いコメントをsize件（新しい順）
+# after_id: after_idより新しいコメントをsize件（古い順、新着コメントのpolling用）
+async def get_stock_comments(db: AsyncSession, stock_id: int, params: Params, last_id: Optional[int] = None, after_id: Optional[int] = None):
+    total = await db.scalar(select(models.STOCK_DETAIL_DAT.comment_cnt)\
+            .where(models.STOCK_DETAIL_DAT.id == stock_id))
+
+    raw_params = params.to_raw_params()
+    query = select(models.STOCK_DETAIL_COMMENT_DAT.id
                 , models.STOCK_DETAIL_COMMENT_DAT.comment
                 , models.STOCK_DETAIL_COMMENT_DAT.created_at
                 , models.STOCK_DETAIL_COMMENT_DAT.updated_at
                 , models.USER.id.label("writer_id")
                 , func.substring(models.USER.email, 1, func.instr(models.USER.email, '@') - 1).label("writer"))\
-            .join(models.STOCK_DETAIL_COMMENT_DAT, models.STOCK_DETAIL_DAT.id == models.STOCK_DETAIL_COMMENT_DAT.stock_id)\
             .join(models.USER, models.STOCK_DETAIL_COMMENT_DAT.user_id == models.USER.id)\
-            .filter(models.STOCK_DETAIL_DAT.id == stock_id)\
-            .filter(models.STOCK_DETAIL_COMMENT_DAT.deleted_at == None)\
-            .order_by(models.STOCK_DETAIL_COMMENT_DAT.id.desc())\
-            .all()
+            .where(models.STOCK_DETAIL_COMMENT_DAT.stock_id == stock_id)\
+            .where(models.STOCK_DETAIL_COMMENT_DAT.deleted_at == None)
+
+    if after_id is not None:
+        query = query.where(models.STOCK_DETAIL_COMMENT_DAT.id > after_id)\
+            .order_by(models.STOCK_DETAIL_COMMENT_DAT.id)
+    elif last_id is not None:
+        query = query.where(models.STOCK_DETAIL_COMMENT_DAT.id < last_id)\
+            .order_by(models.STOCK_DETAIL_COMMENT_DAT.id.desc())
+    else:
+        query = query.order_by(models.STOCK_DETAIL_COMMENT_DAT.id.desc())\
+            .offset(raw_params.offset)
+
+    items = (await db.execute(query.limit(raw_params.limit))).all()
+
+    return Page.create(items=items, total=total or 0, params=params)
 
 
 # Stock Comment Detail
-def get_stock_comment(db: Session, comment_id: int):
-    return db.query(models.STOCK_DETAIL_COMMENT_DAT)\
-            .filter(models.STOCK_DETAIL_COMMENT_DAT.id == comment_id)\
-            .filter(models.STOCK_DETAIL_COMMENT_DAT.deleted_at == None)\
+async def get_stock_comment(db: AsyncSession, comment_id: int):
+    return (await db.scalars(select(models.STOCK_DETAIL_COMMENT_DAT)\
+            .where(models.STOCK_DETAIL_COMMENT_DAT.id == comment_id)\
+            .where(models.STOCK_DETAIL_COMMENT_DAT.deleted_at == None)))\
             .first()
 
 
+# Stock Comment更新結果（更新したコメントとcomment countのみ）
+async def get_stock_comment_result(db: AsyncSession, db_comment: models.STOCK_DETAIL_COMMENT_DAT):
+    counts = await get_stock_version(db=db, stock_id=db_comment.stock_id)
+    return {"id": db_comment.id
+            , "stock_id": db_comment.stock_id
+            , "comment": db_comment.comment
+            , "created_at": db_comment.created_at
+            , "updated_at": db_comment.updated_at
+            , "deleted": db_comment.deleted_at is not None
+            , "comment_cnt": counts.comment_cnt if counts else 0}
+
+
 # Stock Comment Update
-def update_stock_comment(db: Session, comment_id: int, comment: schemas.CommentBase):
-    db_comment = db.query(models.STOCK_DETAIL_COMMENT_DAT).filter(models.STOCK_DETAIL_COMMENT_DAT.id == comment_id).first()
+async def update_stock_comment(db: AsyncSession, comment_id: int, comment: schemas.CommentBase, params: Params, minimal: bool = False):
+    db_comment = await db.get(models.STOCK_DETAIL_COMMENT_DAT, comment_id)
     db_comment.comment = comment.comment
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return get_stock_comments(db=db, stock_id=db_comment.stock_id)
+    await db.commit()
+    if minimal:
+        return await get_stock_comment_result(db=db, db_comment=db_comment)
+    return await get_stock_comments(db=db, stock_id=db_comment.stock_id, params=params)
 
 
 # Stock Comment Delete
-def delete_stock_comment(db: Session, comment_id: int):
-    db_comment = db.query(models.STOCK_DETAIL_COMMENT_DAT).filter(models.STOCK_DETAIL_COMMENT_DAT.id == comment_id).first()
+async def delete_stock_comment(db: AsyncSession, comment_id: int, params: Params, minimal: bool = False):
+    db_comment = await db.get(models.STOCK_DETAIL_COMMENT_DAT, comment_id)
     db_comment.deleted_at = get_datetime()
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return get_stock_comments(db=db, stock_id=db_comment.stock_id)
+    await update_stock_counts(db=db, stock_id=db_comment.stock_id, comment=-1)
+    await db.commit()
+    if minimal:
+        return await get_stock_comment_result(db=db, db_comment=db_comment)
+    return await get_stock_comments(db=db, stock_id=db_comment.stock_id, params=params)
+
+
+# Stock Like, Hate集計（投稿のcount + loginユーザーの投票を1回のqueryで取得する）
+async def get_vote_summary(db: AsyncSession, stock_id: int, user_id: Optional[int] = None, stock_mst_id: Optional[int] = None):
+    # Loginしていない場合は投票をjoinしない
+    my_vote = ((models.STOCK_DETAIL_VOTE_DAT.stock_id == models.STOCK_DETAIL_DAT.id) & (models.STOCK_DETAIL_VOTE_DAT.user_id == user_id)) if user_id is not None else false()
+    summary = (await db.execute(select(models.STOCK_DETAIL_DAT.like_cnt
+                , models.STOCK_DETAIL_DAT.hate_cnt
+                , models.STOCK_DETAIL_VOTE_DAT.like
+                , models.STOCK_DETAIL_VOTE_DAT.hate)\
+            .outerjoin(models.STOCK_DETAIL_VOTE_DAT, my_vote)\
+            .where(models.STOCK_DETAIL_DAT.id == stock_id)\
+            .where(models.STOCK_DETAIL_DAT.deleted_at == None)\
+            .where(true() if stock_mst_id is None else models.STOCK_DETAIL_DAT.stock_mst_id == stock_mst_id)))\
+            .first()
+
+    if summary is None:
+        return None
+    return {"like_cnt": summary.like_cnt
+            , "hate_cnt": summary.hate_cnt
+            , "my_vote": {"like": bool(summary.like), "hate": bool(summary.hate)} if summary.like is not None else None}
 
 
-# Stock Get Like, Hate
-def get_votes(db: Session, stock_id: int):
-    return db.query(models.STOCK_DETAIL_VOTE_DAT)\
-            .filter(models.STOCK_DETAIL_VOTE_DAT.stock_id == stock_id)\
+# Stock Like, Hateリスト（管理者用、DB側でページングする）
+async def get_votes_page(db: AsyncSession, stock_id: int, params: Params):
+    total = await db.scalar(select(func.count(models.STOCK_DETAIL_VOTE_DAT.id))\
+            .where(models.STOCK_DETAIL_VOTE_DAT.stock_id == stock_id))
+
+    raw_params = params.to_raw_params()
+    items = (await db.scalars(select(models.STOCK_DETAIL_VOTE_DAT)\
+            .where(models.STOCK_DETAIL_VOTE_DAT.stock_id == stock_id)\
+            .order_by(models.STOCK_DETAIL_VOTE_DAT.id.desc())\
+            .offset(raw_params.offset)\
+            .limit(raw_params.limit)))\
             .all()
 
+    return Page.create(items=items, total=total, params=params)
+
 
 # Stock Set Like, Hate Update
-def update_vote(db: Session, vote: schemas.VoteUpdate, stock_id: int, user_id: int):
-    db_like = db.query(models.STOCK_DETAIL_VOTE_DAT)\
-                .filter(models.STOCK_DETAIL_VOTE_DAT.stock_id == stock_id)\
-                .filter(models.STOCK_DETAIL_VOTE_DAT.user_id == user_id)\
-                .first()
-
-    if db_like:
-        db_like.like = vote.like
-        db_like.hate = vote.hate
-        db.add(db_like)
-        db.commit()
-        db.refresh(db_like)
-        return get_votes(db=db, stock_id=stock_id)
-
-    db_like = models.STOCK_DETAIL_VOTE_DAT(**vote.dict(), stock_id=stock_id, user_id=user_id)
-    db.add(db_like)
-    db.commit()
-    db.refresh(db_like)
-    return get_votes(db=db, stock_id=stock_id)
+# (stock_id, user_id)のunique keyで1回のupsert（like_cnt, hate_cntはDBのtriggerで更新する）
+async def update_vote(db: AsyncSession, vote: schemas.VoteUpdate, stock_id: int, user_id: int, minimal: bool = False, stock_mst_id: Optional[int] = None):
+    now = datetime.utcnow()
+    query = mysql_insert(models.STOCK_DETAIL_VOTE_DAT)\
+            .values(stock_id=stock_id
+                    , user_id=user_id
+                    , like=int(bool(vote.like))
+                    , hate=int(bool(vote.hate))
+                    , created_at=now
+                    , updated_at=now)
+    vote_dat = models.STOCK_DETAIL_VOTE_DAT.__table__.c
+    unchanged = (vote_dat.like == query.inserted.like) & (vote_dat.hate == query.inserted.hate)
+    # hot rankingのLikeはrefreshでupdated_atから読み込むので、同じ投票を繰り返した場合はupdated_atを変えない
+    # （MySQLは左から順に代入するので、like, hateより先にupdated_atを判定する）
+    await db.execute(query.on_duplicate_key_update([("updated_at", case((unchanged, vote_dat.updated_at), else_=query.inserted.updated_at))
+                                                , ("like", query.inserted.like)
+                                                , ("hate", query.inserted.hate)]))
+    await db.commit()
+    return await get_vote_result(db=db, vote=vote, stock_id=stock_id) if minimal else await get_vote_summary(db=db, stock_id=stock_id, user_id=user_id, stock_mst_id=stock_mst_id)
+
+
+# Like, Hate更新結果（自分の投票とlike, hate countのみ）
+async def get_vote_result(db: AsyncSession, vote: schemas.VoteUpdate, stock_id: int):
+    counts = await get_stock_version(db=db, stock_id=stock_id)
+    return {"like": bool(vote.like)
+            , "hate": bool(vote.hate)
+            , "like_cnt": counts.like_cnt if counts else 0
+            , "hate_cnt": counts.hate_cnt if counts else 0}
 
 
 def get_datetime():
@@ -0,0 +1,80 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from db.config import settings
+
+
+class TokenCache():
+    """
+    検証済みaccess tokenのclaimsをメモリに保持する（LRU + TTL）
+    keyはtokenのsha256、tokenのexpまたはttl秒の早い方で期限切れになる
+    invalidate, invalidate_userはcacheから消すだけで、tokenは失効しない（次のrequestで再検証され、expまで有効）
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.user_keys = {}
+
+    def key(self, token: str):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str):
+        key = self.key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return dict(claims)
+
+    def set(self, token: str, claims: dict, exp: float):
+        if self.maxsize <= 0:
+            return
+        key = self.key(token)
+        expires_at = min(exp, time.time() + self.ttl)
+        with self.lock:
+            self.entries[key] = (dict(claims), expires_at)
+            self.entries.move_to_end(key)
+            self.user_keys.setdefault(claims.get('user_id'), set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self.remove(next(iter(self.entries)))
+
+    # lockを取った状態で呼ぶ
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[0].get('user_id')
+        keys = self.user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.user_keys[user_id]
+
+    # tokenのcacheを消す（token失効の仕組みと組み合わせて使う）
+    def invalidate(self, token: str):
+        with self.lock:
+            self.remove(self.key(token))
+
+    # ユーザーのtokenのcacheを全て消す
+    def invalidate_user(self, user_id: int):
+        with self.lock:
+            for key in list(self.user_keys.get(user_id, ())):
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.user_keys.clear()
+
+
+token_cache = TokenCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
@@ -0,0 +1,172 @@
+import math
+import asyncio
+import logging
+import time
+import hashlib
+import unicodedata
+from typing import Optional
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.config import settings
+from db.session import AsyncSessionLocal
+from .. import models
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter():
+    """
+    false negativeがないset（false positiveはerror_rateの確率で発生する）
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    # double hashing（sha256の前半・後半の64bitからhash_count個の位置を作る）
+    def positions(self, value: str):
+        digest = hashlib.sha256(value.encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    # 既にある値は数えない（syncで同じユーザーを読み直すため）
+    def add(self, value: str):
+        positions = self.positions(value)
+        if all(self.bits[position >> 3] & (1 << (position & 7)) for position in positions):
+            return
+        for position in positions:
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+
+# MySQLのcollation（大文字小文字・アクセントを区別しない、末尾の空白を無視する）より広く一致させる
+def normalize(value: str):
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return value.casefold().rstrip(' ')
+
+
+class UserExistenceFilter():
+    """
+    username, emailの重複チェック用Bloom filter
+    filterにない値は存在しないことが確定するのでDBに問い合わせない
+    起動時にbackgroundで全件から作り（完成するまではDBに問い合わせる）、sync_interval秒ごとに他のworkerで登録されたユーザーを追加する
+
+    syncは読んだ最新のcreated_atからoverlap秒前以降のユーザーを毎回読み直す
+    （idの順番とcommitの順番が違う場合や、workerの時計のずれで読み落とさないため）
+    他のworkerで登録されたユーザーは最大sync_interval秒filterにないので、重複チェックで見つからない場合がある
+    （signup自体はUSERのunique keyで409になる。このworkerで登録したユーザーはcommit後すぐに追加する）
+    """
+
+    def __init__(self, capacity: int, error_rate: float, sync_interval: float, overlap: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.usernames = None
+        self.emails = None
+        self.watermark = None
+        self.synced_at = 0.0
+        self.syncing = False
+        self.task = None
+
+    def add(self, username: str = None, email: str = None):
+        if self.usernames is None:
+            return
+        if username:
+            self.usernames.add(normalize(username))
+        if email:
+            self.emails.add(normalize(email))
+
+    # watermarkのoverlap秒前以降に登録されたユーザー（Noneの場合は全件）をfilterに追加して、最新のcreated_atを返す
+    async def load(self, db: AsyncSession, usernames: BloomFilter, emails: BloomFilter, watermark: Optional[datetime]):
+        query = select(models.USER.created_at
+                    , models.USER.username
+                    , models.USER.email)
+        if watermark is not None:
+            query = query.where(models.USER.created_at >= watermark - self.overlap)
+        result = await db.stream(query.execution_options(yield_per=settings.USER_FILTER_BUILD_BATCH_SIZE))
+        async for created_at, username, email in result:
+            if username:
+                usernames.add(normalize(username))
+            if email:
+                emails.add(normalize(email))
+            if watermark is None or created_at > watermark:
+                watermark = created_at
+        return watermark
+
+    # 別のfilterに全件を読み込んでから入れ替える（作成中のfilterでは判定しない）
+    async def build(self, db: AsyncSession):
+        self.syncing = True
+        try:
+            # 件数がcapacityを超えるとfalse positiveが増えるので大きくして作り直す
+            while self.usernames is not None and self.usernames.count > self.capacity:
+                self.capacity *= 2
+            usernames = BloomFilter(self.capacity, self.error_rate)
+            emails = BloomFilter(self.capacity, self.error_rate)
+            self.watermark = await self.load(db=db, usernames=usernames, emails=emails, watermark=None)
+            self.usernames, self.emails = usernames, emails
+            self.synced_at = time.monotonic()
+        finally:
+            self.syncing = False
+
+    # 全件の読み込みはbackgroundで行う（作成中はfilterがないのでDBに問い合わせる）
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.build_in_background())
+
+    async def build_in_background(self):
+        try:
+            async with AsyncSessionLocal() as db:
+                await self.build(db=db)
+        except Exception:
+            # sync_interval秒後のsyncでもう一度作る
+            logger.exception("user filter build failed")
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def sync(self, db: AsyncSession):
+        if self.syncing or time.monotonic() - self.synced_at < self.sync_interval:
+            return
+        if self.usernames is None or self.usernames.count > self.capacity:
+            self.synced_at = time.monotonic()
+            self.start()
+            return
+        self.syncing = True
+        try:
+            self.watermark = await self.load(db=db, usernames=self.usernames, emails=self.emails, watermark=self.watermark)
+            self.synced_at = time.monotonic()
+        finally:
+            self.syncing = False
+
+    # Falseの場合は確実に存在しない（filterがまだない場合はTrue）
+    async def might_have_username(self, db: AsyncSession, username: str):
+        await self.sync(db=db)
+        return self.usernames is None or normalize(username) in self.usernames
+
+    async def might_have_email(self, db: AsyncSession, email: str):
+        await self.sync(db=db)
+        return self.emails is None or normalize(email) in self.emails
+
+
+user_filter = UserExistenceFilter(capacity=settings.USER_FILTER_CAPACITY
+                                , error_rate=settings.USER_FILTER_ERROR_RATE
+                                , sync_interval=settings.USER_FILTER_SYNC_INTERVAL
+                                , overlap=settings.USER_FILTER_SYNC_OVERLAP)
@@ -0,0 +1,101 @@
+import logging
+import threading
+from collections import defaultdict
+
+from db.config import settings
+from db.session import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCountBuffer():
+    """
+    投稿のview countをメモリに溜めて、一定間隔または一定件数ごとに
+    UPDATE ... SET views = views + n でまとめてDBに反映する
+    """
+
+    def __init__(self, flush_interval: float, flush_size: int):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)
+        self.pending_total = 0
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # view countを１足して、まだDBに反映していない件数を返す
+    def add(self, model, post_id: int):
+        with self.lock:
+            self.pending[(model, post_id)] += 1
+            self.pending_total += 1
+            count = self.pending[(model, post_id)]
+            if self.pending_total >= self.flush_size:
+                self.wakeup.set()
+        return count
+
+    # まだDBに反映していない件数
+    def get(self, model, post_id: int):
+        with self.lock:
+            return self.pending.get((model, post_id), 0)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(int)
+            self.pending_total = 0
+        if not pending:
+            return 0
+
+        # 同じ増加数の投稿は１つのUPDATEにまとめる
+        batches = defaultdict(list)
+        for (model, post_id), count in pending.items():
+            batches[(model, count)].append(post_id)
+
+        db = SessionLocal()
+        try:
+            for (model, count), post_ids in batches.items():
+                db.query(model)\
+                    .filter(model.id.in_(post_ids))\
+                    .update({model.views: model.views + count
+                            , model.updated_at: model.updated_at}
+                            , synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 反映できなかった分は次回のflushで再度反映する
+            with self.lock:
+                for key, count in pending.items():
+                    self.pending[key] += count
+                    self.pending_total += count
+            logger.exception("view count flush failed")
+            return 0
+        finally:
+            db.close()
+        return sum(pending.values())
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(timeout=self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="view-count-flush", daemon=True)
+        self.thread.start()
+
+    # 停止して残りをDBに反映する
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.wakeup.set()
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+
+view_counter = ViewCountBuffer(flush_interval=settings.VIEW_COUNT_FLUSH_INTERVAL
+                            , flush_size=settings.VIEW_COUNT_FLUSH_SIZE)